@@ -0,0 +1,51 @@
+""" Measures the memory used per buffered keen.client.Event.
+
+Compares the current Event with the previous dict-based layout and prints
+the bytes allocated per event, excluding the event bodies themselves, which
+both layouts share. Requires Python 3 (tracemalloc). Run it from the
+repository root:
+
+    PYTHONPATH=. python benchmarks/event_memory.py [event_count]
+"""
+
+import datetime
+import sys
+import tracemalloc
+
+from keen.client import Event
+
+
+class DictEvent(object):
+    """ The previous Event layout: a regular class with a per-instance __dict__. """
+
+    def __init__(self, project_id, event_collection, event_body, timestamp=None):
+        super(DictEvent, self).__init__()
+        self.project_id = project_id
+        self.event_collection = event_collection
+        self.event_body = event_body
+        self.timestamp = timestamp
+
+
+def bytes_per_event(event_class, count, body, timestamp):
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    events = [event_class("project", "clicks", body, timestamp=timestamp) for _ in range(count)]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    allocated = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    del events
+    return float(allocated) / count
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    body = {"user": {"id": 1}, "page": "/home"}
+    timestamp = datetime.datetime.now(datetime.timezone.utc)
+
+    print("{0} events".format(count))
+    print("before (__dict__): {0:.1f} bytes/event".format(bytes_per_event(DictEvent, count, body, timestamp)))
+    print("after (__slots__): {0:.1f} bytes/event".format(bytes_per_event(Event, count, body, timestamp)))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,8 @@
 import os
+import threading
+import weakref
+
+from keen import forking
 from keen.client import KeenClient
 from keen.exceptions import InvalidEnvironmentError
 
@@ -11,26 +15,148 @@ read_key = None
 master_key = None
 base_url = None
 
+# The module-level settings each environment variable fills in when unset.
+_ENVIRONMENT_VARIABLES = (
+    ("project_id", "KEEN_PROJECT_ID"),
+    ("write_key", "KEEN_WRITE_KEY"),
+    ("read_key", "KEEN_READ_KEY"),
+    ("master_key", "KEEN_MASTER_KEY"),
+    ("base_url", "KEEN_BASE_URL"),
+)
+
+_client_lock = threading.Lock()
+_client_options = {}
+_per_thread = False
+_local = threading.local()
+_thread_clients = weakref.WeakSet()
+# The settings read from the environment rather than set in code.
+_from_environment = set()
+
+
+def configure(project_id=None, write_key=None, read_key=None, master_key=None, base_url=None, per_thread=False,
+              **client_options):
+    """ Configures the client behind the module-level functions, like
+    keen.add_event and keen.count. The current client is closed, flushing
+    its events, and the new one is created on first use. Settings left out
+    are read from the KEEN_* environment variables then.
+
+    :param project_id: the Keen IO project ID
+    :param write_key: a Keen IO Scoped Key for Writes
+    :param read_key: a Keen IO Scoped Key for Reads
+    :param master_key: a Keen IO Master API Key
+    :param base_url: optional, set this to override where API requests
+    are sent
+    :param per_thread: optional, give every thread a client of its own, for
+    persistence strategies or sessions that can't be shared between threads
+    :param client_options: other KeenClient options, e.g. persistence_strategy
+    """
+    global _client_options, _per_thread
+    settings = dict(project_id=project_id, write_key=write_key, read_key=read_key, master_key=master_key,
+                    base_url=base_url)
+    with _client_lock:
+        clients = _detach_clients()
+        globals().update(settings)
+        _client_options = dict(client_options)
+        _per_thread = per_thread
+    _close(clients)
+
+
+def reset():
+    """ Closes the module-level client, flushing its events, and forgets
+    its configuration. The next module-level call configures a new client
+    from the environment.
+    """
+    global _client_options, _per_thread
+    with _client_lock:
+        clients = _detach_clients()
+        for name, _ in _ENVIRONMENT_VARIABLES:
+            globals()[name] = None
+        _client_options = {}
+        _per_thread = False
+    _close(clients)
+
+
 def _initialize_client_from_environment():
     ''' Initialize a KeenClient instance using environment variables. '''
-    global _client, project_id, write_key, read_key, master_key, base_url
+    global _client
 
     if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = _create_client()
+    return _client
+
+
+def _get_client():
+    forking.check()
+    if not _per_thread:
+        return _initialize_client_from_environment()
+    client = getattr(_local, "client", None)
+    if client is None:
+        with _client_lock:
+            client = _local.client = _create_client()
+            _thread_clients.add(client)
+    return client
+
+
+def _create_client():
+    # Called with _client_lock held.
+    settings = globals()
+    for name, variable in _ENVIRONMENT_VARIABLES:
         # check environment for project ID and keys
-        project_id = project_id or os.environ.get("KEEN_PROJECT_ID")
-        write_key = write_key or os.environ.get("KEEN_WRITE_KEY")
-        read_key = read_key or os.environ.get("KEEN_READ_KEY")
-        master_key = master_key or os.environ.get("KEEN_MASTER_KEY")
-        base_url = base_url or os.environ.get("KEEN_BASE_URL")
+        if not settings[name] and os.environ.get(variable):
+            settings[name] = os.environ[variable]
+            _from_environment.add(name)
+
+    if not project_id:
+        raise InvalidEnvironmentError("Please set the KEEN_PROJECT_ID environment variable or set keen.project_id!")
+
+    return KeenClient(project_id,
+                      write_key=write_key,
+                      read_key=read_key,
+                      master_key=master_key,
+                      base_url=base_url,
+                      **_client_options)
+
+
+def _detach_clients():
+    # Called with _client_lock held; returns the clients to close.
+    global _client, _local
+    clients = list(_thread_clients)
+    if _client is not None:
+        clients.append(_client)
+    _client = None
+    _local = threading.local()
+    _thread_clients.clear()
+    _from_environment.clear()
+    return clients
+
+
+def _close(clients):
+    for client in clients:
+        client.close()
+
 
-        if not project_id:
-            raise InvalidEnvironmentError("Please set the KEEN_PROJECT_ID environment variable or set keen.project_id!")
+class _ForkHandler(object):
 
-        _client = KeenClient(project_id,
-                             write_key=write_key,
-                             read_key=read_key,
-                             master_key=master_key,
-                             base_url=base_url)
+    def _after_fork(self):
+        global _client, _client_lock, _local
+        # A thread of the parent may have held the lock, and the per-thread
+        # clients belong to threads that don't exist here. Settings read
+        # from the environment are read again, since a worker's environment
+        # may differ from its master's.
+        _client_lock = threading.Lock()
+        _local = threading.local()
+        _thread_clients.clear()
+        if _from_environment:
+            for name in _from_environment:
+                globals()[name] = None
+            _from_environment.clear()
+            _client = None
+
+
+_fork_handler = _ForkHandler()
+forking.register(_fork_handler)
 
 
 def add_event(event_collection, body, timestamp=None):
@@ -45,8 +171,7 @@ def add_event(event_collection, body, timestamp=None):
     :param body: dict, the body of the event to insert the event to
     :param timestamp: datetime, optional, the timestamp of the event
     """
-    _initialize_client_from_environment()
-    _client.add_event(event_collection, body, timestamp=timestamp)
+    _get_client().add_event(event_collection, body, timestamp=timestamp)
 
 
 def add_events(events):
@@ -58,8 +183,54 @@ def add_events(events):
 
     :param events: dictionary of events
     """
-    _initialize_client_from_environment()
-    return _client.add_events(events)
+    return _get_client().add_events(events)
+
+
+def add_events_stream(events, batch_size=500, max_in_flight=4, adaptive=None):
+    """ Adds events from an iterator or generator with bounded memory.
+
+    :param events: an iterable of (collection, event) pairs, or a dict
+    mapping collection names to iterables of events
+    :param batch_size: optional, the maximum number of events per request
+    :param max_in_flight: optional, the maximum number of concurrent requests
+    :param adaptive: optional, True or a keen.batching.AdaptiveBatching to
+    adjust both to the observed latency and errors
+    """
+    return _get_client().add_events_stream(events, batch_size=batch_size, max_in_flight=max_in_flight,
+                                           adaptive=adaptive)
+
+
+def add_events_chunked(events, chunk_size=64 * 1024):
+    """ Adds a batch of events in a single request whose body is streamed.
+
+    :param events: dict mapping collection names to iterables (e.g.
+    generators) of events, each a dict or a JSON bytes/str
+    :param chunk_size: optional, the size of the body pieces in bytes
+    """
+    return _get_client().add_events_chunked(events, chunk_size=chunk_size)
+
+
+def add_events_columnar(event_collection, columns, batch_size=5000):
+    """ Adds a batch of events given as columns instead of a list of dicts.
+
+    :param event_collection: the name of the collection to insert the
+    events to
+    :param columns: dict mapping property names to equally long lists,
+    tuples, NumPy arrays or pandas Series
+    :param batch_size: optional, the maximum number of events per request
+    """
+    return _get_client().add_events_columnar(event_collection, columns, batch_size=batch_size)
+
+
+def add_dataframe(event_collection, dataframe, batch_size=5000):
+    """ Adds every row of a pandas DataFrame as an event.
+
+    :param event_collection: the name of the collection to insert the
+    events to
+    :param dataframe: a pandas DataFrame
+    :param batch_size: optional, the maximum number of events per request
+    """
+    return _get_client().add_dataframe(event_collection, dataframe, batch_size=batch_size)
 
 
 def generate_image_beacon(event_collection, body, timestamp=None):
@@ -70,8 +241,7 @@ def generate_image_beacon(event_collection, body, timestamp=None):
     :param body: dict, the body of the event to insert the event to
     :param timestamp: datetime, optional, the timestamp of the event
     """
-    _initialize_client_from_environment()
-    return _client.generate_image_beacon(event_collection, body, timestamp=timestamp)
+    return _get_client().generate_image_beacon(event_collection, body, timestamp=timestamp)
 
 
 def count(event_collection, timeframe=None, timezone=None, interval=None, filters=None, group_by=None, order_by=None,
@@ -100,10 +270,9 @@ def count(event_collection, timeframe=None, timezone=None, interval=None, filter
     willing to trade for increased query performance, in seconds
 
     """
-    _initialize_client_from_environment()
-    return _client.count(event_collection=event_collection, timeframe=timeframe, timezone=timezone,
-                         interval=interval, filters=filters, group_by=group_by, order_by=order_by,
-                         max_age=max_age, limit=limit)
+    return _get_client().count(event_collection=event_collection, timeframe=timeframe, timezone=timezone,
+                               interval=interval, filters=filters, group_by=group_by, order_by=order_by,
+                               max_age=max_age, limit=limit)
 
 
 def sum(event_collection, target_property, timeframe=None, timezone=None, interval=None, filters=None,
@@ -133,10 +302,9 @@ def sum(event_collection, target_property, timeframe=None, timezone=None, interv
     willing to trade for increased query performance, in seconds
 
     """
-    _initialize_client_from_environment()
-    return _client.sum(event_collection=event_collection, timeframe=timeframe, timezone=timezone,
-                       interval=interval, filters=filters, group_by=group_by, order_by=order_by,
-                       target_property=target_property, max_age=max_age, limit=limit)
+    return _get_client().sum(event_collection=event_collection, timeframe=timeframe, timezone=timezone,
+                             interval=interval, filters=filters, group_by=group_by, order_by=order_by,
+                             target_property=target_property, max_age=max_age, limit=limit)
 
 
 def minimum(event_collection, target_property, timeframe=None, timezone=None, interval=None, filters=None,
@@ -166,10 +334,9 @@ def minimum(event_collection, target_property, timeframe=None, timezone=None, in
     willing to trade for increased query performance, in seconds
 
     """
-    _initialize_client_from_environment()
-    return _client.minimum(event_collection=event_collection, timeframe=timeframe, timezone=timezone,
-                           interval=interval, filters=filters, group_by=group_by, order_by=order_by,
-                           target_property=target_property, max_age=max_age, limit=limit)
+    return _get_client().minimum(event_collection=event_collection, timeframe=timeframe, timezone=timezone,
+                                 interval=interval, filters=filters, group_by=group_by, order_by=order_by,
+                                 target_property=target_property, max_age=max_age, limit=limit)
 
 
 def maximum(event_collection, target_property, timeframe=None, timezone=None, interval=None, filters=None,
@@ -199,10 +366,9 @@ def maximum(event_collection, target_property, timeframe=None, timezone=None, in
     willing to trade for increased query performance, in seconds
 
     """
-    _initialize_client_from_environment()
-    return _client.maximum(event_collection=event_collection, timeframe=timeframe, timezone=timezone,
-                           interval=interval, filters=filters, group_by=group_by, order_by=order_by,
-                           target_property=target_property, max_age=max_age, limit=limit)
+    return _get_client().maximum(event_collection=event_collection, timeframe=timeframe, timezone=timezone,
+                                 interval=interval, filters=filters, group_by=group_by, order_by=order_by,
+                                 target_property=target_property, max_age=max_age, limit=limit)
 
 
 def average(event_collection, target_property, timeframe=None, timezone=None, interval=None, filters=None,
@@ -232,10 +398,9 @@ def average(event_collection, target_property, timeframe=None, timezone=None, in
     willing to trade for increased query performance, in seconds
 
     """
-    _initialize_client_from_environment()
-    return _client.average(event_collection=event_collection, timeframe=timeframe, timezone=timezone,
-                           interval=interval, filters=filters, group_by=group_by, order_by=order_by,
-                           target_property=target_property, max_age=max_age, limit=limit)
+    return _get_client().average(event_collection=event_collection, timeframe=timeframe, timezone=timezone,
+                                 interval=interval, filters=filters, group_by=group_by, order_by=order_by,
+                                 target_property=target_property, max_age=max_age, limit=limit)
 
 
 def median(event_collection, target_property, timeframe=None, timezone=None, interval=None, filters=None,
@@ -265,10 +430,9 @@ def median(event_collection, target_property, timeframe=None, timezone=None, int
     willing to trade for increased query performance, in seconds
 
     """
-    _initialize_client_from_environment()
-    return _client.median(event_collection=event_collection, timeframe=timeframe, timezone=timezone,
-                          interval=interval, filters=filters, group_by=group_by, order_by=order_by,
-                          target_property=target_property, max_age=max_age)
+    return _get_client().median(event_collection=event_collection, timeframe=timeframe, timezone=timezone,
+                                interval=interval, filters=filters, group_by=group_by, order_by=order_by,
+                                target_property=target_property, max_age=max_age)
 
 
 def percentile(event_collection, target_property, percentile, timeframe=None, timezone=None, interval=None,
@@ -300,8 +464,7 @@ def percentile(event_collection, target_property, percentile, timeframe=None, ti
     willing to trade for increased query performance, in seconds
 
     """
-    _initialize_client_from_environment()
-    return _client.percentile(
+    return _get_client().percentile(
         event_collection=event_collection,
         timeframe=timeframe,
         percentile=percentile,
@@ -343,10 +506,9 @@ def count_unique(event_collection, target_property, timeframe=None, timezone=Non
     willing to trade for increased query performance, in seconds
 
     """
-    _initialize_client_from_environment()
-    return _client.count_unique(event_collection=event_collection, timeframe=timeframe, timezone=timezone,
-                                interval=interval, filters=filters, group_by=group_by, order_by=order_by,
-                                target_property=target_property, max_age=max_age, limit=limit)
+    return _get_client().count_unique(event_collection=event_collection, timeframe=timeframe, timezone=timezone,
+                                      interval=interval, filters=filters, group_by=group_by, order_by=order_by,
+                                      target_property=target_property, max_age=max_age, limit=limit)
 
 
 def select_unique(event_collection, target_property, timeframe=None, timezone=None, interval=None,
@@ -376,10 +538,9 @@ def select_unique(event_collection, target_property, timeframe=None, timezone=No
     willing to trade for increased query performance, in seconds
 
     """
-    _initialize_client_from_environment()
-    return _client.select_unique(event_collection=event_collection, timeframe=timeframe, timezone=timezone,
-                                 interval=interval, filters=filters, group_by=group_by, order_by=order_by,
-                                 target_property=target_property, max_age=max_age, limit=limit)
+    return _get_client().select_unique(event_collection=event_collection, timeframe=timeframe, timezone=timezone,
+                                       interval=interval, filters=filters, group_by=group_by, order_by=order_by,
+                                       target_property=target_property, max_age=max_age, limit=limit)
 
 
 def extraction(event_collection, timeframe=None, timezone=None, filters=None, latest=None, email=None,
@@ -401,9 +562,8 @@ def extraction(event_collection, timeframe=None, timezone=None, filters=None, la
     :param property_names: string or list of strings, used to limit the properties returned
 
     """
-    _initialize_client_from_environment()
-    return _client.extraction(event_collection=event_collection, timeframe=timeframe, timezone=timezone,
-                              filters=filters, latest=latest, email=email, property_names=property_names)
+    return _get_client().extraction(event_collection=event_collection, timeframe=timeframe, timezone=timezone,
+                                    filters=filters, latest=latest, email=email, property_names=property_names)
 
 
 def funnel(*args, **kwargs):
@@ -422,8 +582,7 @@ def funnel(*args, **kwargs):
     willing to trade for increased query performance, in seconds
 
     """
-    _initialize_client_from_environment()
-    return _client.funnel(*args, **kwargs)
+    return _get_client().funnel(*args, **kwargs)
 
 
 def multi_analysis(event_collection, analyses, timeframe=None, interval=None, timezone=None,
@@ -455,11 +614,10 @@ def multi_analysis(event_collection, analyses, timeframe=None, interval=None, ti
     willing to trade for increased query performance, in seconds
 
     """
-    _initialize_client_from_environment()
-    return _client.multi_analysis(event_collection=event_collection, timeframe=timeframe,
-                                  interval=interval, timezone=timezone, filters=filters,
-                                  group_by=group_by, order_by=order_by, analyses=analyses,
-                                  max_age=max_age, limit=limit)
+    return _get_client().multi_analysis(event_collection=event_collection, timeframe=timeframe,
+                                        interval=interval, timezone=timezone, filters=filters,
+                                        group_by=group_by, order_by=order_by, analyses=analyses,
+                                        max_age=max_age, limit=limit)
 
 
 def delete_events(*args, **kwargs):
@@ -476,8 +634,7 @@ def delete_events(*args, **kwargs):
     example: [{"property_name":"device", "operator":"eq", "property_value":"iPhone"}]
 
     """
-    _initialize_client_from_environment()
-    return _client.delete_events(*args, **kwargs)
+    return _get_client().delete_events(*args, **kwargs)
 
 
 def get_collection(*args, **kwargs):
@@ -486,16 +643,14 @@ def get_collection(*args, **kwargs):
     :param event_collection: string, the event collection from which schema is to be returned,
     if left blank will return schema for all collections
     """
-    _initialize_client_from_environment()
-    return _client.get_collection(*args, **kwargs)
+    return _get_client().get_collection(*args, **kwargs)
 
 
 def get_all_collections():
     """ Returns event collection schema for all events
 
     """
-    _initialize_client_from_environment()
-    return _client.get_all_collections()
+    return _get_client().get_all_collections()
 
 def create_access_key(name, is_active=True, permitted=[], options={}):
     """ Creates a new access key. A master key must be set first.
@@ -508,16 +663,14 @@ def create_access_key(name, is_active=True, permitted=[], options={}):
     :param options: dictionary containing more details about the key's permitted and restricted
                     functionality
     """
-    _initialize_client_from_environment()
-    return _client.create_access_key(name=name, is_active=is_active,
-                                     permitted=permitted, options=options)
+    return _get_client().create_access_key(name=name, is_active=is_active,
+                                           permitted=permitted, options=options)
 
 def list_access_keys():
     """
     Returns a list of all access keys in this project. A master key must be set first.
     """
-    _initialize_client_from_environment()
-    return _client.list_access_keys()
+    return _get_client().list_access_keys()
 
 def get_access_key(key):
     """
@@ -525,8 +678,7 @@ def get_access_key(key):
 
     :param key: the 'key' value of the access key to retreive data from
     """
-    _initialize_client_from_environment()
-    return _client.get_access_key(key)
+    return _get_client().get_access_key(key)
 
 def update_access_key_name(key, name):
     """
@@ -535,8 +687,7 @@ def update_access_key_name(key, name):
     :param key: the 'key' value of the access key to change the name of
     :param name: the new name to give this access key
     """
-    _initialize_client_from_environment()
-    return _client.update_access_key_name(key, name)
+    return _get_client().update_access_key_name(key, name)
 
 def add_access_key_permissions(key, permissions):
     """
@@ -546,8 +697,7 @@ def add_access_key_permissions(key, permissions):
     :param key: the 'key' value of the access key to add permissions to
     :param permissions: the new permissions to add to the existing list of permissions
     """
-    _initialize_client_from_environment()
-    return _client.add_access_key_permissions(key, permissions)
+    return _get_client().add_access_key_permissions(key, permissions)
 
 def remove_access_key_permissions(key, permissions):
     """
@@ -560,8 +710,7 @@ def remove_access_key_permissions(key, permissions):
     :param key: the 'key' value of the access key to remove some permissions from
     :param permissions: the permissions you wish to remove from this access key
     """
-    _initialize_client_from_environment()
-    return _client.remove_access_key_permissions(key, permissions)
+    return _get_client().remove_access_key_permissions(key, permissions)
 
 def update_access_key_permissions(key, permissions):
     """
@@ -573,8 +722,7 @@ def update_access_key_permissions(key, permissions):
     :param key: the 'key' value of the access key to change the permissions of
     :param permissions: the new list of permissions for this key
     """
-    _initialize_client_from_environment()
-    return _client.update_access_key_permissions(key, permissions)
+    return _get_client().update_access_key_permissions(key, permissions)
 
 def update_access_key_options(key, options):
     """
@@ -584,8 +732,7 @@ def update_access_key_options(key, options):
     :param key: the 'key' value of the access key to change the options of
     :param options: the new dictionary of options for this key
     """
-    _initialize_client_from_environment()
-    return _client.update_access_key_options(key, options)
+    return _get_client().update_access_key_options(key, options)
 
 def update_access_key_full(key, name, is_active, permitted, options):
     """
@@ -598,8 +745,7 @@ def update_access_key_full(key, name, is_active, permitted, options):
     :param permitted: the new list of permissions desired for this access key
     :param options: the new dictionary of options for this access key
     """
-    _initialize_client_from_environment()
-    return _client.update_access_key_full(key, name, is_active, permitted, options)
+    return _get_client().update_access_key_full(key, name, is_active, permitted, options)
 
 def revoke_access_key(key):
     """
@@ -607,8 +753,7 @@ def revoke_access_key(key):
 
     :param key: the 'key' value of the access key to revoke
     """
-    _initialize_client_from_environment()
-    return _client.revoke_access_key(key)
+    return _get_client().revoke_access_key(key)
 
 def unrevoke_access_key(key):
     """
@@ -616,8 +761,7 @@ def unrevoke_access_key(key):
 
     :param key: the 'key' value of the access key to re-enable (unrevoke)
     """
-    _initialize_client_from_environment()
-    return _client.unrevoke_access_key(key)
+    return _get_client().unrevoke_access_key(key)
 
 
 def delete_access_key(key):
@@ -626,5 +770,4 @@ def delete_access_key(key):
 
     :param key: the 'key' value of the access key to delete
     """
-    _initialize_client_from_environment()
-    return _client.delete_access_key(key)
+    return _get_client().delete_access_key(key)
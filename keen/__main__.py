@@ -0,0 +1,5 @@
+import sys
+
+from keen.cli import main
+
+sys.exit(main())
@@ -0,0 +1,214 @@
+""" Client-side pre-aggregation of counter and metric events, used by
+AggregatingPersistenceStrategy.
+
+Events of an aggregated collection that have the same dimension values and
+fall into the same time bucket are collapsed into one event with a count
+and the sum, min and max of each metric property, e.g. a thousand
+{"endpoint": "/a", "status": 200, "duration": ...} events in a minute become
+
+    {"endpoint": "/a", "status": 200, "count": 1000,
+     "duration": {"sum": 5120.5, "min": 1.2, "max": 80.1},
+     "keen": {"timestamp": "<start of the minute>"}}
+
+Query them with sum("count") instead of count(), and sum/min/max of
+"duration.sum", "duration.min" and "duration.max".
+"""
+
+import calendar
+import collections
+import json
+import numbers
+import re
+import threading
+import time
+
+import six
+
+DEFAULT_MAX_KEYS = 10000
+
+# The ISO 8601 timestamps Keen accepts in keen.timestamp.
+_ISO_TIMESTAMP = re.compile(r"(\d{4})-(\d\d)-(\d\d)[T ](\d\d):(\d\d):(\d\d)(\.\d+)?(Z|[+-]\d\d:?\d\d)?$")
+
+
+class Aggregation(object):
+    """ How the events of a collection are aggregated. """
+
+    def __init__(self, dimensions, metrics=(), interval=60, count_property="count"):
+        """ Initializes an Aggregation.
+
+        :param dimensions: the names of the properties whose values identify
+        an aggregate, nested properties separated by dots
+        :param metrics: the names of the numeric properties to keep the sum,
+        min and max of
+        :param interval: the length of the time buckets in seconds
+        :param count_property: the name of the property of the event count
+        """
+        super(Aggregation, self).__init__()
+        if interval <= 0:
+            raise ValueError("The aggregation interval must be positive.")
+        self.dimensions = [dimension.split(".") for dimension in dimensions]
+        self.metrics = [(metric, metric.split(".")) for metric in metrics]
+        self.interval = interval
+        self.count_property = count_property
+
+
+class Aggregator(object):
+    """
+    The open aggregates of all aggregated collections, at most max_keys of
+    them. When a new aggregate would exceed max_keys, the least recently
+    updated one is emitted early; a later event with the same dimensions
+    starts a new aggregate, so sums over the emitted events stay exact.
+    """
+
+    def __init__(self, aggregations, max_keys=DEFAULT_MAX_KEYS, grace=5.0):
+        """ Initializes an Aggregator.
+
+        :param aggregations: dict mapping collection names to Aggregations
+        :param max_keys: the most aggregates kept in memory
+        :param grace: seconds after the end of a bucket that late events
+        still join its aggregates
+        """
+        super(Aggregator, self).__init__()
+        self.aggregations = dict(aggregations)
+        self.max_keys = max_keys
+        self.grace = grace
+        self.aggregated = 0
+        self.emitted = 0
+        self.evicted = 0
+        self._reset()
+
+    def _reset(self):
+        # (collection, bucket, dimension keys) -> [dimension values, count, {metric: [sum, min, max]}],
+        # least recently updated first
+        self._aggregates = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._aggregates)
+
+    def add(self, collection, event, timestamp):
+        """ Adds an event to its aggregate.
+
+        :param collection: an aggregated collection
+        :param event: the event body dict
+        :param timestamp: the time of the event in seconds since the epoch
+        :returns: the events evicted to stay within max_keys, as a list of
+        (collection, event) tuples
+        """
+        aggregation = self.aggregations[collection]
+        bucket = timestamp - timestamp % aggregation.interval
+        values = [_get(event, path) for path in aggregation.dimensions]
+        key = (collection, bucket, tuple(_hashable(value) for value in values))
+        evicted = []
+        with self._lock:
+            self.aggregated += 1
+            aggregate = self._aggregates.pop(key, None)
+            if aggregate is None:
+                aggregate = [values, 0, {}]
+                while len(self._aggregates) >= self.max_keys:
+                    evicted.append(self._emit(*self._aggregates.popitem(last=False)))
+                    self.evicted += 1
+            self._aggregates[key] = aggregate
+            aggregate[1] += 1
+            metrics = aggregate[2]
+            for name, path in aggregation.metrics:
+                value = _get(event, path)
+                if not isinstance(value, numbers.Number) or isinstance(value, bool):
+                    continue
+                stats = metrics.get(name)
+                if stats is None:
+                    metrics[name] = [value, value, value]
+                else:
+                    stats[0] += value
+                    if value < stats[1]:
+                        stats[1] = value
+                    if value > stats[2]:
+                        stats[2] = value
+        return evicted
+
+    def pop_closed(self, now):
+        """ Removes and returns the aggregates of buckets that ended more
+        than grace seconds before now, as a list of (collection, event)
+        tuples.
+        """
+        with self._lock:
+            closed = [key for key in self._aggregates
+                      if key[1] + self.aggregations[key[0]].interval + self.grace <= now]
+            return [self._emit(key, self._aggregates.pop(key)) for key in closed]
+
+    def pop_all(self):
+        """ Removes and returns every aggregate as a list of (collection,
+        event) tuples.
+        """
+        with self._lock:
+            aggregates, self._aggregates = self._aggregates, collections.OrderedDict()
+            return [self._emit(key, aggregate) for key, aggregate in six.iteritems(aggregates)]
+
+    def _emit(self, key, aggregate):
+        collection, bucket, _ = key
+        values, count, metrics = aggregate
+        aggregation = self.aggregations[collection]
+        event = {}
+        for path, value in zip(aggregation.dimensions, values):
+            if value is not None:
+                _set(event, path, value)
+        event[aggregation.count_property] = count
+        for name, path in aggregation.metrics:
+            stats = metrics.get(name)
+            if stats is not None:
+                _set(event, path, {"sum": stats[0], "min": stats[1], "max": stats[2]})
+        event["keen"] = {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(bucket))}
+        self.emitted += 1
+        return collection, event
+
+
+def epoch_seconds(timestamp):
+    """ Converts a datetime, naive ones taken as UTC, to seconds since the
+    epoch.
+    """
+    return calendar.timegm(timestamp.utctimetuple()) + timestamp.microsecond / 1e6
+
+
+def event_time(event, default):
+    """ Returns the time of an event from its keen.timestamp, in seconds
+    since the epoch. Timestamps without an offset are taken as UTC.
+
+    :param event: the event body dict
+    :param default: returned when the event has no timestamp that parses
+    """
+    timestamp = _get(event, ("keen", "timestamp"))
+    if not isinstance(timestamp, six.string_types):
+        return default
+    match = _ISO_TIMESTAMP.match(timestamp)
+    if match is None:
+        return default
+    year, month, day, hour, minute, second, fraction, offset = match.groups()
+    seconds = calendar.timegm((int(year), int(month), int(day), int(hour), int(minute), int(second), 0, 0, 0))
+    if fraction:
+        seconds += float(fraction)
+    if offset and offset != "Z":
+        sign = -1 if offset[0] == "+" else 1
+        digits = offset[1:].replace(":", "")
+        seconds += sign * (int(digits[:2]) * 3600 + int(digits[2:]) * 60)
+    return seconds
+
+
+def _get(event, path):
+    value = event
+    for name in path:
+        if not isinstance(value, dict):
+            return None
+        value = value.get(name)
+    return value
+
+
+def _set(event, path, value):
+    for name in path[:-1]:
+        event = event.setdefault(name, {})
+    event[path[-1]] = value
+
+
+def _hashable(value):
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, sort_keys=True)
+    return value
@@ -2,13 +2,18 @@
 import json
 import ssl
 
+# six
+import six
+
 # requests
 import requests
 from requests.adapters import HTTPAdapter
 from requests.packages.urllib3.poolmanager import PoolManager
 
 # keen
-from keen import direction, exceptions, utilities
+from keen import direction, exceptions, forking, payloads, utilities
+from keen.compression import (CompressionStats, DEFAULT_COMPRESSION_THRESHOLD, encode_body,
+                              iter_encoded_body, validate_compression)
 from keen.utilities import KeenKeys, requires_key
 
 # json
@@ -57,7 +62,8 @@ class KeenApi(object):
     # __init__ create keenapi object whenever KeenApi class is invoked
     def __init__(self, project_id, write_key=None, read_key=None,
                  base_url=None, api_version=None, get_timeout=None, post_timeout=None,
-                 master_key=None):
+                 master_key=None, compression=None, compression_threshold=DEFAULT_COMPRESSION_THRESHOLD,
+                 deduplicator=None, session=None):
         """
         Initializes a KeenApi object
 
@@ -71,6 +77,15 @@ class KeenApi(object):
         :param get_timeout: optional, the timeout on GET requests
         :param post_timeout: optional, the timeout on POST requests
         :param master_key: a Keen IO Master API Key, needed for deletes
+        :param compression: optional, "gzip" or "zstd" to compress event upload
+        bodies
+        :param compression_threshold: optional, bodies smaller than this many
+        bytes are sent uncompressed
+        :param deduplicator: optional, a keen.dedup.Deduplicator to skip events
+        whose keen.id was already acknowledged
+        :param session: optional, a requests.Session shared with other KeenApi
+        objects, e.g. by a keen.pool.KeenClientPool, whose owner replaces it
+        after a fork
         """
         # super? recreates the object with values passed into KeenApi
         super(KeenApi, self).__init__()
@@ -84,12 +99,27 @@ class KeenApi(object):
             self.api_version = api_version
         self.get_timeout = get_timeout
         self.post_timeout = post_timeout
-        self.session = self._create_session()
+        validate_compression(compression)
+        self.compression = compression
+        self.compression_threshold = compression_threshold
+        self.compression_stats = CompressionStats()
+        self.deduplicator = deduplicator
+        self._owns_session = session is None
+        self.session = self._create_session() if session is None else session
+        forking.register(self)
+
+    def _after_fork(self):
+        # The inherited session's pooled sockets are shared with the parent.
+        # They're dropped rather than closed, which would end the parent's
+        # TLS sessions too.
+        if self._owns_session:
+            self.session = self._create_session()
 
     def fulfill(self, method, *args, **kwargs):
 
         """ Fulfill an HTTP request to Keen's API. """
 
+        forking.check()
         return getattr(self.session, method)(*args, **kwargs)
 
     @requires_key(KeenKeys.WRITE)
@@ -103,28 +133,117 @@ class KeenApi(object):
         url = "{0}/{1}/projects/{2}/events/{3}".format(self.base_url, self.api_version,
                                                        self.project_id,
                                                        event.event_collection)
+        event_id = None
+        if self.deduplicator is not None:
+            event_id = self.deduplicator.event_id(event.event_body)
+            if event_id is not None and self.deduplicator.seen(event_id):
+                self.deduplicator.suppressed += 1
+                return
         headers = utilities.headers(self.write_key)
-        payload = event.to_json()
+        payload = self._encode_body(event.to_json(), headers)
         response = self.fulfill(HTTPMethods.POST, url, data=payload, headers=headers, timeout=self.post_timeout)
         self._error_handling(response)
+        if event_id is not None:
+            self.deduplicator.acknowledge([event_id])
 
     @requires_key(KeenKeys.WRITE)
     def post_events(self, events):
 
         """
-        Posts a single event to the Keen IO API. The write key must be set first.
+        Posts a batch of events to the Keen IO API. The write key must be set first.
+
+        Events that are already serialized (JSON bytes or str) are spliced into
+        the request body as they are, without being decoded and re-encoded.
+
+        :param events: dict mapping collection names to lists of events, each
+        a dict or a JSON bytes/str
+        """
+
+        if self.deduplicator is not None:
+            return self._post_events_deduplicated(events)
+        return self._post_events(events)
+
+    def _post_events_deduplicated(self, events):
+        events, ids = self.deduplicator.filter(events)
+        if not any(events.values()):
+            return dict((collection, []) for collection in events)
+        result = self._post_events(events)
+        self.deduplicator.acknowledge_result(ids, result)
+        return result
+
+    def _post_events(self, events):
+        if not payloads.contains_serialized(events):
+            return self.post_events_payload(json.dumps(events))
+
+        builder = payloads.BatchPayloadBuilder()
+        builder.extend(events)
+        return self.post_events_payload(builder.build())
+
+    @requires_key(KeenKeys.WRITE)
+    def post_events_payload(self, payload):
 
-        :param events: an Event to upload
+        """
+        Posts an already serialized batch of events to the Keen IO API. The write key must be set first.
+
+        :param payload: JSON str, bytes or a buffer of the form {"collection": [event, ...], ...}
         """
 
         url = "{0}/{1}/projects/{2}/events".format(self.base_url, self.api_version,
                                                    self.project_id)
         headers = utilities.headers(self.write_key)
-        payload = json.dumps(events)
+        payload = self._encode_body(payload, headers)
         response = self.fulfill(HTTPMethods.POST, url, data=payload, headers=headers, timeout=self.post_timeout)
         self._error_handling(response)
         return self._get_response_json(response)
 
+    @requires_key(KeenKeys.WRITE)
+    def post_events_stream(self, events, chunk_size=payloads.DEFAULT_CHUNK_SIZE):
+
+        """
+        Posts a batch of events to the Keen IO API as a chunked request body
+        that is produced while it is sent, so only about one chunk of the body
+        is in memory at a time. The write key must be set first.
+
+        :param events: dict mapping collection names to iterables (e.g.
+        generators) of events, each a dict or a JSON bytes/str
+        :param chunk_size: optional, the size of the body pieces in bytes
+        """
+
+        url = "{0}/{1}/projects/{2}/events".format(self.base_url, self.api_version,
+                                                   self.project_id)
+        headers = utilities.headers(self.write_key)
+        if self.compression:
+            headers["Content-Encoding"] = self.compression
+        ids = None
+        if self.deduplicator is not None:
+            # Filtered as the body is produced; the ids are collected on the way.
+            ids = dict((collection, []) for collection in events)
+            events = dict((collection, self.deduplicator.filter_iterable(collection_events, ids[collection]))
+                          for collection, collection_events in six.iteritems(events))
+        body = iter_encoded_body(payloads.iter_payload_chunks(events, chunk_size), self.compression,
+                                 self.compression_stats)
+        response = self.fulfill(HTTPMethods.POST, url, data=body, headers=headers, timeout=self.post_timeout)
+        self._error_handling(response)
+        result = self._get_response_json(response)
+        if ids is not None:
+            self.deduplicator.acknowledge_result(ids, result)
+        return result
+
+    def _encode_body(self, payload, headers):
+        """
+        Compresses an upload body according to the compression settings, setting
+        Content-Encoding in headers when it does.
+
+        :param payload: the body, str, bytes or a buffer
+        :param headers: the request headers, updated in place
+        :return: the body to send
+        """
+        body, content_encoding = encode_body(payload, self.compression, self.compression_threshold,
+                                             self.compression_stats)
+        if content_encoding:
+            headers["Content-Encoding"] = content_encoding
+        return body
+
 
     def _order_by_is_valid_or_none(self, params):
         """
@@ -504,7 +623,7 @@ class KeenApi(object):
         # making the error handling generic so if an status_code starting with 2 doesn't exist, we raise the error
         if res.status_code // 100 != 2:
             error = self._get_response_json(res)
-            raise exceptions.KeenApiError(error)
+            raise exceptions.KeenApiError(error, status_code=res.status_code)
 
     def _get_response_json(self, res):
         """
@@ -0,0 +1,314 @@
+import threading
+import time
+
+import requests
+import six
+from six.moves import queue
+
+from keen import exceptions, forking
+
+# Default number of events per post_events request.
+DEFAULT_BATCH_SIZE = 500
+
+# Default number of post_events requests running at the same time.
+DEFAULT_MAX_IN_FLIGHT = 4
+
+
+class Batch(object):
+    """
+    A bounded group of events for one post_events request.
+    """
+
+    __slots__ = ("events", "size", "tag")
+
+    def __init__(self, events, size, tag=None):
+        """ Initializes a Batch.
+
+        :param events: dict mapping collection names to lists of events
+        :param size: the total number of events in the batch
+        :param tag: optional, caller-defined data carried along with the batch
+        (e.g. the input offset it ends at)
+        """
+        self.events = events
+        self.size = size
+        self.tag = tag
+
+
+class UploadStats(object):
+    """
+    Aggregate results of a streaming upload. With adaptive batching,
+    batch_size and max_in_flight are the values chosen by the end of it.
+    """
+
+    def __init__(self):
+        self.batches = 0
+        self.failed_batches = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.last_error = None
+        self.batch_size = None
+        self.max_in_flight = None
+
+    @property
+    def events(self):
+        return self.succeeded + self.failed
+
+    def __repr__(self):
+        return "UploadStats(batches={0}, failed_batches={1}, succeeded={2}, failed={3})".format(
+            self.batches, self.failed_batches, self.succeeded, self.failed)
+
+
+def iter_event_pairs(events):
+    """ Yields (collection, event) pairs lazily.
+
+    :param events: either an iterable of (collection, event) pairs or a dict
+    mapping collection names to iterables (e.g. generators) of events
+    """
+    if isinstance(events, dict):
+        for collection, collection_events in six.iteritems(events):
+            for event in collection_events:
+                yield collection, event
+    else:
+        for pair in events:
+            yield pair
+
+
+def iter_batches(pairs, batch_size=DEFAULT_BATCH_SIZE):
+    """ Groups (collection, event) pairs into Batches of at most batch_size
+    events, pulling from pairs only as each batch is needed.
+
+    :param pairs: an iterable of (collection, event) pairs
+    :param batch_size: the maximum number of events per batch, or a callable
+    returning it, which is called as each batch is started
+    """
+    get_batch_size = batch_size if callable(batch_size) else lambda: batch_size
+    limit = get_batch_size()
+    events = {}
+    size = 0
+    for collection, event in pairs:
+        events.setdefault(collection, []).append(event)
+        size += 1
+        if size >= limit:
+            yield Batch(events, size)
+            events = {}
+            size = 0
+            limit = get_batch_size()
+    if size:
+        yield Batch(events, size)
+
+
+def count_results(response):
+    """ Counts the successful and failed events of a post_events response.
+
+    :param response: the dict returned by KeenApi.post_events
+    :returns: a tuple of (succeeded, failed)
+    """
+    succeeded = failed = 0
+    for collection_results in six.itervalues(response):
+        for result in collection_results:
+            if result.get("success"):
+                succeeded += 1
+            else:
+                failed += 1
+    return succeeded, failed
+
+
+def is_congestion(error):
+    """ Whether an upload error means the API is overloaded or unreachable
+    (HTTP 429, 5xx, timeouts, connection errors), rather than that the batch
+    itself was rejected.
+    """
+    if isinstance(error, exceptions.KeenApiError):
+        return error.status_code is not None and (error.status_code == 429 or error.status_code >= 500)
+    return isinstance(error, (requests.exceptions.Timeout, requests.exceptions.ConnectionError))
+
+
+class AdaptiveBatching(object):
+    """
+    Chooses the batch size and the number of concurrent requests of an
+    upload from how the previous requests went, within fixed bounds.
+
+    It follows AIMD (additive increase, multiplicative decrease), like TCP
+    congestion control. Every batch that succeeds within target_latency
+    grows the batch size by batch_step, and every max_in_flight such batches
+    in a row add a concurrent request. A batch that hits congestion (see
+    is_congestion()) or takes longer than target_latency halves both. Other
+    errors leave them alone. The current values are batch_size and
+    max_in_flight; latency and throughput are moving averages.
+    """
+
+    def __init__(self, batch_size=DEFAULT_BATCH_SIZE, min_batch_size=50, max_batch_size=5000,
+                 max_in_flight=DEFAULT_MAX_IN_FLIGHT, min_in_flight=1, in_flight_limit=16,
+                 target_latency=2.0, batch_step=50, decrease_factor=0.5):
+        """ Initializes an AdaptiveBatching.
+
+        :param batch_size: the initial batch size
+        :param min_batch_size: the smallest batch size to shrink to
+        :param max_batch_size: the largest batch size to grow to
+        :param max_in_flight: the initial number of concurrent requests
+        :param min_in_flight: the fewest concurrent requests to shrink to
+        :param in_flight_limit: the most concurrent requests to grow to
+        :param target_latency: seconds a request may take before it counts as
+        a sign of congestion
+        :param batch_step: events added to the batch size after each good batch
+        :param decrease_factor: what both values are multiplied by on congestion
+        """
+        super(AdaptiveBatching, self).__init__()
+        if not min_batch_size <= batch_size <= max_batch_size:
+            raise ValueError("batch_size must be between min_batch_size and max_batch_size.")
+        if not 1 <= min_in_flight <= max_in_flight <= in_flight_limit:
+            raise ValueError("max_in_flight must be between min_in_flight and in_flight_limit.")
+        self.batch_size = batch_size
+        self.min_batch_size = min_batch_size
+        self.max_batch_size = max_batch_size
+        self.max_in_flight = max_in_flight
+        self.min_in_flight = min_in_flight
+        self.in_flight_limit = in_flight_limit
+        self.target_latency = target_latency
+        self.batch_step = batch_step
+        self.decrease_factor = decrease_factor
+
+        self.latency = None
+        self.throughput = None
+        self.congestion_events = 0
+        self._good_in_a_row = 0
+        self._lock = threading.Lock()
+        forking.register(self)
+
+    def _after_fork(self):
+        # What was learned carries over to the child; only the lock is replaced.
+        self._lock = threading.Lock()
+
+    def get_batch_size(self):
+        return self.batch_size
+
+    def record(self, size, latency, error=None):
+        """ Adjusts the values after a request.
+
+        :param size: the number of events in the batch
+        :param latency: seconds the request took
+        :param error: the exception the request raised, if any
+        """
+        with self._lock:
+            self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+            if error is None and latency > 0:
+                rate = size / latency
+                self.throughput = rate if self.throughput is None else 0.8 * self.throughput + 0.2 * rate
+
+            if (error is not None and is_congestion(error)) or latency > self.target_latency:
+                self.congestion_events += 1
+                self._good_in_a_row = 0
+                self.batch_size = max(self.min_batch_size, int(self.batch_size * self.decrease_factor))
+                self.max_in_flight = max(self.min_in_flight, int(self.max_in_flight * self.decrease_factor))
+            elif error is None:
+                self.batch_size = min(self.max_batch_size, self.batch_size + self.batch_step)
+                self._good_in_a_row += 1
+                if self._good_in_a_row >= self.max_in_flight:
+                    self._good_in_a_row = 0
+                    self.max_in_flight = min(self.in_flight_limit, self.max_in_flight + 1)
+
+    def __repr__(self):
+        return "AdaptiveBatching(batch_size={0}, max_in_flight={1})".format(self.batch_size, self.max_in_flight)
+
+
+class BatchUploader(object):
+    """
+    Uploads a stream of Batches with a bounded number of requests in flight.
+
+    At most max_in_flight batches are being posted and at most max_in_flight
+    more are waiting for a free worker, so memory use doesn't depend on the
+    length of the stream.
+    """
+
+    def __init__(self, post, max_in_flight=DEFAULT_MAX_IN_FLIGHT, on_complete=None, adaptive=None):
+        """ Initializes a BatchUploader.
+
+        :param post: callable taking the events dict of a batch and returning
+        the post_events response, usually KeenApi.post_events
+        :param max_in_flight: the maximum number of concurrent requests
+        :param on_complete: optional, callable invoked from a worker thread as
+        on_complete(batch, response, error) after each batch, where exactly one
+        of response and error is None
+        :param adaptive: optional, an AdaptiveBatching that limits the number
+        of concurrent requests instead of max_in_flight, and is told how each
+        request went
+        """
+        super(BatchUploader, self).__init__()
+        if max_in_flight < 1:
+            raise ValueError("max_in_flight must be at least 1.")
+        self.post = post
+        self.max_in_flight = adaptive.in_flight_limit if adaptive is not None else max_in_flight
+        self.on_complete = on_complete
+        self.adaptive = adaptive
+        self._lock = threading.Lock()
+        self._slots = threading.Condition(threading.Lock())
+        self._active = 0
+
+    def upload(self, batches):
+        """ Posts every batch and blocks until all of them are done.
+
+        :param batches: an iterable of Batches
+        :returns: an UploadStats
+        """
+        stats = UploadStats()
+        pending = queue.Queue(maxsize=self.max_in_flight)
+        workers = [threading.Thread(target=self._work, args=(pending, stats))
+                   for _ in range(self.max_in_flight)]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+
+        try:
+            for batch in batches:
+                pending.put(batch)
+        finally:
+            for _ in workers:
+                pending.put(None)
+            for worker in workers:
+                worker.join()
+
+        if self.adaptive is not None:
+            stats.batch_size = self.adaptive.batch_size
+            stats.max_in_flight = self.adaptive.max_in_flight
+        return stats
+
+    def _work(self, pending, stats):
+        while True:
+            batch = pending.get()
+            if batch is None:
+                return
+            self._post(batch, stats)
+
+    def _post(self, batch, stats):
+        if self.adaptive is not None:
+            with self._slots:
+                while self._active >= self.adaptive.max_in_flight:
+                    self._slots.wait()
+                self._active += 1
+
+        response = error = None
+        started = time.time()
+        try:
+            response = self.post(batch.events)
+        except Exception as e:
+            error = e
+
+        if self.adaptive is not None:
+            self.adaptive.record(batch.size, time.time() - started, error)
+            with self._slots:
+                self._active -= 1
+                self._slots.notify_all()
+
+        with self._lock:
+            stats.batches += 1
+            if error is None:
+                succeeded, failed = count_results(response)
+                stats.succeeded += succeeded
+                stats.failed += failed
+            else:
+                stats.failed_batches += 1
+                stats.failed += batch.size
+                stats.last_error = error
+
+        if self.on_complete:
+            self.on_complete(batch, response, error)
@@ -0,0 +1,202 @@
+import collections
+import threading
+import time
+
+from keen import exceptions, forking
+
+
+class OverflowPolicy(object):
+
+    """ What an EventBuffer does with an event that doesn't fit. """
+
+    # wait up to block_timeout for room, then raise BufferFullError
+    BLOCK = "block"
+    # discard the event being added
+    DROP_NEWEST = "drop_newest"
+    # discard the oldest queued events until the new one fits
+    DROP_OLDEST = "drop_oldest"
+    # hand the event to the spill (e.g. a keen.spool.DiskSpool)
+    SPILL = "spill"
+
+    ALL = (BLOCK, DROP_NEWEST, DROP_OLDEST, SPILL)
+
+
+class EventBuffer(object):
+    """
+    A bounded, thread-safe FIFO of serialized events.
+
+    Every queued event is held as a (collection, data) tuple where data is the
+    encoded JSON of the event, so the buffer knows how many bytes it holds.
+    It never holds more than max_events events or max_bytes bytes; what
+    happens to an event that doesn't fit is decided by the overflow policy.
+    """
+
+    def __init__(self, max_events=10000, max_bytes=16 * 1024 * 1024, overflow_policy=OverflowPolicy.BLOCK,
+                 block_timeout=5.0, spill=None):
+        """ Initializes an EventBuffer.
+
+        :param max_events: the maximum number of queued events
+        :param max_bytes: the maximum total size of the queued events
+        :param overflow_policy: one of the OverflowPolicy values
+        :param block_timeout: seconds put() waits for room with the BLOCK
+        policy before raising BufferFullError, None to wait forever
+        :param spill: an object with a write(items) method taking a list of
+        (collection, data) tuples, required by the SPILL policy
+        """
+        super(EventBuffer, self).__init__()
+        if overflow_policy not in OverflowPolicy.ALL:
+            raise ValueError("Unknown overflow policy '{0}'.".format(overflow_policy))
+        if overflow_policy == OverflowPolicy.SPILL and spill is None:
+            raise ValueError("The spill overflow policy requires a spill.")
+        self.max_events = max_events
+        self.max_bytes = max_bytes
+        self.overflow_policy = overflow_policy
+        self.block_timeout = block_timeout
+        self.spill = spill
+
+        self._reset()
+        forking.register(self)
+
+    def _reset(self):
+        self._items = collections.deque()
+        self._condition = threading.Condition(threading.Lock())
+        self.bytes = 0
+        self.accepted = 0
+        self.dropped = 0
+        self.spilled = 0
+
+    def _after_fork(self):
+        # The queued events are the parent's to upload.
+        self._reset()
+
+    def __len__(self):
+        return len(self._items)
+
+    @property
+    def depth(self):
+        return len(self._items)
+
+    def stats(self):
+        """ Returns a snapshot of the buffer's counters as a dict. """
+        with self._condition:
+            return {
+                "depth": len(self._items),
+                "bytes": self.bytes,
+                "accepted": self.accepted,
+                "dropped": self.dropped,
+                "spilled": self.spilled,
+            }
+
+    def _fits(self, size):
+        return len(self._items) < self.max_events and self.bytes + size <= self.max_bytes
+
+    def put(self, collection, data):
+        """ Queues one serialized event, applying the overflow policy if it
+        doesn't fit.
+
+        :param collection: the name of the collection to insert the event to
+        :param data: the event as JSON bytes
+        :returns: True if the event was queued, False if it was dropped or spilled
+        """
+        size = len(data)
+        spill = None
+        with self._condition:
+            if size > self.max_bytes:
+                # Could never fit, no matter what is dropped or how long we wait.
+                if self.overflow_policy != OverflowPolicy.SPILL:
+                    self.dropped += 1
+                    return False
+                spill = [(collection, data)]
+            elif not self._fits(size):
+                if self.overflow_policy == OverflowPolicy.BLOCK:
+                    self._wait_for_room(size)
+                elif self.overflow_policy == OverflowPolicy.DROP_NEWEST:
+                    self.dropped += 1
+                    return False
+                elif self.overflow_policy == OverflowPolicy.DROP_OLDEST:
+                    while not self._fits(size):
+                        self._popleft()
+                        self.dropped += 1
+                else:
+                    spill = [(collection, data)]
+
+            if spill is None:
+                self._items.append((collection, data))
+                self.bytes += size
+                self.accepted += 1
+                self._condition.notify_all()
+                return True
+
+            self.spilled += 1
+
+        # Disk I/O happens outside the lock.
+        self.spill.write(spill)
+        return False
+
+    def _wait_for_room(self, size):
+        deadline = None if self.block_timeout is None else time.time() + self.block_timeout
+        while not self._fits(size):
+            remaining = None if deadline is None else deadline - time.time()
+            if remaining is not None and remaining <= 0:
+                raise exceptions.BufferFullError(
+                    "The event buffer stayed full for {0} seconds.".format(self.block_timeout))
+            self._condition.wait(remaining)
+
+    def _popleft(self):
+        item = self._items.popleft()
+        self.bytes -= len(item[1])
+        return item
+
+    def take(self, max_events, max_bytes=None, timeout=None):
+        """ Removes and returns up to max_events of the oldest events, waiting
+        up to timeout seconds for at least one.
+
+        :param max_events: the maximum number of events to return
+        :param max_bytes: optional, stop before the returned events exceed
+        this many bytes (at least one event is always returned)
+        :param timeout: seconds to wait while the buffer is empty, None to
+        wait forever, 0 not to wait
+        :returns: a list of (collection, data) tuples, empty on timeout
+        """
+        with self._condition:
+            if not self._items and timeout != 0:
+                deadline = None if timeout is None else time.time() + timeout
+                while not self._items:
+                    remaining = None if deadline is None else deadline - time.time()
+                    if remaining is not None and remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+
+            taken = []
+            taken_bytes = 0
+            while self._items and len(taken) < max_events:
+                size = len(self._items[0][1])
+                if taken and max_bytes is not None and taken_bytes + size > max_bytes:
+                    break
+                taken.append(self._popleft())
+                taken_bytes += size
+            if taken:
+                self._condition.notify_all()
+            return taken
+
+    def clear(self):
+        """ Discards every queued event without counting them as dropped.
+
+        :returns: the discarded (collection, data) tuples
+        """
+        with self._condition:
+            items = list(self._items)
+            self._items.clear()
+            self.bytes = 0
+            self._condition.notify_all()
+            return items
+
+
+def group_by_collection(items):
+    """ Turns (collection, data) tuples into the {collection: [data, ...]}
+    dict post_events expects.
+    """
+    events = {}
+    for collection, data in items:
+        events.setdefault(collection, []).append(data)
+    return events
@@ -0,0 +1,417 @@
+""" Command-line entry points, run as `python -m keen <command>`. """
+
+import argparse
+import bisect
+import gzip
+import json
+import mmap
+import os
+import signal
+import sys
+import threading
+import time
+
+import six
+
+from keen import batching, buffer, relay, ring, spool
+from keen.persistence_strategies import BufferedPersistenceStrategy
+from keen.client import KeenClient
+
+
+def main(argv=None):
+    """ Runs the command given on the command line and returns its exit code.
+
+    :param argv: optional, the arguments to parse instead of sys.argv[1:]
+    """
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if not getattr(args, "command", None):
+        parser.print_help()
+        return 2
+    return args.command(args)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m keen", description="Keen IO command-line tools.")
+    subparsers = parser.add_subparsers()
+
+    import_parser = subparsers.add_parser(
+        "import", help="Upload events from NDJSON files.",
+        description="Upload events from NDJSON files (optionally gzip-compressed) in parallel batches.")
+    _add_connection_arguments(import_parser)
+    routing = import_parser.add_mutually_exclusive_group(required=True)
+    routing.add_argument("--collection", help="the collection to add every event to")
+    routing.add_argument("--collection-field",
+                         help="the event property (dotted path) holding each event's collection")
+    import_parser.add_argument("--batch-size", type=int, default=batching.DEFAULT_BATCH_SIZE,
+                               help="events per request (default: %(default)s)")
+    import_parser.add_argument("--max-in-flight", type=int, default=batching.DEFAULT_MAX_IN_FLIGHT,
+                               help="concurrent requests (default: %(default)s)")
+    import_parser.add_argument("--checkpoint",
+                               help="file recording the acknowledged parts of every input file; an "
+                                    "interrupted import resumes from it and only sends what wasn't acknowledged")
+    import_parser.add_argument("--no-mmap", dest="use_mmap", action="store_false",
+                               help="read uncompressed files with regular reads instead of mmap")
+    import_parser.add_argument("--progress-interval", type=float, default=5.0,
+                               help="seconds between progress lines, 0 to disable (default: %(default)s)")
+    import_parser.add_argument("files", nargs="+", help="NDJSON files, .gz files are decompressed")
+    import_parser.set_defaults(command=run_import)
+
+    ring_parser = subparsers.add_parser(
+        "upload-ring", help="Upload the events written to a shared-memory ring.",
+        description="Drain the ring that RingPersistenceStrategy writes to into large batches. Run one per ring.")
+    _add_connection_arguments(ring_parser)
+    ring_parser.add_argument("--ring", default=os.environ.get("KEEN_RING_PATH", "/dev/shm/keen-events"),
+                             help="the ring file, defaults to $KEEN_RING_PATH or %(default)s")
+    ring_parser.add_argument("--capacity", type=int, default=ring.DEFAULT_RING_CAPACITY,
+                             help="ring size in bytes if it has to be created (default: %(default)s)")
+    ring_parser.add_argument("--batch-size", type=int, default=5000,
+                             help="events per request (default: %(default)s)")
+    ring_parser.add_argument("--spool", help="directory to spool batches that fail to upload to")
+    ring_parser.add_argument("--drain-timeout", type=float, default=10.0,
+                             help="seconds to keep uploading after SIGTERM or SIGINT (default: %(default)s)")
+    ring_parser.set_defaults(command=run_upload_ring)
+
+    relay_parser = subparsers.add_parser(
+        "relay", help="Receive events over UDP or a Unix socket and upload them in batches.",
+        description="A local relay for RelayPersistenceStrategy. Datagrams hold newline-separated "
+                    "[collection, event] JSON frames.")
+    _add_connection_arguments(relay_parser)
+    relay_parser.add_argument("--listen", default=os.environ.get("KEEN_RELAY_ADDRESS", relay.DEFAULT_RELAY_ADDRESS),
+                              help="udp://host:port or unix:///path, defaults to $KEEN_RELAY_ADDRESS or "
+                                   "%(default)s")
+    relay_parser.add_argument("--batch-size", type=int, default=500,
+                              help="events per request (default: %(default)s)")
+    relay_parser.add_argument("--flush-interval", type=float, default=1.0,
+                              help="the longest a received event waits for its batch (default: %(default)s)")
+    relay_parser.add_argument("--max-events", type=int, default=100000,
+                              help="events to buffer in memory; beyond it the oldest are dropped, or spooled "
+                                   "with --spool (default: %(default)s)")
+    relay_parser.add_argument("--spool", help="directory to spool batches that fail to upload to")
+    relay_parser.add_argument("--stats-port", type=int,
+                              help="serve the relay's counters as JSON on http://127.0.0.1:PORT/")
+    relay_parser.add_argument("--drain-timeout", type=float, default=10.0,
+                              help="seconds to keep uploading after SIGTERM or SIGINT (default: %(default)s)")
+    relay_parser.set_defaults(command=run_relay)
+
+    return parser
+
+
+def _add_connection_arguments(parser):
+    parser.add_argument("--project-id", default=os.environ.get("KEEN_PROJECT_ID"),
+                        help="defaults to $KEEN_PROJECT_ID")
+    parser.add_argument("--write-key", default=os.environ.get("KEEN_WRITE_KEY"),
+                        help="defaults to $KEEN_WRITE_KEY")
+    parser.add_argument("--base-url", default=os.environ.get("KEEN_BASE_URL"),
+                        help="defaults to $KEEN_BASE_URL")
+
+
+def _client_from_args(args):
+    if not args.project_id or not args.write_key:
+        raise SystemExit("A project ID and write key are required, see --help.")
+    return KeenClient(args.project_id, write_key=args.write_key, base_url=args.base_url)
+
+
+class Checkpoint(object):
+    """
+    Tracks the offset up to which each input file has been acknowledged.
+
+    Batches complete out of order when uploaded in parallel, so the saved
+    offset only advances over a contiguous run of completed batches. A batch
+    whose request failed stops the advance, so a re-run retries it. The byte
+    ranges of the batches acknowledged beyond it are saved too, so the re-run
+    skips their lines instead of sending them again.
+    """
+
+    def __init__(self, path):
+        """ Initializes a Checkpoint, loading a previous one from path if any.
+
+        :param path: the checkpoint file, or None to keep offsets in memory only
+        """
+        super(Checkpoint, self).__init__()
+        self.path = path
+        self.offsets = {}
+        # Sorted, merged [start, end] byte ranges acknowledged past the offset.
+        self.ranges = {}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                saved = json.load(f)
+            self.offsets = saved.get("offsets", {})
+            self.ranges = saved.get("ranges", {})
+        self._lock = threading.Lock()
+        self._next_sequence = 0
+        self._completed = {}
+        self._failed = False
+
+    def offset(self, name):
+        return self.offsets.get(name, 0)
+
+    def acknowledged(self, name, offset):
+        """ Whether the line of a file ending at offset is part of a batch
+        that was acknowledged beyond the file's offset.
+        """
+        for start, end in self.ranges.get(name, ()):
+            if start < offset <= end:
+                return True
+        return False
+
+    def acknowledge(self, sequence, name, offset, ok, start=None):
+        """ Records that a batch is done.
+
+        :param sequence: the position of the batch among all batches
+        :param name: the input file the batch was read from
+        :param offset: the offset in that file right after the batch
+        :param ok: False if the request failed
+        :param start: optional, the offset in that file where the batch
+        starts; needed to remember the batch while an earlier one keeps the
+        offset from advancing
+        """
+        with self._lock:
+            self._completed[sequence] = (name, offset, ok)
+            changed = ok and start is not None
+            if changed:
+                self._add_range(name, start, offset)
+            advanced = False
+            while not self._failed and self._next_sequence in self._completed:
+                name, offset, ok = self._completed.pop(self._next_sequence)
+                if not ok:
+                    self._failed = True
+                    break
+                self.offsets[name] = max(offset, self.offsets.get(name, 0))
+                self._next_sequence += 1
+                advanced = True
+            if changed or advanced:
+                self._drop_covered_ranges()
+                self.save()
+
+    def _add_range(self, name, start, end):
+        ranges = self.ranges.setdefault(name, [])
+        position = bisect.bisect_left(ranges, [start, end])
+        ranges.insert(position, [start, end])
+        # Batches are contiguous, so neighbours usually merge into one range.
+        merged = []
+        for current in ranges:
+            if merged and current[0] <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], current[1])
+            else:
+                merged.append(current)
+        ranges[:] = merged
+
+    def _drop_covered_ranges(self):
+        # Ranges the offset reached are absorbed into it.
+        for name in list(self.ranges):
+            offset = self.offsets.get(name, 0)
+            remaining = []
+            for start, end in self.ranges[name]:
+                if start <= offset:
+                    offset = max(offset, end)
+                else:
+                    remaining.append([start, end])
+            self.offsets[name] = offset
+            if remaining:
+                self.ranges[name] = remaining
+            else:
+                del self.ranges[name]
+
+    def save(self):
+        if not self.path:
+            return
+        temporary = self.path + ".tmp"
+        with open(temporary, "w") as f:
+            json.dump({"offsets": self.offsets, "ranges": self.ranges}, f)
+        if os.name == "nt" and os.path.exists(self.path):
+            os.remove(self.path)
+        os.rename(temporary, self.path)
+
+
+class ProgressReporter(object):
+    """
+    Prints upload throughput to a stream at most every interval seconds.
+    """
+
+    def __init__(self, interval, stream=None):
+        super(ProgressReporter, self).__init__()
+        self.interval = interval
+        self.stream = stream or sys.stderr
+        self.started = time.time()
+        self._last_report = self.started
+        self._events = 0
+        self._lock = threading.Lock()
+
+    def add(self, events):
+        with self._lock:
+            self._events += events
+            now = time.time()
+            if self.interval and now - self._last_report >= self.interval:
+                self._last_report = now
+                self.report(now)
+
+    def report(self, now=None):
+        elapsed = max((now or time.time()) - self.started, 1e-9)
+        self.stream.write("{0} events in {1:.1f}s ({2:.0f} events/s)\n".format(
+            self._events, elapsed, self._events / elapsed))
+        self.stream.flush()
+
+
+def iter_ndjson_lines(path, offset=0, use_mmap=True):
+    """ Yields (line, end_offset) for each line of an NDJSON file.
+
+    Offsets of .gz files are positions in the decompressed stream. Resuming
+    a compressed file decompresses and skips everything before offset.
+
+    :param path: the file to read
+    :param offset: the position to start reading at
+    :param use_mmap: memory-map uncompressed files instead of reading them
+    """
+    if path.endswith(".gz"):
+        f = gzip.open(path, "rb")
+        try:
+            f.seek(offset)
+            position = offset
+            for line in f:
+                position += len(line)
+                yield line, position
+        finally:
+            f.close()
+        return
+
+    with open(path, "rb") as f:
+        if use_mmap and os.fstat(f.fileno()).st_size > offset:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                mapped.seek(offset)
+                readline = mapped.readline
+                line = readline()
+                while line:
+                    yield line, mapped.tell()
+                    line = readline()
+            finally:
+                mapped.close()
+        else:
+            f.seek(offset)
+            position = offset
+            for line in f:
+                position += len(line)
+                yield line, position
+
+
+def _get_path(event, path):
+    value = event
+    for part in path.split("."):
+        value = value[part]
+    return value
+
+
+def _iter_import_batches(args, checkpoint, errors):
+    sequence = 0
+    for name in args.files:
+        events = {}
+        size = 0
+        offset = start = checkpoint.offset(name)
+        for line, offset in iter_ndjson_lines(name, offset, args.use_mmap):
+            line = line.strip()
+            if not line or checkpoint.acknowledged(name, offset):
+                continue
+            try:
+                event = json.loads(line.decode("utf-8"))
+                collection = args.collection or _get_path(event, args.collection_field)
+                if not isinstance(collection, six.string_types):
+                    raise ValueError("the collection must be a string, got {0!r}".format(collection))
+            except (ValueError, KeyError, TypeError) as e:
+                errors.append("{0}: skipped the line ending at offset {1}: {2}".format(name, offset, e))
+                continue
+            events.setdefault(collection, []).append(event)
+            size += 1
+            if size >= args.batch_size:
+                yield batching.Batch(events, size, tag=(sequence, name, start, offset))
+                sequence += 1
+                events = {}
+                size = 0
+                start = offset
+        if size:
+            yield batching.Batch(events, size, tag=(sequence, name, start, offset))
+            sequence += 1
+
+
+def run_import(args):
+    """ The `import` command. Returns 0 if every batch was uploaded. """
+    client = _client_from_args(args)
+    checkpoint = Checkpoint(args.checkpoint)
+    progress = ProgressReporter(args.progress_interval)
+    errors = []
+
+    def on_complete(batch, response, error):
+        sequence, name, start, offset = batch.tag
+        checkpoint.acknowledge(sequence, name, offset, error is None, start=start)
+        progress.add(batch.size)
+        if error is not None:
+            errors.append("{0}: batch ending at offset {1} failed: {2}".format(name, offset, error))
+
+    uploader = batching.BatchUploader(client.api.post_events, max_in_flight=args.max_in_flight,
+                                      on_complete=on_complete)
+    stats = uploader.upload(_iter_import_batches(args, checkpoint, errors))
+
+    progress.report()
+    for error in errors:
+        sys.stderr.write(error + "\n")
+    sys.stderr.write("{0} events succeeded, {1} failed, {2} of {3} requests failed.\n".format(
+        stats.succeeded, stats.failed, stats.failed_batches, stats.batches))
+    return 1 if stats.failed_batches else 0
+
+
+def run_upload_ring(args):
+    """ The `upload-ring` command. Runs until SIGTERM or SIGINT. """
+    client = _client_from_args(args)
+    event_ring = ring.SharedRingBuffer(args.ring, capacity=args.capacity)
+    event_spool = spool.DiskSpool(args.spool) if args.spool else None
+    uploader = ring.RingUploader(event_ring, client.api.post_events, batch_size=args.batch_size, spool=event_spool)
+    replayer = None
+    if event_spool is not None:
+        replayer = spool.SpoolReplayer(event_spool, client.api.post_events, batch_size=args.batch_size)
+        replayer.start()
+
+    def stop(signum, frame):
+        uploader.stop()
+
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, stop)
+    uploader.run()
+    uploader.drain(timeout=args.drain_timeout)
+    if replayer is not None:
+        replayer.stop(0)
+
+    stats = event_ring.stats()
+    sys.stderr.write("{0} events uploaded, {1} spooled, {2} bytes left in the ring, "
+                     "{3} events dropped by producers.\n".format(uploader.uploaded, uploader.spilled,
+                                                                 stats["bytes"], stats["dropped"]))
+    return 0
+
+
+def run_relay(args):
+    """ The `relay` command. Runs until SIGTERM or SIGINT. """
+    client = _client_from_args(args)
+    event_spool = spool.DiskSpool(args.spool) if args.spool else None
+    if event_spool is not None:
+        event_buffer = buffer.EventBuffer(max_events=args.max_events, overflow_policy=buffer.OverflowPolicy.SPILL,
+                                          spill=spool.SpillWriter(event_spool))
+    else:
+        event_buffer = buffer.EventBuffer(max_events=args.max_events,
+                                          overflow_policy=buffer.OverflowPolicy.DROP_OLDEST)
+    strategy = BufferedPersistenceStrategy(client.api, event_buffer, batch_size=args.batch_size,
+                                           flush_interval=args.flush_interval, spool=event_spool)
+    server = relay.RelayServer(args.listen, strategy, stats_port=args.stats_port)
+
+    def stop(signum, frame):
+        server.stop()
+
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, stop)
+    server.serve_forever()
+    report = server.close(timeout=args.drain_timeout)
+
+    stats = server.stats()
+    sys.stderr.write("{0} events received ({1} invalid frames), {2} uploaded, {3} dropped; on shutdown {4} "
+                     "flushed, {5} spilled, {6} lost.\n".format(stats["received"], stats["invalid"],
+                                                                stats["uploaded"], stats["dropped"], report.flushed,
+                                                                report.spilled, report.lost))
+    return 0
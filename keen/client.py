@@ -1,21 +1,67 @@
 import base64
-import copy
+import datetime
+import functools
 import json
 import sys
+
+import six
+
 from keen import persistence_strategies, exceptions, saved_queries, cached_datasets
+from keen import batching, columnar, payloads, results, sampling as event_sampling, shutdown, validation
 from keen.api import KeenApi
+from keen.compression import DEFAULT_COMPRESSION_THRESHOLD, validate_compression
+from keen.context import ContextClient, EventContext
 from keen.persistence_strategies import BasePersistenceStrategy
 
 __author__ = 'dkador'
 
 
+# datetime.timezone only exists on Python 3.
+_UTC = datetime.timezone.utc if hasattr(datetime, "timezone") else None
+
+# The last timestamp formatted and its string, shared by events created with
+# the same datetime object (e.g. a batch stamped with one "now").
+_last_formatted_timestamp = (None, None)
+
+
+def _format_timestamp(timestamp):
+    """ Formats a datetime like isoformat(), caching the last result. """
+    global _last_formatted_timestamp
+
+    last_timestamp, last_formatted = _last_formatted_timestamp
+    if timestamp is last_timestamp:
+        return last_formatted
+
+    if _UTC is not None and timestamp.tzinfo is _UTC:
+        # Fast path for timezone.utc: skips the utcoffset() call isoformat()
+        # makes for aware datetimes.
+        formatted = "%04d-%02d-%02dT%02d:%02d:%02d" % (timestamp.year, timestamp.month, timestamp.day,
+                                                        timestamp.hour, timestamp.minute, timestamp.second)
+        if timestamp.microsecond:
+            formatted = "%s.%06d+00:00" % (formatted, timestamp.microsecond)
+        else:
+            formatted += "+00:00"
+    else:
+        formatted = timestamp.isoformat()
+
+    _last_formatted_timestamp = (timestamp, formatted)
+    return formatted
+
+
 class Event(object):
     """
     An event in Keen.
+
+    Events may be buffered by the hundreds of thousands, so they use
+    __slots__ instead of a per-instance __dict__, and format their
+    timestamp at most once.
     """
 
+    __slots__ = ("project_id", "event_collection", "event_body", "context", "_timestamp",
+                 "_formatted_timestamp")
+
     def __init__(self, project_id, event_collection, event_body,
-                 timestamp=None):
+                 timestamp=None, context=None):
         """ Initializes a new Event.
 
         :param project_id: the Keen project ID to insert the event to
@@ -23,25 +69,55 @@ class Event(object):
         :param event_body: a dict that contains the body of the event to insert
         :param timestamp: optional, specify a datetime to override the
         timestamp associated with the event in Keen
+        :param context: optional, a keen.context.EventContext whose shared
+        properties are merged into the event when it is serialized
         """
         super(Event, self).__init__()
         self.project_id = project_id
         self.event_collection = event_collection
         self.event_body = event_body
+        self.context = context
         self.timestamp = timestamp
 
+    @property
+    def timestamp(self):
+        return self._timestamp
+
+    @timestamp.setter
+    def timestamp(self, timestamp):
+        self._timestamp = timestamp
+        self._formatted_timestamp = None
+
+    @property
+    def formatted_timestamp(self):
+        """ The timestamp as an ISO-8601 string, or None. Formatted lazily
+        and cached.
+        """
+        if self._formatted_timestamp is None and self._timestamp:
+            self._formatted_timestamp = _format_timestamp(self._timestamp)
+        return self._formatted_timestamp
+
     def to_json(self):
         """ Serializes the event to JSON.
 
         :returns: a string
         """
-        event_as_dict = copy.deepcopy(self.event_body)
-        if self.timestamp:
-            if "keen" in event_as_dict:
-                event_as_dict["keen"]["timestamp"] = self.timestamp.isoformat()
-            else:
-                event_as_dict["keen"] = {"timestamp": self.timestamp.isoformat()}
-        return json.dumps(event_as_dict)
+        if self.context is not None:
+            return self.context.encode(self.to_dict())
+        return json.dumps(self.to_dict())
+
+    def to_dict(self):
+        """ Returns the body to upload, with the timestamp merged in. The
+        event body itself is never modified; only the dicts that change
+        are copied.
+        """
+        if not self._timestamp:
+            return self.event_body
+        event_as_dict = dict(self.event_body)
+        keen = dict(event_as_dict.get("keen") or {})
+        keen["timestamp"] = self.formatted_timestamp
+        event_as_dict["keen"] = keen
+        return event_as_dict
 
 
 class KeenClient(object):
@@ -61,7 +137,9 @@ class KeenClient(object):
 
     def __init__(self, project_id, write_key=None, read_key=None,
                  persistence_strategy=None, api_class=KeenApi, get_timeout=305, post_timeout=305,
-                 master_key=None, base_url=None):
+                 master_key=None, base_url=None, columnar_results=False, compression=None,
+                 compression_threshold=DEFAULT_COMPRESSION_THRESHOLD, sampling=None, deduplicator=None,
+                 validator=None):
         """ Initializes a KeenClient object.
 
         :param project_id: the Keen IO project ID
@@ -72,6 +150,20 @@ class KeenClient(object):
         :param get_timeout: optional, the timeout on GET requests
         :param post_timeout: optional, the timeout on POST requests
         :param master_key: a Keen IO Master API Key
+        :param columnar_results: optional, return interval and group_by results
+        of numeric analyses as keen.results.ColumnarResult objects
+        :param compression: optional, "gzip" or "zstd" to compress event upload
+        bodies
+        :param compression_threshold: optional, bodies smaller than this many
+        bytes are sent uncompressed
+        :param sampling: optional, a keen.sampling.Sampling, or a dict mapping
+        collection names to keen.sampling.Samplers, to keep only a sample of
+        the events of high-volume collections
+        :param deduplicator: optional, a keen.dedup.Deduplicator, to give every
+        event a keen.id and never upload an acknowledged id twice
+        :param validator: optional, True or a keen.validation.EventValidator,
+        to reject invalid events, or pass them to its dead-letter callback,
+        before they are queued or uploaded
         """
         super(KeenClient, self).__init__()
 
@@ -83,6 +175,12 @@ class KeenClient(object):
         self.api = api_class(project_id, write_key=write_key, read_key=read_key,
                              get_timeout=get_timeout, post_timeout=post_timeout,
                              master_key=master_key, base_url=base_url)
+        # Set like the deduplicator, so api classes written before these
+        # options keep working.
+        if compression is not None or compression_threshold != DEFAULT_COMPRESSION_THRESHOLD:
+            validate_compression(compression)
+            self.api.compression = compression
+            self.api.compression_threshold = compression_threshold
 
         if persistence_strategy:
             # validate the given persistence strategy
@@ -97,6 +195,16 @@ class KeenClient(object):
         self.persistence_strategy = persistence_strategy
         self.get_timeout = get_timeout
         self.post_timeout = post_timeout
+        self.columnar_results = columnar_results
+        if isinstance(sampling, dict):
+            sampling = event_sampling.Sampling(sampling)
+        self.sampling = sampling
+        self.deduplicator = deduplicator
+        if validator is True:
+            validator = validation.EventValidator()
+        self.validator = validator
+        if deduplicator is not None:
+            self.api.deduplicator = deduplicator
         self.saved_queries = saved_queries.SavedQueriesInterface(self.api)
         self.cached_datasets = cached_datasets.CachedDatasetsInterface(self.api)
 
@@ -117,7 +225,7 @@ class KeenClient(object):
             if not project_id or not isinstance(project_id, str):
                 raise exceptions.InvalidProjectIdError(project_id)
 
-    def add_event(self, event_collection, event_body, timestamp=None):
+    def add_event(self, event_collection, event_body, timestamp=None, context=None):
         """ Adds an event.
 
         Depending on the persistence strategy of the client,
@@ -128,11 +236,35 @@ class KeenClient(object):
         event to
         :param event_body: dict, the body of the event to insert the event to
         :param timestamp: datetime, optional, the timestamp of the event
+        :param context: keen.context.EventContext, optional, shared properties
+        to merge into the event when it is serialized; see with_context()
         """
+        if self.sampling is not None:
+            event_body = self.sampling.sample(event_collection, event_body)
+            if event_body is None:
+                return
+        if self.validator is not None and not self.validator.check(event_collection, event_body):
+            return
+        if self.deduplicator is not None:
+            event_body = self.deduplicator.assign(event_body)
         event = Event(self.project_id, event_collection, event_body,
-                      timestamp=timestamp)
+                      timestamp=timestamp, context=context)
         self.persistence_strategy.persist(event)
 
+    def with_context(self, properties):
+        """ Returns a view of this client that adds properties to every event
+        it sends.
+
+        The properties are kept and encoded once, then merged into each
+        event only while it is serialized, instead of being copied into
+        every event body. Properties of an event win over context properties
+        of the same name. Queries and every other method go to this client.
+
+        :param properties: dict of properties to add to every event
+        :returns: a keen.context.ContextClient
+        """
+        return ContextClient(self, EventContext(properties))
+
     def add_events(self, events):
         """ Adds a batch of events.
 
@@ -142,8 +274,189 @@ class KeenClient(object):
 
         :param events: dictionary of events
         """
+        if self.sampling is not None:
+            events = self.sampling.sample_events(events)
+        if self.validator is not None:
+            events = self.validator.filter_events(events)
+        if self.deduplicator is not None:
+            assign = self.deduplicator.assign
+            events = dict((collection, [assign(event) for event in collection_events])
+                          for collection, collection_events in six.iteritems(events))
         return self.persistence_strategy.batch_persist(events)
 
+    def add_events_stream(self, events, batch_size=batching.DEFAULT_BATCH_SIZE,
+                          max_in_flight=batching.DEFAULT_MAX_IN_FLIGHT, adaptive=None):
+        """ Adds events from an iterator or generator with bounded memory.
+
+        Events are pulled lazily and uploaded in batches of at most batch_size
+        events, with at most max_in_flight requests running at a time. These
+        events are always uploaded directly, regardless of the persistence
+        strategy of the client. Failed requests are counted, not raised.
+
+        With adaptive, the batch size and the number of concurrent requests
+        start at batch_size and max_in_flight and then follow the latency,
+        errors and 429 responses of the requests.
+
+        :param events: an iterable of (collection, event) pairs, or a dict
+        mapping collection names to iterables of events
+        :param batch_size: optional, the maximum number of events per request
+        :param max_in_flight: optional, the maximum number of concurrent requests
+        :param adaptive: optional, True, or a keen.batching.AdaptiveBatching
+        with custom bounds, which can be reused to carry what it learned over
+        to the next upload
+        :returns: a keen.batching.UploadStats with the aggregate counts
+        """
+        if adaptive is True:
+            adaptive = batching.AdaptiveBatching(batch_size=batch_size, min_batch_size=min(50, batch_size),
+                                                 max_batch_size=max(5000, batch_size), max_in_flight=max_in_flight,
+                                                 in_flight_limit=max(16, max_in_flight))
+        uploader = batching.BatchUploader(self.api.post_events, max_in_flight=max_in_flight,
+                                          adaptive=adaptive or None)
+        pairs = batching.iter_event_pairs(events)
+        if self.sampling is not None:
+            pairs = self.sampling.sample_pairs(pairs)
+        if self.validator is not None:
+            check = self.validator.check
+            pairs = ((collection, event) for collection, event in pairs if check(collection, event))
+        if self.deduplicator is not None:
+            assign = self.deduplicator.assign
+            pairs = ((collection, assign(event)) for collection, event in pairs)
+        if adaptive:
+            batch_size = adaptive.get_batch_size
+        return uploader.upload(batching.iter_batches(pairs, batch_size=batch_size))
+
+    def flush(self, timeout=None):
+        """ Uploads the events the persistence strategy is holding on to.
+        Strategies that upload immediately have nothing to flush.
+
+        :param timeout: optional, the most seconds to spend
+        :returns: a keen.persistence_strategies.FlushReport of the events
+        flushed, spilled to a spool, lost, or still in flight at the deadline
+        """
+        return self.persistence_strategy.flush(timeout=timeout)
+
+    def close(self, timeout=None):
+        """ Flushes the pending events and stops the persistence strategy's
+        background work.
+
+        :param timeout: optional, the most seconds to spend
+        :returns: a keen.persistence_strategies.FlushReport
+        """
+        report = self.persistence_strategy.close(timeout=timeout)
+        if self.deduplicator is not None:
+            self.deduplicator.save()
+        return report
+
+    def close_on_exit(self, timeout=shutdown.DEFAULT_SHUTDOWN_TIMEOUT, signals=None,
+                      on_report=shutdown.print_report):
+        """ Closes the client when the interpreter exits or the process
+        receives SIGTERM, so pending events aren't lost on deploys. Must be
+        called from the main thread.
+
+        :param timeout: optional, the most seconds to spend flushing
+        :param signals: optional, the signals to flush on, SIGTERM by default
+        :param on_report: optional, a callable receiving the FlushReport,
+        by default a summary is written to stderr
+        :returns: the installed keen.shutdown.ShutdownHook
+        """
+        hook = shutdown.ShutdownHook(self, timeout=timeout, on_report=on_report)
+        if signals is None:
+            return hook.install()
+        return hook.install(signals=signals)
+
+    def add_events_chunked(self, events, chunk_size=payloads.DEFAULT_CHUNK_SIZE):
+        """ Adds a batch of events in a single request whose body is streamed.
+
+        The body is generated from the event iterables while it is written to
+        the connection (chunked transfer encoding), so peak memory is about one
+        chunk instead of the whole batch. These events are always uploaded
+        directly, regardless of the persistence strategy of the client.
+
+        :param events: dict mapping collection names to iterables (e.g.
+        generators) of events, each a dict or a JSON bytes/str
+        :param chunk_size: optional, the size of the body pieces in bytes
+        :returns: the per-event results, in the same form as add_events()
+        """
+        if self.sampling is not None:
+            sample = self.sampling.sample_iterable
+            events = dict((collection, sample(collection, collection_events))
+                          for collection, collection_events in six.iteritems(events))
+        if self.validator is not None:
+            check = self.validator.check
+            events = dict((collection, (event for event in collection_events if check(collection, event)))
+                          for collection, collection_events in six.iteritems(events))
+        if self.deduplicator is not None:
+            assign = self.deduplicator.assign
+            events = dict((collection, (assign(event) for event in collection_events))
+                          for collection, collection_events in six.iteritems(events))
+        return self.api.post_events_stream(events, chunk_size=chunk_size)
+
+    def add_events_columnar(self, event_collection, columns, batch_size=columnar.DEFAULT_BATCH_SIZE, context=None):
+        """ Adds a batch of events given as columns instead of a list of dicts.
+
+        The request bodies are built directly from the column arrays, so no
+        dict is created per event. These events are always uploaded directly,
+        regardless of the persistence strategy of the client.
+
+        :param event_collection: the name of the collection to insert the
+        events to
+        :param columns: dict mapping property names to equally long lists,
+        tuples, NumPy arrays or pandas Series. Dotted names such as "user.id"
+        become nested properties.
+        :param batch_size: optional, the maximum number of events per request
+        :param context: keen.context.EventContext, optional, shared properties
+        written into every row's JSON once encoded; columns win over context
+        properties of the same top-level name
+        :returns: the merged per-event results of all requests, in the same
+        form as add_events(), empty if the validator rejected the column names
+        """
+        response = {}
+        if self.validator is not None and not self.validator.check_columns(event_collection, columns):
+            return response
+        transform = None
+        if self.sampling is not None and event_collection in self.sampling.samplers:
+            # Sampled rows get their weight property spliced in.
+            transform = functools.partial(self.sampling.sample, event_collection)
+        ids = []
+        if self.deduplicator is not None:
+            transform = functools.partial(self._deduplicate_row, transform, ids)
+        fragment = None
+        if context is not None:
+            fragment = context.fragment_without(name.split(".", 1)[0] for name in columns)
+        for payload in columnar.iter_payloads(event_collection, columns, batch_size=batch_size, transform=transform,
+                                              fragment=fragment):
+            result = self.api.post_events_payload(payload)
+            if self.deduplicator is not None:
+                # ids holds the ids of exactly the rows of this payload.
+                self.deduplicator.acknowledge_result({event_collection: list(ids)}, result)
+                del ids[:]
+            for collection, collection_results in result.items():
+                response.setdefault(collection, []).extend(collection_results)
+        return response
+
+    def _deduplicate_row(self, transform, ids, row):
+        if transform is not None:
+            row = transform(row)
+            if row is None:
+                return None
+        row = self.deduplicator.assign(row)
+        for kept in self.deduplicator.filter_iterable([row], ids):
+            return kept
+        return None
+
+    def add_dataframe(self, event_collection, dataframe, batch_size=columnar.DEFAULT_BATCH_SIZE):
+        """ Adds every row of a pandas DataFrame as an event.
+
+        See add_events_columnar(); column names become property names.
+
+        :param event_collection: the name of the collection to insert the
+        events to
+        :param dataframe: a pandas DataFrame
+        :param batch_size: optional, the maximum number of events per request
+        """
+        return self.add_events_columnar(event_collection, columnar.dataframe_columns(dataframe),
+                                        batch_size=batch_size)
+
     def generate_image_beacon(self, event_collection, event_body, timestamp=None):
         """ Generates an image beacon URL.
 
@@ -363,7 +676,7 @@ class KeenClient(object):
         params = self.get_params(event_collection=event_collection, timeframe=timeframe, timezone=timezone,
                                  interval=interval, filters=filters, group_by=group_by, order_by=order_by,
                                  max_age=max_age, limit=limit)
-        return self.api.query("count", params)
+        return self._numeric_query("count", params)
 
     def sum(self, event_collection, target_property, timeframe=None, timezone=None, interval=None, filters=None,
             group_by=None, order_by=None, max_age=None, limit=None):
@@ -395,7 +708,34 @@ class KeenClient(object):
         params = self.get_params(event_collection=event_collection, timeframe=timeframe, timezone=timezone,
                                  interval=interval, filters=filters, group_by=group_by, order_by=order_by,
                                  target_property=target_property, max_age=max_age, limit=limit)
-        return self.api.query("sum", params)
+        return self._numeric_query("sum", params)
+
+    def weighted_count(self, event_collection, timeframe=None, timezone=None, interval=None, filters=None,
+                       group_by=None, order_by=None, max_age=None, limit=None):
+        """ Estimates the number of events before client-side sampling by
+        summing the weights the sampler recorded, so it stays correct when the
+        sampling rate changed over the timeframe. Takes the arguments of
+        count(). Unsampled events need a weight of 1 to be counted.
+
+        :param event_collection: string, the name of the collection to query
+        """
+        weight_property = self.sampling.weight_property if self.sampling is not None \
+            else event_sampling.DEFAULT_WEIGHT_PROPERTY
+        return self.sum(event_collection, weight_property, timeframe=timeframe, timezone=timezone,
+                        interval=interval, filters=filters, group_by=group_by, order_by=order_by,
+                        max_age=max_age, limit=limit)
+
+    def rescale(self, event_collection, result):
+        """ Scales a count() or sum() result of a sampled collection up by
+        its sampler's current rate, e.g. by 100 for 1% sampling. Results of
+        unsampled collections are returned unchanged.
+
+        :param event_collection: string, the name of the queried collection
+        :param result: the result of count() or sum()
+        """
+        if self.sampling is None:
+            return result
+        return self.sampling.rescale(event_collection, result)
 
     def minimum(self, event_collection, target_property, timeframe=None, timezone=None, interval=None,
                 filters=None, group_by=None, order_by=None, max_age=None, limit=None):
@@ -427,7 +767,7 @@ class KeenClient(object):
         params = self.get_params(event_collection=event_collection, timeframe=timeframe, timezone=timezone,
                                  interval=interval, filters=filters, group_by=group_by,
                                  target_property=target_property, max_age=max_age, limit=limit)
-        return self.api.query("minimum", params)
+        return self._numeric_query("minimum", params)
 
     def maximum(self, event_collection, target_property, timeframe=None, timezone=None, interval=None,
                 filters=None, group_by=None, order_by=None, max_age=None, limit=None):
@@ -459,7 +799,7 @@ class KeenClient(object):
         params = self.get_params(event_collection=event_collection, timeframe=timeframe, timezone=timezone,
                                  interval=interval, filters=filters, group_by=group_by, order_by=order_by,
                                  target_property=target_property, max_age=max_age, limit=limit)
-        return self.api.query("maximum", params)
+        return self._numeric_query("maximum", params)
 
     def average(self, event_collection, target_property, timeframe=None, timezone=None, interval=None,
                 filters=None, group_by=None, order_by=None, max_age=None, limit=None):
@@ -491,7 +831,7 @@ class KeenClient(object):
         params = self.get_params(event_collection=event_collection, timeframe=timeframe, timezone=timezone,
                                  interval=interval, filters=filters, group_by=group_by, order_by=order_by,
                                  target_property=target_property, max_age=max_age, limit=limit)
-        return self.api.query("average", params)
+        return self._numeric_query("average", params)
 
     def median(self, event_collection, target_property, timeframe=None, timezone=None, interval=None,
                 filters=None, group_by=None, order_by=None, max_age=None, limit=None):
@@ -523,7 +863,7 @@ class KeenClient(object):
         params = self.get_params(event_collection=event_collection, timeframe=timeframe, timezone=timezone,
                                  interval=interval, filters=filters, group_by=group_by, order_by=order_by,
                                  target_property=target_property, max_age=max_age, limit=limit)
-        return self.api.query("median", params)
+        return self._numeric_query("median", params)
 
     def percentile(self, event_collection, target_property, percentile, timeframe=None, timezone=None,
                    interval=None, filters=None, group_by=None, order_by=None, max_age=None, limit=None):
@@ -567,7 +907,7 @@ class KeenClient(object):
             max_age=max_age,
             limit=limit
         )
-        return self.api.query("percentile", params)
+        return self._numeric_query("percentile", params)
 
     def count_unique(self, event_collection, target_property, timeframe=None, timezone=None, interval=None,
                      filters=None, group_by=None, order_by=None, max_age=None, limit=None):
@@ -599,7 +939,7 @@ class KeenClient(object):
         params = self.get_params(event_collection=event_collection, timeframe=timeframe, timezone=timezone,
                                  interval=interval, filters=filters, group_by=group_by, order_by=order_by,
                                  target_property=target_property, max_age=max_age, limit=limit)
-        return self.api.query("count_unique", params)
+        return self._numeric_query("count_unique", params)
 
     def select_unique(self, event_collection, target_property, timeframe=None, timezone=None, interval=None,
                       filters=None, group_by=None, order_by=None, max_age=None, limit=None):
@@ -726,6 +1066,13 @@ class KeenClient(object):
 
         return self.api.query("multi_analysis", params)
 
+    def _numeric_query(self, analysis_type, params):
+        result = self.api.query(analysis_type, params)
+        if self.columnar_results and isinstance(result, list):
+            result = results.ColumnarResult.from_result(result, group_by=params.get("group_by"),
+                                                        interval=params.get("interval"))
+        return result
+
     def get_params(self, event_collection=None, timeframe=None, timezone=None, interval=None, filters=None,
                    group_by=None, order_by=None, target_property=None, latest=None, email=None, analyses=None,
                    steps=None, property_names=None, percentile=None, max_age=None, limit=None):
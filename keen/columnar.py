@@ -0,0 +1,175 @@
+import datetime
+import json
+import sys
+
+import six
+
+# Default number of rows sent per post_events request.
+DEFAULT_BATCH_SIZE = 5000
+
+_NULL = "null"
+_NON_FINITE = frozenset(["NaN", "Infinity", "-Infinity"])
+
+
+def _is_missing(value):
+    # pandas.NA and pandas.NaT; pandas is imported if there are any. NA
+    # can't be compared with !=, its truth value is ambiguous.
+    pandas = sys.modules.get("pandas")
+    if pandas is not None and (value is getattr(pandas, "NA", None) or value is getattr(pandas, "NaT", None)):
+        return True
+    # Other NaN-like scalars, e.g. numpy.datetime64("NaT").
+    try:
+        return bool(value != value)
+    except (TypeError, ValueError):
+        return False
+
+
+def _is_datetime64(values):
+    return getattr(getattr(values, "dtype", None), "kind", None) == "M"
+
+
+def _default(value):
+    # Scalars that json can't handle natively.
+    if _is_missing(value):
+        return None
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    if _is_datetime64(value):
+        # item() of nanosecond datetime64 scalars is an int.
+        return value.astype("datetime64[us]").item().isoformat()
+    if hasattr(value, "item"):
+        # NumPy scalars
+        return value.item()
+    raise TypeError("{0!r} is not JSON serializable".format(value))
+
+
+_encode = json.JSONEncoder(default=_default, separators=(",", ":")).encode
+
+
+def encode_column(values):
+    """ Encodes every value of a column to its JSON fragment in one pass.
+
+    :param values: a list, tuple, NumPy array or pandas Series
+    :returns: a list of JSON strings, NaN and infinite floats and missing
+    values (None, NaT, pandas.NA) become null
+    """
+    if _is_datetime64(values) and not hasattr(values, "iloc"):
+        # tolist() turns nanosecond datetime64 arrays into ints; microseconds
+        # become datetimes (and NaT None). Series give pandas Timestamps.
+        values = values.astype("datetime64[us]")
+    if hasattr(values, "tolist"):
+        # Converts NumPy and pandas scalars to native Python values in C.
+        values = values.tolist()
+    encoded = list(map(_encode, values))
+    return [_NULL if fragment in _NON_FINITE else fragment for fragment in encoded]
+
+
+def row_template(names, fragment=None):
+    """ Builds a %-format template for one event from column names, nesting
+    dotted names, e.g. ["a", "b.c", "b.d"] gives '{"a":%s,"b":{"c":%s,"d":%s}}'.
+
+    :param names: the column names, in the order their values will be given
+    :param fragment: optional, JSON members without the surrounding braces,
+    e.g. '"host":"a"', written into every event before the columns
+    :returns: a tuple of the template and the column positions in the order
+    the template expects them
+    """
+    tree = {}
+    order = []
+    for position, name in enumerate(names):
+        node = tree
+        parts = name.split(".")
+        for part in parts[:-1]:
+            node = node.setdefault(part, {})
+            if not isinstance(node, dict):
+                raise ValueError("Column '{0}' conflicts with a column of the same prefix.".format(name))
+        if parts[-1] in node:
+            raise ValueError("Column '{0}' conflicts with a column of the same prefix.".format(name))
+        node[parts[-1]] = position
+
+    def render(node):
+        members = []
+        for key, child in six.iteritems(node):
+            encoded_key = _encode(key).replace("%", "%%")
+            if isinstance(child, dict):
+                members.append("{0}:{1}".format(encoded_key, render(child)))
+            else:
+                order.append(child)
+                members.append("{0}:%s".format(encoded_key))
+        return "{" + ",".join(members) + "}"
+
+    template = render(tree)
+    if fragment:
+        separator = "," if template != "{}" else ""
+        template = "{" + fragment.replace("%", "%%") + separator + template[1:]
+    return template, order
+
+
+def iter_rows(columns, chunk_size=DEFAULT_BATCH_SIZE, fragment=None):
+    """ Yields each event of a set of columns as a JSON string without
+    building an intermediate dict per row. Columns are encoded chunk_size
+    rows at a time, so only one chunk of fragments is held in memory.
+
+    :param columns: a dict mapping column names to equally long sequences;
+    dotted names such as "user.id" become nested properties
+    :param chunk_size: the number of rows encoded per pass
+    :param fragment: optional, JSON members written into every event, see
+    row_template()
+    """
+    names = list(columns)
+    if not names:
+        return
+
+    lengths = set(len(columns[name]) for name in names)
+    if len(lengths) > 1:
+        raise ValueError("All columns must have the same length.")
+    length = lengths.pop()
+
+    template, order = row_template(names, fragment=fragment)
+    ordered = [columns[names[position]] for position in order]
+    for start in range(0, length, chunk_size):
+        chunk = [encode_column(_slice(column, start, start + chunk_size)) for column in ordered]
+        for fragments in zip(*chunk):
+            yield template % fragments
+
+
+def _slice(values, start, stop):
+    # Positional slicing that also works for pandas Series with any index.
+    return getattr(values, "iloc", values)[start:stop]
+
+
+def iter_payloads(event_collection, columns, batch_size=DEFAULT_BATCH_SIZE, transform=None, fragment=None):
+    """ Yields post_events request bodies of at most batch_size events.
+
+    :param event_collection: the name of the collection to insert the events to
+    :param columns: a dict mapping column names to equally long sequences
+    :param batch_size: the maximum number of events per request body
+    :param transform: optional, a callable applied to the JSON string of
+    every row; rows it returns None for are left out
+    :param fragment: optional, JSON members written into every event, see
+    row_template()
+    """
+    prefix = "{" + _encode(event_collection) + ":["
+    batch = []
+    for row in iter_rows(columns, chunk_size=batch_size, fragment=fragment):
+        if transform is not None:
+            row = transform(row)
+            if row is None:
+                continue
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield prefix + ",".join(batch) + "]}"
+            batch = []
+    if batch:
+        yield prefix + ",".join(batch) + "]}"
+
+
+def dataframe_columns(dataframe):
+    """ Returns the columns of a pandas DataFrame as a dict, without copying
+    the underlying data.
+
+    :param dataframe: a pandas DataFrame
+    """
+    return dict((str(name), dataframe[name]) for name in dataframe.columns)
@@ -0,0 +1,157 @@
+import threading
+import zlib
+
+import six
+
+from keen import forking
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+GZIP = "gzip"
+ZSTD = "zstd"
+
+# Bodies smaller than this many bytes are sent uncompressed by default; the
+# headers and CPU time cost more than compression saves.
+DEFAULT_COMPRESSION_THRESHOLD = 1024
+
+
+def _gzip(data):
+    # wbits=31 makes zlib write a gzip header and trailer.
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+
+def _zstd(data):
+    return zstandard.ZstdCompressor().compress(data)
+
+
+def _gzip_stream():
+    return zlib.compressobj(6, zlib.DEFLATED, 31)
+
+
+def _zstd_stream():
+    return zstandard.ZstdCompressor().compressobj()
+
+
+_CODECS = {
+    GZIP: _gzip,
+    ZSTD: _zstd,
+}
+
+_STREAM_CODECS = {
+    GZIP: _gzip_stream,
+    ZSTD: _zstd_stream,
+}
+
+
+def validate_compression(codec):
+    """ Raises if codec can't be used to compress request bodies.
+
+    :param codec: None, "gzip" or "zstd"
+    """
+    if codec is None:
+        return
+    if codec not in _CODECS:
+        raise ValueError("Unsupported compression '{0}', use one of: {1}.".format(
+            codec, ", ".join(sorted(_CODECS))))
+    if codec == ZSTD and zstandard is None:
+        raise ImportError("The zstandard package is required for zstd compression.")
+
+
+class CompressionStats(object):
+    """
+    Thread-safe counters of request body bytes before and after compression.
+    """
+
+    def __init__(self):
+        super(CompressionStats, self).__init__()
+        self._lock = threading.Lock()
+        self.raw_bytes = 0
+        self.sent_bytes = 0
+        self.compressed_requests = 0
+        self.uncompressed_requests = 0
+        forking.register(self)
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+
+    def record(self, raw_size, sent_size, compressed):
+        with self._lock:
+            self.raw_bytes += raw_size
+            self.sent_bytes += sent_size
+            if compressed:
+                self.compressed_requests += 1
+            else:
+                self.uncompressed_requests += 1
+
+    @property
+    def ratio(self):
+        """ raw_bytes / sent_bytes, i.e. how many times smaller the uploads were. """
+        return float(self.raw_bytes) / self.sent_bytes if self.sent_bytes else 1.0
+
+    def __repr__(self):
+        return "CompressionStats(raw_bytes={0}, sent_bytes={1}, compressed_requests={2}, " \
+               "uncompressed_requests={3})".format(self.raw_bytes, self.sent_bytes,
+                                                   self.compressed_requests, self.uncompressed_requests)
+
+
+def encode_body(payload, codec, threshold, stats=None):
+    """ Compresses a request body if it's large enough.
+
+    :param payload: the body, str, bytes or a buffer
+    :param codec: None, "gzip" or "zstd"
+    :param threshold: bodies smaller than this many bytes are left as they are
+    :param stats: optional, a CompressionStats to record the sizes in
+    :returns: a tuple of the body and its Content-Encoding, or None if the
+    body wasn't compressed
+    """
+    if isinstance(payload, six.text_type):
+        payload = payload.encode("utf-8")
+
+    content_encoding = None
+    body = payload
+    if codec and len(payload) >= threshold:
+        body = _CODECS[codec](payload)
+        content_encoding = codec
+
+    elif not isinstance(body, six.binary_type):
+        # requests only sends bytes as-is.
+        body = bytes(body)
+
+    if stats is not None:
+        stats.record(len(payload), len(body), content_encoding is not None)
+    return body, content_encoding
+
+
+def iter_encoded_body(chunks, codec, stats=None):
+    """ Compresses a request body that is produced in pieces, as it is sent.
+
+    The total size isn't known up front, so the body is compressed whenever
+    codec is set, regardless of the threshold.
+
+    :param chunks: an iterable of bytes
+    :param codec: None, "gzip" or "zstd"
+    :param stats: optional, a CompressionStats to record the sizes in once
+    the body is exhausted
+    """
+    compressor = _STREAM_CODECS[codec]() if codec else None
+    raw_size = sent_size = 0
+    for chunk in chunks:
+        raw_size += len(chunk)
+        if compressor is not None:
+            chunk = compressor.compress(chunk)
+            if not chunk:
+                continue
+        sent_size += len(chunk)
+        yield chunk
+    if compressor is not None:
+        chunk = compressor.flush()
+        sent_size += len(chunk)
+        if chunk:
+            yield chunk
+
+    if stats is not None:
+        stats.record(raw_size, sent_size, compressor is not None)
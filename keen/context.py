@@ -0,0 +1,178 @@
+import json
+
+import six
+
+from keen import batching, columnar, payloads
+
+
+class EventContext(object):
+    """
+    Properties shared by many events (host, build, region, ...), kept once
+    and merged into each event only while it is encoded.
+
+    The shared properties are encoded to a JSON fragment once. When an event
+    body has none of the context's top-level keys, which is the common case,
+    encoding the event is a single splice of that fragment and the encoded
+    body; no merged dict is built.
+    """
+
+    __slots__ = ("properties", "keys", "fragment")
+
+    def __init__(self, properties):
+        """ Initializes an EventContext.
+
+        :param properties: dict of the properties to add to every event
+        """
+        self.properties = dict(properties)
+        self.keys = frozenset(self.properties)
+        # '"host":"a","build":12' without the surrounding braces
+        self.fragment = json.dumps(self.properties)[1:-1]
+
+    def merged(self, properties):
+        """ Returns a new EventContext with properties added to (or replacing)
+        the ones of this context.
+
+        :param properties: dict of properties
+        """
+        combined = dict(self.properties)
+        combined.update(properties)
+        return EventContext(combined)
+
+    def fragment_without(self, names):
+        """ Returns the JSON fragment of the properties whose names aren't
+        in names.
+
+        :param names: an iterable of top-level property names
+        """
+        names = frozenset(names)
+        if self.keys.isdisjoint(names):
+            return self.fragment
+        return json.dumps(dict((name, value) for name, value in six.iteritems(self.properties)
+                               if name not in names))[1:-1]
+
+    def encode(self, body):
+        """ Encodes an event body with the context properties merged in.
+        Properties of the body win over context properties of the same name.
+
+        :param body: the event body, a dict or JSON bytes/str
+        :returns: a JSON string
+        """
+        if payloads.is_serialized(body):
+            body = json.loads(body)
+        if not self.fragment:
+            return json.dumps(body)
+        if not self.keys.isdisjoint(body):
+            merged = dict(self.properties)
+            merged.update(body)
+            return json.dumps(merged)
+        encoded = json.dumps(body)
+        if encoded == "{}":
+            return "{" + self.fragment + "}"
+        return "{" + self.fragment + "," + encoded[1:]
+
+
+class ContextClient(object):
+    """
+    A view of a KeenClient that adds a set of shared properties to every event
+    it sends, by every method that adds events. Everything else is delegated
+    to the client.
+
+    Create one with KeenClient.with_context().
+    """
+
+    def __init__(self, client, context):
+        """ Initializes a ContextClient.
+
+        :param client: the KeenClient to send events with
+        :param context: the EventContext to merge into every event
+        """
+        super(ContextClient, self).__init__()
+        self.client = client
+        self.context = context
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def with_context(self, properties):
+        """ Returns a ContextClient that adds properties on top of this
+        client's context.
+
+        :param properties: dict of properties to add to every event
+        """
+        return ContextClient(self.client, self.context.merged(properties))
+
+    def add_event(self, event_collection, event_body, timestamp=None):
+        """ Adds an event with the context properties merged in.
+
+        :param event_collection: the name of the collection to insert the
+        event to
+        :param event_body: dict, the body of the event to insert the event to
+        :param timestamp: datetime, optional, the timestamp of the event
+        """
+        return self.client.add_event(event_collection, event_body, timestamp=timestamp,
+                                     context=self.context)
+
+    def add_events(self, events):
+        """ Adds a batch of events with the context properties merged in. The
+        events are validated and encoded here and passed on already
+        serialized.
+
+        :param events: dictionary of events
+        """
+        if self.client.validator is not None:
+            events = self.client.validator.filter_events(events)
+        encode = self.context.encode
+        return self.client.add_events(dict(
+            (collection, [encode(event) for event in collection_events])
+            for collection, collection_events in six.iteritems(events)
+        ))
+
+    def add_events_stream(self, events, **kwargs):
+        """ Adds events from an iterator or generator with the context
+        properties merged in. See KeenClient.add_events_stream().
+
+        :param events: an iterable of (collection, event) pairs, or a dict
+        mapping collection names to iterables of events
+        """
+        encode = self.context.encode
+        pairs = batching.iter_event_pairs(events)
+        if self.client.validator is not None:
+            check = self.client.validator.check
+            pairs = ((collection, event) for collection, event in pairs if check(collection, event))
+        pairs = ((collection, encode(event)) for collection, event in pairs)
+        return self.client.add_events_stream(pairs, **kwargs)
+
+    def add_events_chunked(self, events, **kwargs):
+        """ Adds a batch of events in a streamed request with the context
+        properties merged in. See KeenClient.add_events_chunked().
+
+        :param events: dict mapping collection names to iterables of events
+        """
+        encode = self.context.encode
+        validator = self.client.validator
+        check = validator.check if validator is not None else lambda collection, event: True
+        return self.client.add_events_chunked(dict(
+            (collection, (encode(event) for event in collection_events if check(collection, event)))
+            for collection, collection_events in six.iteritems(events)
+        ), **kwargs)
+
+    def add_events_columnar(self, event_collection, columns, **kwargs):
+        """ Adds a batch of events given as columns with the context
+        properties merged in. Columns win over context properties of the same
+        top-level name. See KeenClient.add_events_columnar().
+
+        :param event_collection: the name of the collection to insert the
+        events to
+        :param columns: dict mapping property names to equally long sequences
+        """
+        return self.client.add_events_columnar(event_collection, columns, context=self.context, **kwargs)
+
+    def add_dataframe(self, event_collection, dataframe, **kwargs):
+        """ Adds every row of a pandas DataFrame as an event with the context
+        properties merged in. See KeenClient.add_dataframe().
+
+        :param event_collection: the name of the collection to insert the
+        events to
+        :param dataframe: a pandas DataFrame
+        """
+        return self.add_events_columnar(event_collection, columnar.dataframe_columns(dataframe), **kwargs)
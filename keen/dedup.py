@@ -0,0 +1,258 @@
+""" Suppression of events that were already uploaded, by keen.id.
+
+Events get a random keen.id when they are added, so a retry, a spool
+replay or a re-injected spill carries the same id as the first attempt. A
+Deduplicator remembers the ids Keen acknowledged in Bloom filters and drops
+events with those ids from later uploads.
+
+Memory is bounded: the filters are sized for capacity ids per window, and
+an id is remembered for one to two windows. In exchange, a new event is
+wrongly taken for a resend with probability error_rate.
+"""
+
+import hashlib
+import json
+import math
+import os
+import struct
+import tempfile
+import threading
+import time
+import uuid
+
+import six
+
+from keen import forking, payloads
+
+_MAGIC = b"KEENDDP1"
+
+
+class BloomFilter(object):
+    """ A Bloom filter of strings with a target false positive rate. """
+
+    def __init__(self, capacity, error_rate, bits=None):
+        """ Initializes a BloomFilter.
+
+        :param capacity: the number of items the error rate holds for
+        :param error_rate: the false positive rate at capacity items
+        :param bits: optional, the bit array of a saved filter
+        """
+        super(BloomFilter, self).__init__()
+        if capacity <= 0 or not 0 < error_rate < 1:
+            raise ValueError("A Bloom filter needs a positive capacity and an error rate in (0, 1).")
+        self.size = int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, int(round(self.size / float(capacity) * math.log(2))))
+        self.bits = bytearray(bits) if bits is not None else bytearray((self.size + 7) // 8)
+        if len(self.bits) != (self.size + 7) // 8:
+            raise ValueError("The saved bits don't match the filter's size.")
+
+    def _positions(self, item):
+        # Double hashing: position i is h1 + i * h2, from one MD5 digest.
+        h1, h2 = struct.unpack("<QQ", hashlib.md5(item.encode("utf-8")).digest())
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, item):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item):
+        bits = self.bits
+        for position in self._positions(item):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+
+class Deduplicator(object):
+    """
+    Assigns keen.ids to events and drops the events whose id Keen already
+    acknowledged. KeenApi.post_events() and post_events_stream() consult it
+    for every upload, and KeenClient.add_events_columnar() for every row, so
+    it covers direct, streamed and columnar uploads, retries, spool replays
+    and every persistence strategy alike.
+    """
+
+    def __init__(self, capacity=1000000, error_rate=0.001, window=3600.0, path=None):
+        """ Initializes a Deduplicator.
+
+        :param capacity: the most acknowledged ids per window the error rate
+        holds for
+        :param error_rate: the probability that a new event is taken for a
+        resend and dropped
+        :param window: the least time in seconds an acknowledged id is
+        remembered
+        :param path: optional, a file the filters are saved to with save()
+        and loaded from on start, so resends are caught across restarts
+        """
+        super(Deduplicator, self).__init__()
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.window = window
+        self.path = path
+        self.acknowledged = 0
+        self.suppressed = 0
+        self._lock = threading.Lock()
+        # Ids acknowledged in the current window, and in the one before.
+        self._current = BloomFilter(capacity, error_rate)
+        self._previous = BloomFilter(capacity, error_rate)
+        self._started = time.time()
+        if path is not None and os.path.exists(path):
+            self._load()
+        forking.register(self)
+
+    def _after_fork(self):
+        # The filters stay valid in the child; only the lock is replaced.
+        self._lock = threading.Lock()
+
+    def assign(self, event):
+        """ Returns the event with a new random keen.id unless it has one.
+        Dict events are copied, not modified.
+
+        :param event: the event body, a dict or JSON bytes/str
+        """
+        if payloads.is_serialized(event):
+            text = _text(event)
+            if '"keen"' not in text:
+                # Spliced in; no need to decode the event.
+                body = text.lstrip()[1:].lstrip()
+                separator = "" if body.startswith("}") else ","
+                return '{"keen":{"id":"' + uuid.uuid4().hex + '"}' + separator + body
+            body = json.loads(text)
+            if _get_id(body) is not None:
+                return event
+            return json.dumps(self.assign(body))
+        if _get_id(event) is not None:
+            return event
+        event = dict(event)
+        keen = dict(event.get("keen") or {})
+        keen["id"] = uuid.uuid4().hex
+        event["keen"] = keen
+        return event
+
+    def event_id(self, event):
+        """ Returns the keen.id of an event, None if it has none. """
+        if payloads.is_serialized(event):
+            text = _text(event)
+            if '"keen"' not in text:
+                return None
+            event = json.loads(text)
+        return _get_id(event)
+
+    def seen(self, event_id):
+        """ Whether Keen acknowledged the id within the window, or is
+        falsely thought to have.
+        """
+        with self._lock:
+            self._rotate(time.time())
+            return event_id in self._current or event_id in self._previous
+
+    def acknowledge(self, event_ids):
+        """ Remembers ids that Keen acknowledged. """
+        with self._lock:
+            self._rotate(time.time())
+            for event_id in event_ids:
+                self._current.add(event_id)
+                self.acknowledged += 1
+
+    def filter(self, events):
+        """ Drops the events whose ids were acknowledged already.
+
+        :param events: dict mapping collection names to lists of events
+        :returns: the remaining events, and a dict mapping collection names to
+        the lists of their ids (None for events without one)
+        """
+        remaining = {}
+        ids = {}
+        for collection, collection_events in six.iteritems(events):
+            ids[collection] = []
+            remaining[collection] = list(self.filter_iterable(collection_events, ids[collection]))
+        return remaining, ids
+
+    def filter_iterable(self, events, ids):
+        """ Yields the events of an iterable whose ids weren't acknowledged
+        already, lazily.
+
+        :param events: an iterable of events
+        :param ids: a list the id of every yielded event is appended to (None
+        for events without one)
+        """
+        for event in events:
+            event_id = self.event_id(event)
+            if event_id is not None and self.seen(event_id):
+                self.suppressed += 1
+                continue
+            ids.append(event_id)
+            yield event
+
+    def acknowledge_result(self, ids, result):
+        """ Remembers the ids of the events a post_events response accepted.
+
+        :param ids: dict mapping collection names to the lists of the ids of
+        the uploaded events, in upload order
+        :param result: the post_events response
+        """
+        acknowledged = []
+        for collection, collection_ids in six.iteritems(ids):
+            statuses = result.get(collection) if isinstance(result, dict) else None
+            if not isinstance(statuses, list):
+                # Not a per-event result; the request succeeded, so all were accepted.
+                statuses = [{"success": True}] * len(collection_ids)
+            acknowledged.extend(event_id for event_id, status in zip(collection_ids, statuses)
+                                if event_id is not None and isinstance(status, dict) and status.get("success"))
+        self.acknowledge(acknowledged)
+
+    def save(self):
+        """ Writes the filters to path, atomically. """
+        if self.path is None:
+            return
+        with self._lock:
+            header = json.dumps({"capacity": self.capacity, "error_rate": self.error_rate, "window": self.window,
+                                 "started": self._started}).encode("utf-8")
+            data = b"".join([_MAGIC, header, b"\n", bytes(self._current.bits), bytes(self._previous.bits)])
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, temporary = tempfile.mkstemp(dir=directory, prefix=".keen-dedup-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.rename(temporary, self.path)
+        except Exception:
+            os.remove(temporary)
+            raise
+
+    def _load(self):
+        with open(self.path, "rb") as f:
+            data = f.read()
+        if not data.startswith(_MAGIC):
+            return
+        header, _, bits = data[len(_MAGIC):].partition(b"\n")
+        header = json.loads(header.decode("utf-8"))
+        if (header["capacity"], header["error_rate"]) != (self.capacity, self.error_rate):
+            # Differently sized filters; start over.
+            return
+        length = len(self._current.bits)
+        self._current = BloomFilter(self.capacity, self.error_rate, bits[:length])
+        self._previous = BloomFilter(self.capacity, self.error_rate, bits[length:])
+        self._started = header["started"]
+        self._rotate(time.time())
+
+    def _rotate(self, now):
+        elapsed = now - self._started
+        if elapsed < self.window:
+            return
+        if elapsed < 2 * self.window:
+            self._previous = self._current
+        else:
+            self._previous = BloomFilter(self.capacity, self.error_rate)
+        self._current = BloomFilter(self.capacity, self.error_rate)
+        self._started = now
+
+
+def _get_id(event):
+    keen = event.get("keen")
+    if isinstance(keen, dict):
+        return keen.get("id")
+    return None
+
+
+def _text(event):
+    return event if isinstance(event, six.text_type) else bytes(event).decode("utf-8")
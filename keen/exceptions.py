@@ -26,9 +26,10 @@ class InvalidPersistenceStrategyError(BaseKeenClientError):
 
 
 class KeenApiError(BaseKeenClientError):
-    def __init__(self, api_error):
+    def __init__(self, api_error, status_code=None):
         super(KeenApiError, self).__init__(api_error)
         self.api_error = api_error
+        self.status_code = status_code
         self._message = "Error from Keen API. Details:\n Message: {0}\nCode: " \
                         "{1}".format(api_error["message"], api_error["error_code"])
         if "stacktrace_id" in api_error:
@@ -40,4 +41,18 @@ class KeenApiError(BaseKeenClientError):
 class InvalidEnvironmentError(BaseKeenClientError):
     def __init__(self, message):
         super(InvalidEnvironmentError, self).__init__(message)
-        self._message = message
\ No newline at end of file
+        self._message = message
+
+
+class BufferFullError(BaseKeenClientError):
+    def __init__(self, message):
+        super(BufferFullError, self).__init__(message)
+        self._message = message
+
+
+class InvalidEventError(BaseKeenClientError):
+    def __init__(self, event_collection, problems):
+        super(InvalidEventError, self).__init__(event_collection, problems)
+        self.event_collection = event_collection
+        self.problems = problems
+        self._message = "Invalid event for collection {0}: {1}".format(event_collection, "; ".join(problems))
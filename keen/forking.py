@@ -0,0 +1,46 @@
+""" Keeps Keen objects usable in processes forked from the one that created
+them, e.g. gunicorn or uwsgi workers forked from a master that imported keen.
+
+A forked child inherits its parent's sockets, locks and queued events but
+none of its threads. Objects registered here get their _after_fork() method
+called in the child, where they drop that shared state: KeenApi rebuilds its
+session and connection pool, buffers start out empty and background workers
+are restarted on first use. The hook runs from os.register_at_fork where it
+exists (Python 3.7+), and otherwise the first time check() sees a new PID.
+"""
+
+import os
+import weakref
+
+_pid = os.getpid()
+_objects = weakref.WeakSet()
+
+
+def register(obj):
+    """ Calls obj._after_fork() in every process forked from this one, for as
+    long as obj is alive.
+
+    :param obj: an object with an _after_fork() method
+    """
+    _objects.add(obj)
+
+
+def check():
+    """ Runs the fork handlers if this process is a fork that hasn't run them
+    yet. Cheap enough to call before every request.
+    """
+    if os.getpid() != _pid:
+        _after_fork()
+
+
+def _after_fork():
+    global _pid
+    _pid = os.getpid()
+    # No locks here: a thread of the parent may have held any of them at the
+    # moment of the fork, and it doesn't exist in the child to release them.
+    for obj in list(_objects):
+        obj._after_fork()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork)
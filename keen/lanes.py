@@ -0,0 +1,193 @@
+""" Priority lanes for LanedPersistenceStrategy: separately buffered streams
+of events, e.g. billing events that must not wait behind a flood of
+clickstream events, drained with weighted fairness.
+"""
+
+import threading
+import time
+
+from keen import buffer as event_buffer
+from keen import forking
+
+
+class Lane(object):
+    """
+    A named stream of events with its own buffer limits, overflow policy,
+    batch size and flush cadence.
+
+    A lane is ready to upload once it holds a full batch, or holds any event
+    and flush_interval has passed since it was last drained. Among the ready
+    lanes, each gets upload turns in proportion to its weight.
+    """
+
+    def __init__(self, name, collections=(), weight=1, batch_size=500, flush_interval=1.0, max_events=10000,
+                 max_bytes=16 * 1024 * 1024, overflow_policy=event_buffer.OverflowPolicy.DROP_NEWEST,
+                 block_timeout=5.0):
+        """ Initializes a Lane.
+
+        :param name: the name of the lane
+        :param collections: the collections whose events go to this lane
+        :param weight: the lane's share of upload turns relative to the other
+        ready lanes
+        :param batch_size: the maximum number of events per upload
+        :param flush_interval: the longest time in seconds an event waits for
+        its batch to fill up
+        :param max_events: the most events the lane buffers
+        :param max_bytes: the most bytes of events the lane buffers
+        :param overflow_policy: what happens to events that don't fit, one
+        of keen.buffer.OverflowPolicy
+        :param block_timeout: seconds to wait for room with the BLOCK policy
+        """
+        super(Lane, self).__init__()
+        if weight <= 0:
+            raise ValueError("A lane's weight must be positive.")
+        self.name = name
+        self.collections = frozenset(collections)
+        self.weight = weight
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_events = max_events
+        self.max_bytes = max_bytes
+        self.overflow_policy = overflow_policy
+        self.block_timeout = block_timeout
+        self.buffer = None
+        self.last_drained = time.time()
+        # Smooth weighted round-robin state, see LaneScheduler.
+        self.credit = 0
+
+    def open(self, spool=None):
+        """ Creates the lane's buffer.
+
+        :param spool: the spill of the buffer, used with the SPILL policy,
+        e.g. a keen.spool.SpillWriter
+        """
+        self.buffer = event_buffer.EventBuffer(max_events=self.max_events, max_bytes=self.max_bytes,
+                                               overflow_policy=self.overflow_policy,
+                                               block_timeout=self.block_timeout, spill=spool)
+
+    def wait_left(self, now):
+        """ Seconds until the lane is ready, 0 if it is, None if it is empty. """
+        depth = self.buffer.depth
+        if not depth:
+            return None
+        if depth >= self.batch_size:
+            return 0
+        return max(0, self.last_drained + self.flush_interval - now)
+
+
+class LaneScheduler(object):
+    """
+    Picks the lane to upload from next with smooth weighted round-robin:
+    every ready lane earns its weight in credit, the lane with the most
+    credit is picked and pays the total weight of the ready lanes. Over time
+    each lane gets turns in proportion to its weight, and a heavy lane's
+    turns are spread out rather than bunched together.
+    """
+
+    def __init__(self, lanes, default_lane):
+        """ Initializes a LaneScheduler.
+
+        :param lanes: the Lanes, with their buffers open
+        :param default_lane: the name of the lane for collections that no
+        lane lists
+        """
+        super(LaneScheduler, self).__init__()
+        self.lanes = list(lanes)
+        self.by_name = dict((lane.name, lane) for lane in self.lanes)
+        if len(self.by_name) != len(self.lanes):
+            raise ValueError("Lane names must be unique.")
+        if default_lane not in self.by_name:
+            raise ValueError("Unknown default lane '{0}'.".format(default_lane))
+        self.default_lane = self.by_name[default_lane]
+        self.routes = {}
+        for lane in self.lanes:
+            for collection in lane.collections:
+                if collection in self.routes:
+                    raise ValueError("Collection '{0}' is in more than one lane.".format(collection))
+                self.routes[collection] = lane
+        self._reset()
+        forking.register(self)
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._arrived = threading.Event()
+
+    def _after_fork(self):
+        # The lanes' buffers reset themselves.
+        self._reset()
+
+    def lane_for(self, collection):
+        return self.routes.get(collection, self.default_lane)
+
+    def put(self, collection, data):
+        accepted = self.lane_for(collection).buffer.put(collection, data)
+        self._arrived.set()
+        return accepted
+
+    def pick(self, flushing=False):
+        """ Returns the ready lane whose turn it is, None if none is ready.
+
+        :param flushing: whether any lane with events counts as ready
+        """
+        now = time.time()
+        with self._lock:
+            ready = [lane for lane in self.lanes
+                     if (lane.buffer.depth if flushing else lane.wait_left(now) == 0)]
+            if not ready:
+                return None
+            total = 0
+            for lane in ready:
+                lane.credit += lane.weight
+                total += lane.weight
+            chosen = max(ready, key=lambda lane: lane.credit)
+            chosen.credit -= total
+            chosen.last_drained = now
+            return chosen
+
+    def take(self, max_bytes, timeout, flushing=False, max_events=None):
+        """ Takes a batch from the next ready lane, waiting up to timeout
+        seconds for one to become ready.
+
+        :param max_bytes: the approximate maximum size of the batch
+        :param timeout: seconds to wait, None to wait indefinitely
+        :param flushing: whether any lane with events counts as ready
+        :param max_events: optional, a cap on the lanes' batch sizes
+        :returns: a list of (collection, data) tuples, empty on timeout
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            lane = self.pick(flushing)
+            if lane is not None:
+                batch_size = lane.batch_size if max_events is None else min(lane.batch_size, max_events)
+                items = lane.buffer.take(batch_size, max_bytes=max_bytes, timeout=0)
+                if items:
+                    return items
+                continue
+            now = time.time()
+            waits = [wait for wait in (lane.wait_left(now) for lane in self.lanes) if wait is not None]
+            wait = min(waits) if waits else None
+            if deadline is not None:
+                remaining = deadline - now
+                if remaining <= 0:
+                    return []
+                wait = remaining if wait is None else min(wait, remaining)
+            self._arrived.clear()
+            self._arrived.wait(wait)
+
+    def clear(self):
+        items = []
+        for lane in self.lanes:
+            items.extend(lane.buffer.clear())
+        return items
+
+    def stats(self):
+        """ Returns the summed counters of all lanes, with each lane's own
+        counters under "lanes".
+        """
+        stats = {"depth": 0, "bytes": 0, "accepted": 0, "dropped": 0, "spilled": 0, "lanes": {}}
+        for lane in self.lanes:
+            lane_stats = lane.buffer.stats()
+            for name in ("depth", "bytes", "accepted", "dropped", "spilled"):
+                stats[name] += lane_stats[name]
+            stats["lanes"][lane.name] = lane_stats
+        return stats
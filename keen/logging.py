@@ -0,0 +1,207 @@
+""" A logging handler that ships log records to a Keen collection.
+
+    import logging
+    from keen.logging import KeenHandler
+
+    logging.getLogger().addHandler(KeenHandler(client, "logs", level=logging.INFO))
+"""
+from __future__ import absolute_import
+
+import collections
+import json
+import logging
+import random
+import threading
+import time
+import traceback
+
+import six
+
+from keen import forking, sampling
+
+# Attributes every LogRecord has; the others were passed with extra=.
+_RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))).union(["message", "asctime"])
+
+_SCALAR_TYPES = six.string_types + six.integer_types + (six.text_type, float, bool, type(None))
+
+
+class KeenHandler(logging.Handler):
+    """
+    A logging.Handler that never waits for the Keen API. emit() only appends
+    the record to a bounded queue; a background thread turns the records
+    into events, formatting their messages there, and uploads them with
+    post_events in batches.
+
+    When the queue is full, new records are dropped and counted rather than
+    blocking the caller. Noisy levels can be sampled with sample_rates; the
+    kept records get a sample_weight like keen.sampling does.
+    """
+
+    def __init__(self, client, collection="logs", level=logging.NOTSET, max_queue=10000, batch_size=500,
+                 flush_interval=1.0, sample_rates=None):
+        """ Initializes a KeenHandler.
+
+        :param client: the KeenClient whose api uploads the events
+        :param collection: the collection to add the log events to
+        :param level: the lowest level handled
+        :param max_queue: the most records waiting for upload
+        :param batch_size: the most records per upload
+        :param flush_interval: the longest time in seconds a record waits for
+        its batch to fill up
+        :param sample_rates: optional, dict mapping levels to the fraction of
+        their records to keep, e.g. {logging.DEBUG: 0.01}
+        """
+        super(KeenHandler, self).__init__(level)
+        self.client = client
+        self.collection = collection
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.sample_rates = dict(sample_rates or {})
+        self.shipped = 0
+        self.dropped = 0
+        self.failed = 0
+        self.last_error = None
+        self._reset()
+        forking.register(self)
+
+    def _reset(self):
+        # deque appends and pops are atomic, so emit() takes no lock.
+        self._queue = collections.deque()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self._ship_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+        self._local = threading.local()
+
+    def _after_fork(self):
+        # The queued records are the parent's to ship.
+        self._reset()
+
+    def emit(self, record):
+        if getattr(self._local, "shipping", False):
+            # Records logged while uploading (requests, urllib3) would
+            # otherwise feed back into the queue forever.
+            return
+        rate = self.sample_rates.get(record.levelno)
+        if rate is not None:
+            if random.random() >= rate:
+                return
+            record.keen_sample_weight = 1.0 / rate
+        if len(self._queue) >= self.max_queue:
+            self.dropped += 1
+            return
+        self._queue.append(record)
+        self._ensure_thread()
+        if len(self._queue) >= self.batch_size:
+            self._wake.set()
+
+    def to_event(self, record):
+        """ Returns the event body of a log record. Override to change the
+        properties sent.
+
+        :param record: a logging.LogRecord
+        """
+        event = {
+            "level": record.levelname,
+            "logger": record.name,
+            "message": self.format(record) if self.formatter is not None else record.getMessage(),
+            "module": record.module,
+            "function": record.funcName,
+            "line": record.lineno,
+            "path": record.pathname,
+            "process": record.process,
+            "thread": record.threadName,
+            "keen": {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) +
+                     ".{0:03d}Z".format(int(record.msecs))},
+        }
+        if record.exc_info:
+            event["exception"] = "".join(traceback.format_exception(*record.exc_info))
+        extra = {}
+        for name, value in vars(record).items():
+            if name in _RECORD_ATTRIBUTES:
+                continue
+            if name == "keen_sample_weight":
+                event[sampling.DEFAULT_WEIGHT_PROPERTY] = value
+                continue
+            extra[name] = value if isinstance(value, _SCALAR_TYPES) else _jsonable(value)
+        if extra:
+            event["extra"] = extra
+        return event
+
+    def flush(self):
+        """ Uploads every queued record. """
+        while self._ship():
+            pass
+
+    def close(self):
+        """ Stops the background thread and uploads the queued records.
+        logging.shutdown() calls this at exit.
+        """
+        self._closed = True
+        self._wake.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(self.flush_interval + 5)
+        self.flush()
+        super(KeenHandler, self).close()
+
+    def _ensure_thread(self):
+        forking.check()
+        if self._thread is not None or self._closed:
+            return
+        with self._thread_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="keen-logging")
+                self._thread.daemon = True
+                self._thread.start()
+
+    def _run(self):
+        while not self._closed:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            while self._ship():
+                pass
+
+    def _ship(self):
+        """ Uploads one batch of records.
+
+        :returns: the number of records taken off the queue
+        """
+        with self._ship_lock:
+            records = []
+            popleft = self._queue.popleft
+            try:
+                while len(records) < self.batch_size:
+                    records.append(popleft())
+            except IndexError:
+                pass
+            if not records:
+                return 0
+            events = []
+            for record in records:
+                try:
+                    events.append(self.to_event(record))
+                except Exception:
+                    self.failed += 1
+            self._local.shipping = True
+            try:
+                self.client.api.post_events({self.collection: events})
+            except Exception as e:
+                self.failed += len(events)
+                self.last_error = e
+            else:
+                self.shipped += len(events)
+            finally:
+                self._local.shipping = False
+            return len(records)
+
+
+def _jsonable(value):
+    # One unserializable extra would fail the whole batch.
+    try:
+        json.dumps(value)
+    except (TypeError, ValueError):
+        return repr(value)
+    return value
@@ -0,0 +1,358 @@
+""" A transactional outbox of serialized events in a local SQLite database,
+used by OutboxPersistenceStrategy.
+
+Events are rows of an outbox table. They can be inserted in the same
+transaction as the application's own writes, so an event is recorded if and
+only if that transaction commits, or through a GroupCommitter, which commits
+the inserts of many threads together. An OutboxDrainer uploads the rows in
+post_events batches and deletes them once Keen has acknowledged them.
+
+Processes sharing a database, e.g. forked workers, each run a drainer. A
+drainer claims the rows it is about to upload for a lease in a write
+transaction, so the others skip them until the lease runs out.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from keen import buffer as event_buffer
+
+DEFAULT_OUTBOX_TABLE = "keen_outbox"
+
+# Seconds a drainer may take to upload the rows it claimed before other
+# drainers may claim them again.
+DEFAULT_LEASE = 300.0
+
+
+class SQLiteOutbox(object):
+    """
+    The outbox table of a SQLite database file. Opens connections in WAL
+    mode, so inserts and the drainer's reads don't block each other.
+    """
+
+    def __init__(self, path, table=DEFAULT_OUTBOX_TABLE, timeout=30.0):
+        """ Initializes a SQLiteOutbox and creates its table if needed.
+
+        :param path: the SQLite database file
+        :param table: the name of the outbox table
+        :param timeout: seconds to wait for another connection's write lock
+        """
+        super(SQLiteOutbox, self).__init__()
+        if not table.replace("_", "").isalnum():
+            raise ValueError("Invalid outbox table name '{0}'.".format(table))
+        self.path = path
+        self.table = table
+        self.timeout = timeout
+        connection = self.connect()
+        try:
+            self.create_table(connection)
+        finally:
+            connection.close()
+
+    def connect(self):
+        """ Opens a new connection in WAL mode. Connections can't be shared
+        between threads.
+        """
+        connection = sqlite3.connect(self.path, timeout=self.timeout)
+        connection.execute("PRAGMA journal_mode=WAL")
+        # With WAL, NORMAL only risks the last commits on power loss, not
+        # corruption, and saves an fsync per commit.
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def create_table(self, connection):
+        """ Creates the outbox table if it doesn't exist yet. """
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS {0} (id INTEGER PRIMARY KEY AUTOINCREMENT, collection TEXT NOT NULL, "
+            "event BLOB NOT NULL, created REAL NOT NULL, claimed_by TEXT, claimed_until REAL)".format(self.table))
+        columns = set(row[1] for row in connection.execute("PRAGMA table_info({0})".format(self.table)))
+        # Tables created before rows were claimed.
+        if "claimed_by" not in columns:
+            connection.execute("ALTER TABLE {0} ADD COLUMN claimed_by TEXT".format(self.table))
+        if "claimed_until" not in columns:
+            connection.execute("ALTER TABLE {0} ADD COLUMN claimed_until REAL".format(self.table))
+        connection.commit()
+
+    def insert(self, connection, items):
+        """ Inserts events without committing.
+
+        :param connection: the connection (and transaction) to insert with
+        :param items: a list of (collection, data) tuples, data being the
+        event as JSON bytes
+        """
+        now = time.time()
+        connection.executemany(
+            "INSERT INTO {0} (collection, event, created) VALUES (?, ?, ?)".format(self.table),
+            [(collection, sqlite3.Binary(data), now) for collection, data in items])
+
+    def read(self, connection, limit):
+        """ Returns up to limit of the oldest rows as (id, collection, data) tuples. """
+        rows = connection.execute(
+            "SELECT id, collection, event FROM {0} ORDER BY id LIMIT ?".format(self.table), (limit,)).fetchall()
+        return [(row_id, collection, bytes(data)) for row_id, collection, data in rows]
+
+    def claim(self, connection, limit, owner, lease=DEFAULT_LEASE):
+        """ Claims up to limit of the oldest rows that no one else holds a
+        lease on, and commits.
+
+        :param connection: a connection without an open transaction
+        :param limit: the most rows to claim
+        :param owner: a string identifying the claiming drainer
+        :param lease: seconds until the rows may be claimed again
+        :returns: the claimed rows as (id, collection, data) tuples
+        """
+        now = time.time()
+        # IMMEDIATE takes the write lock before reading, so no two drainers
+        # can read the same unclaimed rows.
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            rows = connection.execute(
+                "SELECT id, collection, event FROM {0} WHERE claimed_until IS NULL OR claimed_until < ? "
+                "ORDER BY id LIMIT ?".format(self.table), (now, limit)).fetchall()
+            connection.executemany(
+                "UPDATE {0} SET claimed_by = ?, claimed_until = ? WHERE id = ?".format(self.table),
+                [(owner, now + lease, row[0]) for row in rows])
+            connection.commit()
+        except BaseException:
+            connection.rollback()
+            raise
+        return [(row_id, collection, bytes(data)) for row_id, collection, data in rows]
+
+    def release(self, connection, ids, owner):
+        """ Gives up the claim of owner on rows, and commits. """
+        connection.executemany(
+            "UPDATE {0} SET claimed_by = NULL, claimed_until = NULL WHERE id = ? AND claimed_by = ?".format(
+                self.table), [(row_id, owner) for row_id in ids])
+        connection.commit()
+
+    def delete(self, connection, ids):
+        """ Deletes rows and commits. """
+        connection.executemany("DELETE FROM {0} WHERE id = ?".format(self.table), [(row_id,) for row_id in ids])
+        connection.commit()
+
+    def backlog(self, connection):
+        """ Returns the number of rows waiting to be uploaded and the age in
+        seconds of the oldest one (0 when there are none) as a dict.
+        """
+        depth, oldest = connection.execute(
+            "SELECT COUNT(*), MIN(created) FROM {0}".format(self.table)).fetchone()
+        return {"depth": depth, "age": time.time() - oldest if oldest is not None else 0.0}
+
+
+class GroupCommitter(object):
+    """
+    Commits the inserts of many threads in shared transactions.
+
+    Threads hand their events to submit() and, by default, wait until the
+    transaction that contains them commits. A single thread collects
+    everything submitted within commit_interval of the first pending event
+    and writes it in one transaction, so thousands of inserts a second cost a
+    few commits instead of thousands.
+    """
+
+    def __init__(self, outbox, commit_interval=0.01):
+        """ Initializes a GroupCommitter.
+
+        :param outbox: the SQLiteOutbox to insert into
+        :param commit_interval: seconds to collect events for a transaction
+        """
+        super(GroupCommitter, self).__init__()
+        self.outbox = outbox
+        self.commit_interval = commit_interval
+        self.commits = 0
+        self.last_error = None
+        self._reset()
+
+    def _reset(self):
+        self._condition = threading.Condition(threading.Lock())
+        self._pending = []
+        # Transactions are numbered; submit() waits for its number to commit.
+        self._filling = 1
+        self._committed = 0
+        self._errors = {}
+        self._thread = None
+        self._stop = False
+
+    def submit(self, items, wait=True):
+        """ Queues events for the next transaction.
+
+        :param items: a list of (collection, data) tuples
+        :param wait: whether to wait until the events are committed
+        :raises Exception: the error of the transaction with the events, if
+        it failed
+        """
+        with self._condition:
+            self._ensure_thread()
+            self._pending.extend(items)
+            number = self._filling
+            self._condition.notify_all()
+            if not wait:
+                return
+            while self._committed < number:
+                self._condition.wait()
+            error = self._errors.get(number)
+        if error is not None:
+            raise error
+
+    def flush(self):
+        """ Waits until everything submitted so far is committed. """
+        with self._condition:
+            # The transaction being filled, or else the one being written.
+            number = self._filling if self._pending else self._filling - 1
+            while self._committed < number:
+                self._condition.wait()
+
+    def stop(self, timeout=None):
+        """ Commits what is pending and stops the commit thread.
+
+        :param timeout: optional, the most seconds to wait for the thread
+        """
+        with self._condition:
+            self._stop = True
+            self._condition.notify_all()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop = False
+            self._thread = threading.Thread(target=self._run, name="keen-outbox-commit")
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _run(self):
+        connection = self.outbox.connect()
+        try:
+            while True:
+                with self._condition:
+                    while not self._pending and not self._stop:
+                        self._condition.wait()
+                    if not self._pending:
+                        return
+                # Let more events join this transaction.
+                time.sleep(self.commit_interval)
+                with self._condition:
+                    items, self._pending = self._pending, []
+                    number = self._filling
+                    self._filling += 1
+                error = None
+                try:
+                    self.outbox.insert(connection, items)
+                    connection.commit()
+                    self.commits += 1
+                except Exception as e:
+                    connection.rollback()
+                    self.last_error = error = e
+                with self._condition:
+                    self._committed = number
+                    if error is not None:
+                        self._errors[number] = error
+                    # Waiters of older transactions have seen their result.
+                    self._errors.pop(number - 100, None)
+                    self._condition.notify_all()
+        finally:
+            connection.close()
+
+
+class OutboxDrainer(object):
+    """
+    A background thread that uploads outbox rows, oldest first, and deletes
+    them once the upload succeeded. Failed uploads leave the rows in place
+    and back off exponentially.
+
+    Rows are claimed for a lease before they are uploaded, so drainers of
+    other processes don't upload them too.
+    """
+
+    def __init__(self, outbox, post, batch_size=500, interval=1.0, max_backoff=60.0, lease=DEFAULT_LEASE):
+        """ Initializes an OutboxDrainer.
+
+        :param outbox: the SQLiteOutbox to drain
+        :param post: callable uploading a {collection: [event, ...]} dict,
+        typically KeenApi.post_events
+        :param batch_size: the maximum number of events per upload
+        :param interval: seconds to wait when the outbox is empty, and after
+        the first failed upload
+        :param max_backoff: the longest wait after failed uploads
+        :param lease: seconds an upload may take before other drainers may
+        claim its rows again
+        """
+        super(OutboxDrainer, self).__init__()
+        self.outbox = outbox
+        self.post = post
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_backoff = max_backoff
+        self.lease = lease
+        self.uploaded = 0
+        self.failures = 0
+        self.last_error = None
+        self._reset()
+
+    def _reset(self):
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        # Held from claiming a batch until it is deleted, so a flush() and
+        # the drain thread don't wait on each other's write transactions.
+        self._drain_lock = threading.Lock()
+        # A forked child is a new owner; it must not delete the parent's rows.
+        self.owner = "{0}-{1}".format(os.getpid(), uuid.uuid4().hex)
+
+    def start(self):
+        """ Starts the drain thread unless it is already running. """
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name="keen-outbox-drain")
+                self._thread.daemon = True
+                self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def drain_once(self, connection):
+        """ Uploads and deletes one batch of rows.
+
+        :returns: the number of events uploaded, None if the upload failed
+        """
+        with self._drain_lock:
+            return self._drain_once(connection)
+
+    def _drain_once(self, connection):
+        rows = self.outbox.claim(connection, self.batch_size, self.owner, self.lease)
+        if not rows:
+            return 0
+        ids = [row_id for row_id, _, _ in rows]
+        try:
+            self.post(event_buffer.group_by_collection([(collection, data) for _, collection, data in rows]))
+        except Exception as e:
+            self.failures += 1
+            self.last_error = e
+            self.outbox.release(connection, ids, self.owner)
+            return None
+        self.outbox.delete(connection, ids)
+        self.uploaded += len(rows)
+        return len(rows)
+
+    def _run(self):
+        connection = self.outbox.connect()
+        delay = self.interval
+        try:
+            while not self._stop.is_set():
+                count = self.drain_once(connection)
+                if count:
+                    delay = self.interval
+                    continue
+                if count is None:
+                    self._stop.wait(delay)
+                    delay = min(delay * 2, self.max_backoff)
+                else:
+                    self._stop.wait(self.interval)
+        finally:
+            connection.close()
@@ -0,0 +1,122 @@
+import json
+
+import six
+
+# Default size of the pieces a streamed request body is written in.
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+_SERIALIZED_TYPES = (six.binary_type, six.text_type, bytearray, memoryview)
+
+
+def is_serialized(event):
+    """ Whether an event is already JSON (bytes, str or a buffer) rather
+    than a dict that still has to be encoded.
+    """
+    return isinstance(event, _SERIALIZED_TYPES)
+
+
+def contains_serialized(events):
+    """ Whether any event of a {collection: [events]} dict is already serialized. """
+    for collection_events in six.itervalues(events):
+        for event in collection_events:
+            if is_serialized(event):
+                return True
+    return False
+
+
+def _as_buffer(event):
+    if isinstance(event, six.text_type):
+        return event.encode("utf-8")
+    if isinstance(event, _SERIALIZED_TYPES):
+        return event
+    return json.dumps(event).encode("utf-8")
+
+
+class BatchPayloadBuilder(object):
+    """
+    Assembles a post_events body, {"collection": [event, ...], ...}, from
+    events that are already serialized, without decoding and re-encoding them.
+
+    Added events are only referenced until build(), which joins them into
+    the body. Dicts can be mixed in and are encoded on add().
+    """
+
+    def __init__(self):
+        super(BatchPayloadBuilder, self).__init__()
+        self._collections = {}
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def add(self, collection, event):
+        """ Adds one event.
+
+        :param collection: the name of the collection to insert the event to
+        :param event: the event as JSON bytes, str, a buffer or a dict
+        """
+        chunks = self._collections.get(collection)
+        if chunks is None:
+            chunks = self._collections[collection] = []
+        chunks.append(_as_buffer(event))
+        self._count += 1
+
+    def extend(self, events):
+        """ Adds every event of a {collection: [events]} dict.
+
+        :param events: dict mapping collection names to lists of events
+        """
+        for collection, collection_events in six.iteritems(events):
+            for event in collection_events:
+                self.add(collection, event)
+
+    def build(self):
+        """ Builds the body.
+
+        :returns: the body as bytes
+        """
+        return b"".join(_iter_body_pieces(six.iteritems(self._collections)))
+
+    def reset(self):
+        """ Forgets the added events. """
+        self._collections = {}
+        self._count = 0
+
+
+def _iter_body_pieces(collections):
+    # Yields the pieces of {"collection": [event, ...], ...} for an iterable of
+    # (collection, iterable of event buffers) pairs.
+    separator = b"{"
+    for collection, chunks in collections:
+        yield separator
+        yield json.dumps(collection).encode("utf-8")
+        yield b":["
+        for position, chunk in enumerate(chunks):
+            if position:
+                yield b","
+            yield chunk
+        yield b"]"
+        separator = b","
+    if separator == b"{":
+        yield separator
+    yield b"}"
+
+
+def iter_payload_chunks(events, chunk_size=DEFAULT_CHUNK_SIZE):
+    """ Yields a post_events body in pieces of about chunk_size bytes,
+    pulling events from their iterables only as the body is consumed.
+
+    :param events: dict mapping collection names to iterables (e.g.
+    generators) of events, each a dict or JSON bytes/str
+    :param chunk_size: the size of the yielded pieces
+    """
+    collections = ((collection, (_as_buffer(event) for event in collection_events))
+                   for collection, collection_events in six.iteritems(events))
+    buffer = bytearray()
+    for piece in _iter_body_pieces(collections):
+        buffer += piece
+        if len(buffer) >= chunk_size:
+            yield bytes(buffer)
+            del buffer[:]
+    if buffer:
+        yield bytes(buffer)
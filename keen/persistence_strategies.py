@@ -1,3 +1,16 @@
+import contextlib
+import json
+import socket
+import threading
+import time
+
+import six
+
+from keen import aggregation as event_aggregation, buffer as event_buffer
+from keen import forking, payloads
+from keen import lanes as event_lanes, outbox as event_outbox, relay as event_relay
+from keen import ring as event_ring, spool as event_spool
+
 __author__ = 'dkador'
 
 
@@ -14,6 +27,50 @@ class BasePersistenceStrategy(object):
         """
         raise NotImplementedError()
 
+    def flush(self, timeout=None):
+        """ Uploads the events the strategy is holding on to, if any.
+
+        :param timeout: optional, the most seconds to spend
+        :returns: a FlushReport
+        """
+        return FlushReport()
+
+    def close(self, timeout=None):
+        """ Flushes and stops any background work of the strategy.
+
+        :param timeout: optional, the most seconds to spend
+        :returns: a FlushReport
+        """
+        return self.flush(timeout)
+
+
+class FlushReport(object):
+    """
+    What happened to the pending events during a flush: how many were
+    uploaded, written to a spool, lost, or still being uploaded when the
+    deadline passed.
+    """
+
+    __slots__ = ("flushed", "spilled", "lost", "in_flight")
+
+    def __init__(self, flushed=0, spilled=0, lost=0, in_flight=0):
+        self.flushed = flushed
+        self.spilled = spilled
+        self.lost = lost
+        self.in_flight = in_flight
+
+    def __bool__(self):
+        return bool(self.flushed or self.spilled or self.lost or self.in_flight)
+
+    __nonzero__ = __bool__
+
+    def to_dict(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+    def __repr__(self):
+        return "FlushReport(flushed={0}, spilled={1}, lost={2}, in_flight={3})".format(
+            self.flushed, self.spilled, self.lost, self.in_flight)
+
 
 class DirectPersistenceStrategy(BasePersistenceStrategy):
     """
@@ -44,6 +101,852 @@ class DirectPersistenceStrategy(BasePersistenceStrategy):
         return self.api.post_events(events)
 
 
+class BufferedPersistenceStrategy(BasePersistenceStrategy):
+    """
+    A persistence strategy that serializes events into a bounded
+    keen.buffer.EventBuffer and uploads them in batches from a background
+    thread, so adding an event doesn't wait for the Keen API.
+
+    The buffer's limits and overflow policy decide what happens when events
+    are added faster than they can be uploaded, e.g. during an outage. With a
+    keen.spool.DiskSpool, batches that still fail after their retries are
+    written to disk instead of being lost, and replayed once uploads succeed
+    again.
+    """
+
+    def __init__(self, api, buffer=None, batch_size=500, max_batch_bytes=5 * 1024 * 1024,
+                 flush_interval=1.0, max_retries=3, retry_backoff=0.5, spool=None,
+                 replay_events_per_second=1000, flush_parallelism=4, adaptive=None):
+        """ Initializer for BufferedPersistenceStrategy.
+
+        :param api: the Keen Api object used to communicate with the Keen API
+        :param buffer: optional, the EventBuffer to queue events in, defaults
+        to an EventBuffer with its default limits that spills to spool when one
+        is given
+        :param batch_size: the maximum number of events per upload
+        :param max_batch_bytes: the approximate maximum size of an upload
+        :param flush_interval: the longest time in seconds a queued event
+        waits for its batch to fill up
+        :param max_retries: how many times a failed upload is retried
+        :param retry_backoff: seconds to wait before the first retry, doubled
+        for every further retry
+        :param spool: optional, a DiskSpool for batches that fail to upload
+        :param replay_events_per_second: the rate spooled events are replayed at
+        :param flush_parallelism: how many batches flush() uploads at once
+        :param adaptive: optional, a keen.batching.AdaptiveBatching that
+        chooses the batch size from the latency and errors of the uploads
+        instead of batch_size
+        """
+        super(BufferedPersistenceStrategy, self).__init__()
+        self.api = api
+        if buffer is None:
+            if spool is not None:
+                buffer = event_buffer.EventBuffer(overflow_policy=event_buffer.OverflowPolicy.SPILL,
+                                                  spill=event_spool.SpillWriter(spool))
+            else:
+                buffer = event_buffer.EventBuffer()
+        self.buffer = buffer
+        self.batch_size = batch_size
+        self.max_batch_bytes = max_batch_bytes
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.spool = spool
+        self.flush_parallelism = flush_parallelism
+        self.adaptive = adaptive
+        self.replayer = None
+        if spool is not None:
+            self.replayer = event_spool.SpoolReplayer(spool, api.post_events, batch_size=batch_size,
+                                                      max_events_per_second=replay_events_per_second)
+
+        self._reset()
+        forking.register(self)
+
+    def _reset(self):
+        self.uploaded = 0
+        self.failed = 0
+        self.spilled = 0
+        self.last_error = None
+        self._worker = None
+        self._worker_lock = threading.Lock()
+        self._counter_lock = threading.Lock()
+        self._closed = threading.Event()
+
+    def _after_fork(self):
+        # The upload thread wasn't forked; the next event starts a new one.
+        # The buffer and replayer reset themselves.
+        self._reset()
+
+    def persist(self, event):
+        """ Queues the given event for upload.
+
+        :param event: an Event to persist
+        :returns: True if the event was queued, False if the overflow policy
+        dropped or spilled it
+        """
+        self._ensure_worker()
+        return self._put(event.event_collection, _encode(event.to_json()))
+
+    def batch_persist(self, events):
+        """ Queues the given events for upload.
+
+        :param events: dictionary mapping collection names to lists of events,
+        each a dict or JSON bytes/str
+        :returns: the number of events that were queued
+        """
+        self._ensure_worker()
+        queued = 0
+        put = self._put
+        for collection, collection_events in six.iteritems(events):
+            for event in collection_events:
+                if not payloads.is_serialized(event):
+                    event = json.dumps(event)
+                if put(collection, _encode(event)):
+                    queued += 1
+        return queued
+
+    def stats(self):
+        """ Returns the buffer's counters and the upload counters as a dict. """
+        stats = self._buffer_stats()
+        stats["uploaded"] = self.uploaded
+        stats["failed"] = self.failed
+        if self.spool is not None:
+            stats["spooled_failures"] = self.spilled
+            stats["replayed"] = self.replayer.replayed_events
+            stats["spool_segments"] = len(self.spool)
+        return stats
+
+    def flush(self, timeout=None):
+        """ Uploads every queued event, flush_parallelism batches at a time.
+        Batches that fail, and events still queued when the timeout expires,
+        are written to the spool if there is one and lost otherwise.
+
+        :param timeout: optional, the most seconds to spend
+        :returns: a FlushReport
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        report = FlushReport()
+        lock = threading.Lock()
+        drainers = []
+        for _ in range(max(1, self.flush_parallelism)):
+            drainer = threading.Thread(target=self._drain, args=(deadline, report, lock), name="keen-flush")
+            drainer.daemon = True
+            drainer.start()
+            drainers.append(drainer)
+        for drainer in drainers:
+            drainer.join(None if deadline is None else max(0, deadline - time.time()))
+
+        remaining = self._clear()
+        if remaining:
+            with lock:
+                if self._spill(remaining):
+                    report.spilled += len(remaining)
+                else:
+                    report.lost += len(remaining)
+        for spill in self._spills():
+            if hasattr(spill, "flush"):
+                spill.flush()
+        return report
+
+    def close(self, timeout=None):
+        """ Flushes the queued events, then stops the background upload and
+        replay threads. Events added after close() stay queued until the
+        next flush().
+
+        :param timeout: optional, the most seconds to spend
+        :returns: a FlushReport
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        self._closed.set()
+        report = self.flush(timeout)
+        if self._worker is not None:
+            self._worker.join(None if deadline is None else max(0, deadline - time.time()))
+        if self.replayer is not None:
+            self.replayer.stop(0)
+        for spill in self._spills():
+            if hasattr(spill, "close"):
+                spill.close()
+        return report
+
+    def _drain(self, deadline, report, lock):
+        while deadline is None or time.time() < deadline:
+            items = self._take(timeout=0, flushing=True)
+            if not items:
+                return
+            with lock:
+                report.in_flight += len(items)
+            uploaded, spilled, lost = self._deliver(items, deadline)
+            with lock:
+                report.in_flight -= len(items)
+                report.flushed += uploaded
+                report.spilled += spilled
+                report.lost += lost
+
+    def _ensure_worker(self):
+        forking.check()
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._worker_lock:
+            if self._closed.is_set():
+                return
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="keen-buffered-upload")
+                self._worker.daemon = True
+                self._worker.start()
+        if self.replayer is not None:
+            self.replayer.start()
+
+    def _run(self):
+        while not self._closed.is_set():
+            self._upload_batch(timeout=self.flush_interval)
+
+    def _upload_batch(self, timeout=0):
+        """ Takes one batch off the buffer and uploads it, retrying failures.
+
+        :param timeout: seconds to wait for an event if the buffer is empty
+        :returns: the number of events taken off the buffer
+        """
+        items = self._take(timeout=timeout)
+        if items:
+            self._deliver(items)
+        return len(items)
+
+    # Where events are queued; LanedPersistenceStrategy overrides these.
+
+    def _put(self, collection, data):
+        return self.buffer.put(collection, data)
+
+    def _take(self, timeout, flushing=False):
+        return self.buffer.take(self._batch_size(), max_bytes=self.max_batch_bytes, timeout=timeout)
+
+    def _clear(self):
+        return self.buffer.clear()
+
+    def _buffer_stats(self):
+        return self.buffer.stats()
+
+    def _spills(self):
+        return [self.buffer.spill] if self.buffer.spill is not None else []
+
+    def _batch_size(self):
+        return self.adaptive.batch_size if self.adaptive is not None else self.batch_size
+
+    def _deliver(self, items, deadline=None):
+        """ Uploads a list of (collection, data) tuples, and spills them if
+        the upload fails.
+
+        :returns: the numbers of events uploaded, spilled and lost
+        """
+        if self._upload(items, deadline):
+            return len(items), 0, 0
+        if self._spill(items):
+            return 0, len(items), 0
+        return 0, 0, len(items)
+
+    def _upload(self, items, deadline=None, post=None):
+        """ Uploads a list of (collection, data) tuples, retrying failures
+        unless the retry would start after the deadline.
+
+        :param post: optional, the callable to upload with instead of
+        self.api.post_events
+        :returns: whether the upload succeeded
+        """
+        events = event_buffer.group_by_collection(items)
+        post = post or self.api.post_events
+        delay = self.retry_backoff
+        for attempt in range(self.max_retries + 1):
+            started = time.time()
+            try:
+                post(events)
+            except Exception as e:
+                self.last_error = e
+                if self.adaptive is not None:
+                    self.adaptive.record(len(items), time.time() - started, e)
+                if attempt == self.max_retries or (deadline is not None and time.time() + delay >= deadline):
+                    break
+                time.sleep(delay)
+                delay *= 2
+            else:
+                if self.adaptive is not None:
+                    self.adaptive.record(len(items), time.time() - started)
+                with self._counter_lock:
+                    self.uploaded += len(items)
+                if self.replayer is not None:
+                    # The API is accepting uploads, so don't wait out the replay backoff.
+                    self.replayer.wake()
+                return True
+        return False
+
+    def _spill(self, items):
+        """ Writes events that couldn't be uploaded to the spool, or counts
+        them as failed without one.
+
+        :returns: whether the events were spooled
+        """
+        if self.spool is not None:
+            self.spool.write(items)
+            with self._counter_lock:
+                self.spilled += len(items)
+            return True
+        with self._counter_lock:
+            self.failed += len(items)
+        return False
+
+
+class LanedPersistenceStrategy(BufferedPersistenceStrategy):
+    """
+    A BufferedPersistenceStrategy that queues events in priority lanes, see
+    keen.lanes.Lane. Each lane has its own buffer limits, overflow policy,
+    batch size and flush cadence, and the upload thread drains the lanes
+    that are ready in proportion to their weights, so a burst of low
+    priority events neither crowds out nor delays the important ones.
+    """
+
+    def __init__(self, api, lanes, default_lane=None, **kwargs):
+        """ Initializer for LanedPersistenceStrategy.
+
+        :param api: the Keen Api object used to communicate with the Keen API
+        :param lanes: a list of keen.lanes.Lane
+        :param default_lane: optional, the name of the lane for collections
+        that no lane lists, defaults to the last lane
+        :param kwargs: the other options of BufferedPersistenceStrategy,
+        except buffer; batch_size only caps the lanes' own batch sizes when an
+        adaptive batching is given
+        """
+        if not lanes:
+            raise ValueError("At least one lane is required.")
+        if "buffer" in kwargs:
+            raise TypeError("LanedPersistenceStrategy queues events in its lanes' buffers.")
+        spool = kwargs.get("spool")
+        spill = event_spool.SpillWriter(spool) if spool is not None else None
+        for lane in lanes:
+            lane.open(spill)
+        if default_lane is None:
+            default_lane = lanes[-1].name
+        self.scheduler = event_lanes.LaneScheduler(lanes, default_lane)
+        super(LanedPersistenceStrategy, self).__init__(api, buffer=self.scheduler.default_lane.buffer, **kwargs)
+
+    @property
+    def lanes(self):
+        return self.scheduler.by_name
+
+    def _put(self, collection, data):
+        return self.scheduler.put(collection, data)
+
+    def _take(self, timeout, flushing=False):
+        max_events = self.adaptive.batch_size if self.adaptive is not None else None
+        return self.scheduler.take(self.max_batch_bytes, timeout, flushing=flushing, max_events=max_events)
+
+    def _clear(self):
+        return self.scheduler.clear()
+
+    def _buffer_stats(self):
+        return self.scheduler.stats()
+
+    def _spills(self):
+        spills = []
+        for lane in self.scheduler.lanes:
+            if lane.buffer.spill is not None and lane.buffer.spill not in spills:
+                spills.append(lane.buffer.spill)
+        return spills
+
+
+class MultiProjectPersistenceStrategy(BufferedPersistenceStrategy):
+    """
+    One buffer and upload thread for the clients of many projects, see
+    keen.pool.KeenClientPool. Events are queued with the key of their
+    client, a (project ID, write key) tuple, and each batch taken off the
+    buffer is uploaded in one request per key.
+    """
+
+    def __init__(self, **kwargs):
+        """ Initializer for MultiProjectPersistenceStrategy.
+
+        :param kwargs: the options of BufferedPersistenceStrategy, except api
+        and spool
+        """
+        if kwargs.get("spool") is not None:
+            raise ValueError("MultiProjectPersistenceStrategy doesn't support a spool.")
+        # key -> the KeenApi that uploads its events
+        self.apis = {}
+        # key -> {"queued": ..., "uploaded": ..., "failed": ...}
+        self.key_stats = {}
+        super(MultiProjectPersistenceStrategy, self).__init__(None, **kwargs)
+
+    def add_key(self, key, api):
+        """ Registers the api that uploads the events of a key. """
+        self.apis[key] = api
+        self.key_stats.setdefault(key, {"queued": 0, "uploaded": 0, "failed": 0})
+
+    def persist_for(self, key, event):
+        """ Queues an event of a key's client for upload. """
+        self._ensure_worker()
+        queued = self._put((key, event.event_collection), _encode(event.to_json()))
+        if queued:
+            with self._counter_lock:
+                self.key_stats[key]["queued"] += 1
+        return queued
+
+    def batch_persist_for(self, key, events):
+        """ Queues the events of a key's client for upload. """
+        queued = self.batch_persist(dict(((key, collection), collection_events)
+                                         for collection, collection_events in six.iteritems(events)))
+        with self._counter_lock:
+            self.key_stats[key]["queued"] += queued
+        return queued
+
+    def _deliver(self, items, deadline=None):
+        groups = {}
+        for (key, collection), data in items:
+            groups.setdefault(key, []).append((collection, data))
+        uploaded = lost = 0
+        for key, group in six.iteritems(groups):
+            if self._upload(group, deadline, post=self.apis[key].post_events):
+                uploaded += len(group)
+                counter = "uploaded"
+            else:
+                self._spill(group)
+                lost += len(group)
+                counter = "failed"
+            with self._counter_lock:
+                self.key_stats[key][counter] += len(group)
+        return uploaded, 0, lost
+
+
+class AggregatingPersistenceStrategy(BasePersistenceStrategy):
+    """
+    A persistence strategy that pre-aggregates the events of metric-style
+    collections, see keen.aggregation, and hands the aggregates and the
+    events of every other collection to another strategy.
+
+    Aggregates are handed on once their time bucket has ended, when they
+    are the least recently updated and memory is full, and on flush(). Events
+    are bucketed by their keen.timestamp, or the time they are added. When
+    the other strategy fails to take aggregates, they are kept (up to
+    max_keys of them) and handed on again with the next ones.
+    """
+
+    def __init__(self, strategy, aggregations, max_keys=event_aggregation.DEFAULT_MAX_KEYS, grace=5.0,
+                 flush_interval=5.0):
+        """ Initializer for AggregatingPersistenceStrategy.
+
+        :param strategy: the persistence strategy to hand events on to, e.g.
+        a BufferedPersistenceStrategy
+        :param aggregations: dict mapping collection names to
+        keen.aggregation.Aggregations
+        :param max_keys: the most aggregates kept in memory
+        :param grace: seconds after the end of a bucket that late events
+        still join its aggregates
+        :param flush_interval: how often in seconds ended buckets are handed on
+        """
+        super(AggregatingPersistenceStrategy, self).__init__()
+        self.strategy = strategy
+        self.aggregator = event_aggregation.Aggregator(aggregations, max_keys=max_keys, grace=grace)
+        self.flush_interval = flush_interval
+        self._reset()
+        forking.register(self)
+
+    def _reset(self):
+        self.failed = 0
+        self.last_error = None
+        self._worker = None
+        self._worker_lock = threading.Lock()
+        self._closed = threading.Event()
+        # Aggregates the other strategy failed to take, oldest first.
+        self._pending = []
+        self._pending_lock = threading.Lock()
+
+    def _after_fork(self):
+        # The aggregates are the parent's to hand on.
+        self.aggregator._reset()
+        self._reset()
+
+    def persist(self, event):
+        """ Adds the given event to its aggregate, or hands it on if its
+        collection isn't aggregated.
+
+        :param event: an Event to persist
+        """
+        if event.event_collection not in self.aggregator.aggregations:
+            return self.strategy.persist(event)
+        self._ensure_worker()
+        body = json.loads(event.to_json()) if event.context is not None else event.event_body
+        if event.timestamp:
+            timestamp = event_aggregation.epoch_seconds(event.timestamp)
+        else:
+            timestamp = event_aggregation.event_time(body, time.time())
+        self._hand_on(self.aggregator.add(event.event_collection, body, timestamp))
+        return True
+
+    def batch_persist(self, events):
+        """ Adds the events of aggregated collections to their aggregates
+        and hands the others on.
+
+        :param events: dictionary mapping collection names to lists of events,
+        each a dict or JSON bytes/str
+        :returns: the number of events aggregated when every collection is
+        aggregated. Otherwise what the other strategy returns for the rest,
+        plus the number of events aggregated if that is a count of queued
+        events, as with the buffered strategies; any other result, e.g. the
+        API response of DirectPersistenceStrategy, is returned unchanged.
+        """
+        others = {}
+        aggregated = 0
+        now = time.time()
+        for collection, collection_events in six.iteritems(events):
+            if collection not in self.aggregator.aggregations:
+                others[collection] = collection_events
+                continue
+            self._ensure_worker()
+            for event in collection_events:
+                if payloads.is_serialized(event):
+                    if not isinstance(event, six.text_type):
+                        event = bytes(event).decode("utf-8")
+                    event = json.loads(event)
+                timestamp = event_aggregation.event_time(event, now)
+                self._hand_on(self.aggregator.add(collection, event, timestamp))
+                aggregated += 1
+        if not others:
+            return aggregated
+        result = self.strategy.batch_persist(others)
+        if result is None:
+            return aggregated
+        if isinstance(result, six.integer_types) and not isinstance(result, bool):
+            return aggregated + result
+        return result
+
+    def stats(self):
+        """ Returns the aggregation counters as a dict. """
+        return {"aggregates": len(self.aggregator), "aggregated": self.aggregator.aggregated,
+                "emitted": self.aggregator.emitted, "evicted": self.aggregator.evicted,
+                "pending": len(self._pending), "failed": self.failed}
+
+    def flush(self, timeout=None):
+        """ Hands on every aggregate, then flushes the other strategy. """
+        self._hand_on(self.aggregator.pop_all())
+        return self.strategy.flush(timeout=timeout)
+
+    def close(self, timeout=None):
+        """ Stops the background thread, hands on every aggregate and closes
+        the other strategy.
+        """
+        self._closed.set()
+        self._hand_on(self.aggregator.pop_all())
+        return self.strategy.close(timeout=timeout)
+
+    def _hand_on(self, items):
+        with self._pending_lock:
+            if self._pending:
+                items, self._pending = self._pending + list(items), []
+        if not items:
+            return
+        try:
+            self.strategy.batch_persist(event_buffer.group_by_collection(items))
+        except Exception as e:
+            # e.g. a DirectPersistenceStrategy failing to upload; keep the
+            # aggregates for the next hand-on.
+            with self._pending_lock:
+                self.last_error = e
+                self._pending = list(items) + self._pending
+                excess = len(self._pending) - self.aggregator.max_keys
+                if excess > 0:
+                    del self._pending[:excess]
+                    self.failed += excess
+
+    def _ensure_worker(self):
+        forking.check()
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._worker_lock:
+            if not self._closed.is_set() and (self._worker is None or not self._worker.is_alive()):
+                self._worker = threading.Thread(target=self._run, name="keen-aggregate")
+                self._worker.daemon = True
+                self._worker.start()
+
+    def _run(self):
+        while not self._closed.wait(self.flush_interval):
+            self._hand_on(self.aggregator.pop_closed(time.time()))
+
+
+class RingPersistenceStrategy(BasePersistenceStrategy):
+    """
+    A persistence strategy that writes serialized events into a
+    keen.ring.SharedRingBuffer shared by every process on the host. A single
+    uploader process (`python -m keen upload-ring`) drains the ring into
+    large batches, so worker processes neither hold connections nor wait for
+    uploads.
+    """
+
+    def __init__(self, ring):
+        """ Initializer for RingPersistenceStrategy.
+
+        :param ring: a SharedRingBuffer, or the path of one to open or create
+        """
+        super(RingPersistenceStrategy, self).__init__()
+        if isinstance(ring, six.string_types):
+            ring = event_ring.SharedRingBuffer(ring)
+        self.ring = ring
+
+    def persist(self, event):
+        """ Writes the given event to the ring.
+
+        :param event: an Event to persist
+        :returns: True if the event was written, False if the ring was full
+        """
+        return self.ring.put(event.event_collection, _encode(event.to_json()))
+
+    def batch_persist(self, events):
+        """ Writes the given events to the ring.
+
+        :param events: dictionary mapping collection names to lists of events,
+        each a dict or JSON bytes/str
+        :returns: the number of events that were written
+        """
+        written = 0
+        put = self.ring.put
+        for collection, collection_events in six.iteritems(events):
+            for event in collection_events:
+                if not payloads.is_serialized(event):
+                    event = json.dumps(event)
+                if put(collection, _encode(event)):
+                    written += 1
+        return written
+
+
+class RelayPersistenceStrategy(BasePersistenceStrategy):
+    """
+    A persistence strategy that sends events to a local relay
+    (`python -m keen relay`) over UDP or a Unix datagram socket. Sending is
+    fire-and-forget: nothing is buffered in the application, and events the
+    relay can't receive are counted as dropped rather than raised.
+    """
+
+    def __init__(self, address=event_relay.DEFAULT_RELAY_ADDRESS, max_datagram_size=None):
+        """ Initializer for RelayPersistenceStrategy.
+
+        :param address: the relay's udp://host:port or unix:///path address
+        :param max_datagram_size: optional, the largest datagram to send; a
+        batch is split into datagrams of at most this size
+        """
+        super(RelayPersistenceStrategy, self).__init__()
+        self.family, self.address = event_relay.parse_address(address)
+        if max_datagram_size is None:
+            max_datagram_size = (event_relay.DEFAULT_UDP_DATAGRAM_SIZE if self.family == socket.AF_INET
+                                 else event_relay.DEFAULT_UNIX_DATAGRAM_SIZE)
+        self.max_datagram_size = max_datagram_size
+        self.sent = 0
+        self.dropped = 0
+        self._socket = socket.socket(self.family, socket.SOCK_DGRAM)
+        self._socket.setblocking(False)
+        forking.register(self)
+
+    def _after_fork(self):
+        # Sends from several processes on one socket don't interleave, but
+        # each process should own its socket.
+        self._socket = socket.socket(self.family, socket.SOCK_DGRAM)
+        self._socket.setblocking(False)
+
+    def persist(self, event):
+        """ Sends the given event to the relay.
+
+        :param event: an Event to persist
+        :returns: True if the event was sent
+        """
+        frame = event_relay.encode_frame(event.event_collection, _encode(event.to_json()))
+        return self._send(frame, 1) == 1
+
+    def batch_persist(self, events):
+        """ Sends the given events to the relay, packing as many frames into
+        each datagram as fit.
+
+        :param events: dictionary mapping collection names to lists of events,
+        each a dict or JSON bytes/str
+        :returns: the number of events that were sent
+        """
+        sent = 0
+        datagram = []
+        size = 0
+        for collection, collection_events in six.iteritems(events):
+            for event in collection_events:
+                if not payloads.is_serialized(event):
+                    event = json.dumps(event)
+                frame = event_relay.encode_frame(collection, _encode(event))
+                if datagram and size + len(frame) > self.max_datagram_size:
+                    sent += self._send(b"".join(datagram), len(datagram))
+                    datagram = []
+                    size = 0
+                datagram.append(frame)
+                size += len(frame)
+        if datagram:
+            sent += self._send(b"".join(datagram), len(datagram))
+        return sent
+
+    def _send(self, datagram, count):
+        # Returns how many of the count events in datagram were sent.
+        try:
+            self._socket.sendto(datagram, self.address)
+        except (socket.error, OSError):
+            self.dropped += count
+            return 0
+        self.sent += count
+        return count
+
+
+class OutboxPersistenceStrategy(BasePersistenceStrategy):
+    """
+    A persistence strategy that records events in an outbox table of a local
+    SQLite database (see keen.outbox) and uploads them from a background
+    thread, deleting them once Keen has acknowledged them.
+
+    Inside transaction(connection), events are inserted with the
+    application's own connection, so they are committed or rolled back
+    together with its writes. Elsewhere they are group-committed: the
+    inserts of all threads within commit_interval share a transaction.
+
+    Several processes can share one database; their drainers claim rows
+    before uploading them, so every row is uploaded by one of them.
+    """
+
+    def __init__(self, api, path, table=event_outbox.DEFAULT_OUTBOX_TABLE, batch_size=500,
+                 commit_interval=0.01, wait_for_commit=True, drain_interval=1.0):
+        """ Initializer for OutboxPersistenceStrategy.
+
+        :param api: the Keen Api object used to communicate with the Keen API
+        :param path: the SQLite database file, created if missing
+        :param table: optional, the name of the outbox table
+        :param batch_size: the maximum number of events per upload
+        :param commit_interval: seconds to collect inserts for a group commit
+        :param wait_for_commit: whether adding an event outside of
+        transaction() waits until it is committed
+        :param drain_interval: seconds between checks of an empty outbox, and
+        before the first retry of a failed upload
+        """
+        super(OutboxPersistenceStrategy, self).__init__()
+        self.api = api
+        self.outbox = event_outbox.SQLiteOutbox(path, table=table)
+        self.committer = event_outbox.GroupCommitter(self.outbox, commit_interval=commit_interval)
+        self.drainer = event_outbox.OutboxDrainer(self.outbox, api.post_events, batch_size=batch_size,
+                                                  interval=drain_interval)
+        self.wait_for_commit = wait_for_commit
+        self._transactions = threading.local()
+        forking.register(self)
+
+    def _after_fork(self):
+        # SQLite connections must not be used across a fork; the committer
+        # and drainer open new ones in their new threads.
+        self.committer._reset()
+        self.drainer._reset()
+        self._transactions = threading.local()
+
+    @contextlib.contextmanager
+    def transaction(self, connection):
+        """ Records the events added in this block with connection, in its
+        current transaction. Commits when the block exits, or rolls back if it
+        raises.
+
+        :param connection: a sqlite3 connection to the outbox's database
+        """
+        self._transactions.connection = connection
+        try:
+            yield connection
+        except BaseException:
+            connection.rollback()
+            raise
+        else:
+            connection.commit()
+        finally:
+            self._transactions.connection = None
+
+    def persist(self, event):
+        """ Records the given event in the outbox.
+
+        :param event: an Event to persist
+        """
+        self._record([(event.event_collection, _encode(event.to_json()))])
+
+    def batch_persist(self, events):
+        """ Records the given events in the outbox.
+
+        :param events: dictionary mapping collection names to lists of events,
+        each a dict or JSON bytes/str
+        :returns: the number of events recorded
+        """
+        items = []
+        for collection, collection_events in six.iteritems(events):
+            for event in collection_events:
+                if not payloads.is_serialized(event):
+                    event = json.dumps(event)
+                items.append((collection, _encode(event)))
+        self._record(items)
+        return len(items)
+
+    def _record(self, items):
+        self.drainer.start()
+        connection = getattr(self._transactions, "connection", None)
+        if connection is not None:
+            self.outbox.insert(connection, items)
+        else:
+            self.committer.submit(items, wait=self.wait_for_commit)
+
+    def backlog(self):
+        """ Returns the number of events waiting in the outbox and the age in
+        seconds of the oldest one, as a dict with "depth" and "age".
+        """
+        connection = self.outbox.connect()
+        try:
+            return self.outbox.backlog(connection)
+        finally:
+            connection.close()
+
+    def stats(self):
+        """ Returns the backlog and the upload counters as a dict. """
+        stats = self.backlog()
+        stats["uploaded"] = self.drainer.uploaded
+        stats["upload_failures"] = self.drainer.failures
+        stats["commits"] = self.committer.commits
+        return stats
+
+    def flush(self, timeout=None):
+        """ Commits the pending inserts and uploads the outbox until it is
+        empty, an upload fails or the timeout expires. Events left in the
+        outbox are durable and reported as spilled.
+
+        :param timeout: optional, the most seconds to spend
+        :returns: a FlushReport
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        self.committer.flush()
+        report = FlushReport()
+        connection = self.outbox.connect()
+        try:
+            while deadline is None or time.time() < deadline:
+                count = self.drainer.drain_once(connection)
+                if not count:
+                    break
+                report.flushed += count
+            report.spilled = self.outbox.backlog(connection)["depth"]
+        finally:
+            connection.close()
+        return report
+
+    def close(self, timeout=None):
+        """ Flushes the outbox and stops the commit and upload threads.
+
+        :param timeout: optional, the most seconds to spend
+        :returns: a FlushReport
+        """
+        self.drainer.stop(0)
+        report = self.flush(timeout)
+        self.committer.stop(timeout)
+        return report
+
+
+def _encode(event):
+    if isinstance(event, six.text_type):
+        return event.encode("utf-8")
+    return event
+
+
 class RedisPersistenceStrategy(BasePersistenceStrategy):
     """
     A persistence strategy that persists events to Redis for later processing.
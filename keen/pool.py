@@ -0,0 +1,170 @@
+""" Clients for many Keen projects that share connections and an uploader.
+
+A KeenClient per project builds its own requests.Session, connection pool
+and, when buffered, its own upload thread. With hundreds of projects that is
+thousands of mostly idle sockets. The clients of a KeenClientPool share one
+session, and so one connection pool, per base URL, and queue their events
+in one buffer whose upload thread batches them per project and write key.
+"""
+
+import threading
+
+import requests
+import six
+
+from keen import forking
+from keen.api import KeenAdapter, KeenApi
+from keen.client import KeenClient
+from keen.persistence_strategies import BasePersistenceStrategy, FlushReport, MultiProjectPersistenceStrategy
+
+
+class PooledPersistenceStrategy(BasePersistenceStrategy):
+    """ The persistence strategy of a pooled client: hands its events to the
+    pool's MultiProjectPersistenceStrategy under the client's key.
+    """
+
+    def __init__(self, shared, key):
+        """ Initializer for PooledPersistenceStrategy.
+
+        :param shared: the pool's MultiProjectPersistenceStrategy
+        :param key: the client's (project ID, write key) tuple
+        """
+        super(PooledPersistenceStrategy, self).__init__()
+        self.shared = shared
+        self.key = key
+
+    def persist(self, event):
+        return self.shared.persist_for(self.key, event)
+
+    def batch_persist(self, events):
+        return self.shared.batch_persist_for(self.key, events)
+
+    def flush(self, timeout=None):
+        """ Flushes the pool's buffer, with the events of every client. """
+        return self.shared.flush(timeout=timeout)
+
+    def close(self, timeout=None):
+        """ Flushes the pool's buffer; the pool keeps running. Use
+        KeenClientPool.close() to stop it.
+        """
+        return self.shared.flush(timeout=timeout)
+
+
+class KeenClientPool(object):
+    """
+    Hands out a KeenClient per project and keys, creating each once. The
+    clients share a requests.Session per base URL and a buffered uploader.
+
+        pool = KeenClientPool()
+        pool.client(project_id, write_key=write_key).add_event("clicks", {...})
+        pool.stats()[project_id]  # {"queued": ..., "uploaded": ..., "failed": ...}
+    """
+
+    def __init__(self, pool_connections=10, pool_maxsize=10, buffered=True, **strategy_options):
+        """ Initializes a KeenClientPool.
+
+        :param pool_connections: the number of hosts whose connections are
+        kept per base URL
+        :param pool_maxsize: the most connections kept per host
+        :param buffered: whether events are queued and uploaded in batches by
+        the pool's upload thread, or uploaded directly
+        :param strategy_options: options of the MultiProjectPersistenceStrategy,
+        e.g. batch_size or flush_interval
+        """
+        super(KeenClientPool, self).__init__()
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.strategy = MultiProjectPersistenceStrategy(**strategy_options) if buffered else None
+        self._clients = {}
+        self._sessions = {}
+        self._lock = threading.Lock()
+        forking.register(self)
+
+    def _after_fork(self):
+        # Like KeenApi, drop the sessions shared with the parent; pooled
+        # KeenApis don't replace sessions they don't own.
+        self._lock = threading.Lock()
+        for base_url in list(self._sessions):
+            self._sessions[base_url] = self._create_session()
+        for client in list(self._clients.values()):
+            client.api.session = self._sessions[client.api.base_url]
+
+    def client(self, project_id, write_key=None, read_key=None, master_key=None, base_url=None, **client_options):
+        """ Returns the pool's client for a project and keys, creating it on
+        first use.
+
+        :param project_id: the Keen IO project ID
+        :param write_key: a Keen IO Scoped Key for Writes
+        :param read_key: a Keen IO Scoped Key for Reads
+        :param master_key: a Keen IO Master API Key
+        :param base_url: optional, set this to override where API requests
+        are sent
+        :param client_options: other KeenClient options, used when the client
+        is created
+        """
+        cache_key = (project_id, write_key, read_key, master_key, base_url)
+        client = self._clients.get(cache_key)
+        if client is not None:
+            return client
+        with self._lock:
+            client = self._clients.get(cache_key)
+            if client is None:
+                client = self._create_client(project_id, write_key, read_key, master_key, base_url, client_options)
+                self._clients[cache_key] = client
+        return client
+
+    def stats(self):
+        """ Returns the queued, uploaded and failed event counts of each
+        project, summed over its write keys.
+        """
+        stats = {}
+        if self.strategy is None:
+            return stats
+        for (project_id, _), key_stats in list(six.iteritems(self.strategy.key_stats)):
+            project_stats = stats.setdefault(project_id, {"queued": 0, "uploaded": 0, "failed": 0})
+            for name, value in six.iteritems(key_stats):
+                project_stats[name] += value
+        return stats
+
+    def flush(self, timeout=None):
+        """ Uploads the queued events of every client.
+
+        :returns: a keen.persistence_strategies.FlushReport
+        """
+        if self.strategy is None:
+            return FlushReport()
+        return self.strategy.flush(timeout=timeout)
+
+    def close(self, timeout=None):
+        """ Uploads the queued events and stops the upload thread.
+
+        :returns: a keen.persistence_strategies.FlushReport
+        """
+        if self.strategy is None:
+            return FlushReport()
+        return self.strategy.close(timeout=timeout)
+
+    def _create_client(self, project_id, write_key, read_key, master_key, base_url, client_options):
+        session = self._session(base_url or KeenApi.base_url)
+
+        def api_class(*args, **kwargs):
+            return KeenApi(*args, session=session, **kwargs)
+
+        client = KeenClient(project_id, write_key=write_key, read_key=read_key, master_key=master_key,
+                            base_url=base_url, api_class=api_class, **client_options)
+        if self.strategy is not None and "persistence_strategy" not in client_options:
+            key = (project_id, write_key)
+            self.strategy.add_key(key, client.api)
+            client.persistence_strategy = PooledPersistenceStrategy(self.strategy, key)
+        return client
+
+    def _session(self, base_url):
+        session = self._sessions.get(base_url)
+        if session is None:
+            session = self._sessions[base_url] = self._create_session()
+        return session
+
+    def _create_session(self):
+        session = requests.Session()
+        session.mount("https://", KeenAdapter(pool_connections=self.pool_connections, pool_maxsize=self.pool_maxsize))
+        return session
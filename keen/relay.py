@@ -0,0 +1,182 @@
+""" A local relay that receives events over UDP or a Unix datagram socket and
+uploads them in batches, for applications that shouldn't buffer events
+themselves. Run it with `python -m keen relay`; applications send to it with
+RelayPersistenceStrategy.
+
+Every datagram holds one or more newline-separated frames, each a JSON array
+of the collection name and the event:
+
+    ["clicks", {"user": 1}]
+"""
+
+import json
+import os
+import socket
+import threading
+
+import six
+from six.moves import BaseHTTPServer
+
+DEFAULT_RELAY_ADDRESS = "udp://127.0.0.1:8126"
+# Larger UDP datagrams risk IP fragmentation; Unix sockets allow far more.
+DEFAULT_UDP_DATAGRAM_SIZE = 8192
+DEFAULT_UNIX_DATAGRAM_SIZE = 65536
+_RECEIVE_SIZE = 65536
+
+_decoder = json.JSONDecoder()
+
+
+def parse_address(address):
+    """ Parses udp://host:port or unix:///path/to/socket.
+
+    :returns: the socket family and the address to bind or send to
+    """
+    if address.startswith("unix://"):
+        if not hasattr(socket, "AF_UNIX"):
+            raise ValueError("Unix sockets aren't supported on this system.")
+        return socket.AF_UNIX, address[len("unix://"):]
+    if address.startswith("udp://"):
+        host, _, port = address[len("udp://"):].rpartition(":")
+        if host and port.isdigit():
+            return socket.AF_INET, (host.strip("[]"), int(port))
+    raise ValueError("Invalid relay address '{0}', expected udp://host:port or unix:///path.".format(address))
+
+
+def encode_frame(collection, data):
+    """ Encodes one frame.
+
+    :param collection: the name of the collection
+    :param data: the event as JSON bytes
+    """
+    return b"[" + json.dumps(collection).encode("utf-8") + b"," + data + b"]\n"
+
+
+def parse_frame(line):
+    """ Splits a frame into its collection and the event JSON. The event is
+    only checked to look like an object, not decoded.
+
+    :param line: one frame, bytes
+    :returns: (collection, data), data being the event as JSON bytes
+    :raises ValueError: if the frame is malformed
+    """
+    text = line.decode("utf-8").strip()
+    if not text.startswith("[") or not text.endswith("]"):
+        raise ValueError("A frame must be a JSON array.")
+    inner = text[1:-1].strip()
+    collection, end = _decoder.raw_decode(inner)
+    if not isinstance(collection, six.string_types):
+        raise ValueError("A frame must start with the collection name.")
+    rest = inner[end:].lstrip()
+    if not rest.startswith(","):
+        raise ValueError("A frame must hold a collection name and an event.")
+    event = rest[1:].strip()
+    if not event.startswith("{") or not event.endswith("}"):
+        raise ValueError("The event of a frame must be a JSON object.")
+    return collection, event.encode("utf-8")
+
+
+class RelayServer(object):
+    """
+    Receives frames on a datagram socket and hands them to a
+    BufferedPersistenceStrategy, which batches, retries and spools them.
+    """
+
+    def __init__(self, address, strategy, stats_port=None):
+        """ Initializes a RelayServer and binds its socket.
+
+        :param address: udp://host:port or unix:///path to listen on
+        :param strategy: the BufferedPersistenceStrategy uploading the events
+        :param stats_port: optional, a local port serving stats() as JSON
+        """
+        super(RelayServer, self).__init__()
+        self.address = address
+        self.strategy = strategy
+        self.received = 0
+        self.invalid = 0
+        self._stop = threading.Event()
+
+        family, bind_address = parse_address(address)
+        self._unix_path = bind_address if family != socket.AF_INET else None
+        self.socket = socket.socket(family, socket.SOCK_DGRAM)
+        self.socket.settimeout(0.5)
+        self.socket.bind(bind_address)
+
+        self._stats_server = None
+        self._stats_thread = None
+        if stats_port is not None:
+            self._stats_server = BaseHTTPServer.HTTPServer(("127.0.0.1", stats_port), _stats_handler(self))
+
+    def stats(self):
+        """ Returns the frame counters and the strategy's stats as a dict. """
+        stats = self.strategy.stats()
+        stats["received"] = self.received
+        stats["invalid"] = self.invalid
+        return stats
+
+    def handle(self, datagram):
+        """ Queues the frames of one datagram. """
+        events = {}
+        for line in datagram.splitlines():
+            if not line.strip():
+                continue
+            try:
+                collection, data = parse_frame(line)
+            except ValueError:
+                self.invalid += 1
+                continue
+            self.received += 1
+            events.setdefault(collection, []).append(data)
+        if events:
+            self.strategy.batch_persist(events)
+
+    def serve_forever(self):
+        """ Receives datagrams until stop() is called. """
+        if self._stats_server is not None and self._stats_thread is None:
+            self._stats_thread = threading.Thread(target=self._stats_server.serve_forever, name="keen-relay-stats")
+            self._stats_thread.daemon = True
+            self._stats_thread.start()
+        while not self._stop.is_set():
+            try:
+                datagram = self.socket.recv(_RECEIVE_SIZE)
+            except socket.timeout:
+                continue
+            self.handle(datagram)
+
+    def stop(self):
+        self._stop.set()
+
+    def close(self, timeout=None):
+        """ Closes the socket and flushes the strategy.
+
+        :param timeout: optional, the most seconds to spend flushing
+        :returns: the strategy's FlushReport
+        """
+        self.socket.close()
+        if self._unix_path:
+            try:
+                os.remove(self._unix_path)
+            except OSError:
+                pass
+        if self._stats_server is not None:
+            if self._stats_thread is not None:
+                self._stats_server.shutdown()
+            self._stats_server.server_close()
+        return self.strategy.close(timeout=timeout)
+
+
+def _stats_handler(server):
+
+    class StatsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            body = json.dumps(server.stats()).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return StatsHandler
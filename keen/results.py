@@ -0,0 +1,310 @@
+import array
+import json
+import math
+
+import six
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import pandas
+except ImportError:
+    pandas = None
+
+
+class ColumnarResult(object):
+    """
+    A compact, column-wise representation of an interval and/or group_by
+    analysis result.
+
+    The Keen API returns these results as nested lists of dicts, e.g.
+    [{"timeframe": {...}, "value": [{"browser": "x", "result": 3}, ...]}, ...].
+    A ColumnarResult keeps the timeframes and group keys once and stores
+    every value in a single flat float array (a NumPy array when NumPy is
+    installed, an array.array otherwise) laid out as one row per interval
+    and one column per group. Missing values are stored as NaN.
+    """
+
+    __slots__ = ("group_by", "starts", "ends", "keys", "values", "_index")
+
+    def __init__(self, group_by, starts, ends, keys, values):
+        """ Initializes a ColumnarResult. Use from_result() to build one from
+        an API response.
+
+        :param group_by: tuple of the group_by property names, empty if the
+        query wasn't grouped
+        :param starts: list of interval start strings, or None if the query
+        had no interval
+        :param ends: list of interval end strings, or None if the query had
+        no interval
+        :param keys: list of group keys; a plain value for a single group_by
+        property, a tuple for several
+        :param values: flat float array of len(starts) * len(keys) values
+        """
+        super(ColumnarResult, self).__init__()
+        self.group_by = group_by
+        self.starts = starts
+        self.ends = ends
+        self.keys = keys
+        self.values = values
+        self._index = dict((key, i) for i, key in enumerate(keys))
+
+    @classmethod
+    def from_result(cls, result, group_by=None, interval=None):
+        """ Builds a ColumnarResult from the "result" of an analysis.
+
+        :param result: the list returned by an interval and/or group_by query
+        :param group_by: optional, string or list of strings, the group_by used
+        for the query. Inferred from the result when not given; needed only to
+        keep the property names of an empty grouped result.
+        :param interval: optional, the interval used for the query. Needed only
+        to tell an empty interval result from an empty grouped one when
+        group_by is given.
+        """
+        if not isinstance(result, list):
+            raise ValueError("Only interval and group_by results can be made columnar.")
+
+        group_by = _normalize_group_by(group_by)
+        if result:
+            has_interval = isinstance(result[0], dict) and "timeframe" in result[0]
+        else:
+            # Without group_by, only an interval query returns a list.
+            has_interval = interval is not None or group_by is None
+
+        if has_interval:
+            starts = [item["timeframe"]["start"] for item in result]
+            ends = [item["timeframe"]["end"] for item in result]
+            rows = [item["value"] for item in result]
+        else:
+            starts = ends = None
+            rows = [result]
+
+        grouped = group_by is not None or any(isinstance(row, list) for row in rows)
+        if grouped and group_by is None:
+            group_by = _infer_group_by(rows)
+
+        keys = []
+        index = {}
+        cells = []
+        for row_number, row in enumerate(rows):
+            if not grouped:
+                cells.append((row_number, 0, row))
+                continue
+            for group in row:
+                key = _group_key(group, group_by)
+                column = index.get(key)
+                if column is None:
+                    column = index[key] = len(keys)
+                    keys.append(key)
+                cells.append((row_number, column, group["result"]))
+
+        if not grouped:
+            keys = [None]
+        width = len(keys)
+        values = _nan_array(len(rows) * width)
+        for row_number, column, value in cells:
+            values[row_number * width + column] = _to_float(value)
+
+        if numpy is not None:
+            values = values.reshape((len(rows), width))
+
+        return cls(tuple(group_by or ()), starts, ends, keys, values)
+
+    @property
+    def has_interval(self):
+        return self.starts is not None
+
+    @property
+    def grouped(self):
+        # An ungrouped result has the single key None; a grouped one whose
+        # property names weren't known and couldn't be inferred has none.
+        return bool(self.group_by) or self.keys != [None]
+
+    @property
+    def interval_count(self):
+        return len(self.starts) if self.starts is not None else 1
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __iter__(self):
+        return iter(self.keys)
+
+    def _flat(self):
+        if numpy is not None:
+            return self.values.reshape(-1)
+        return self.values
+
+    def value(self, key=None, interval=0):
+        """ Returns a single value in O(1).
+
+        :param key: the group key, omit for an ungrouped result
+        :param interval: the position of the interval, 0 for a result
+        without interval
+        """
+        column = self._index[key]
+        value = self._flat()[interval * len(self.keys) + column]
+        return None if math.isnan(value) else float(value)
+
+    def series(self, key=None):
+        """ Returns the values of one group across all intervals.
+
+        :param key: the group key, omit for an ungrouped result
+        """
+        column = self._index[key]
+        width = len(self.keys)
+        flat = self._flat()
+        return [_from_float(flat[row * width + column]) for row in range(self.interval_count)]
+
+    def totals(self):
+        """ Returns a dict mapping each group key to its sum over all
+        intervals, ignoring missing values.
+        """
+        if numpy is not None:
+            return dict(zip(self.keys, numpy.nansum(self.values, axis=0).tolist()))
+
+        width = len(self.keys)
+        sums = [0.0] * width
+        for position, value in enumerate(self.values):
+            if not math.isnan(value):
+                sums[position % width] += value
+        return dict(zip(self.keys, sums))
+
+    def top(self, n, interval=None):
+        """ Returns the n largest groups as a list of (key, value) tuples.
+
+        :param n: the number of groups to return
+        :param interval: optional, rank by the value at this interval
+        position instead of by the total over all intervals
+        """
+        if interval is None:
+            ranked = six.iteritems(self.totals())
+        else:
+            ranked = ((key, self.value(key, interval)) for key in self.keys)
+            ranked = [(key, value) for key, value in ranked if value is not None]
+        return sorted(ranked, key=lambda pair: pair[1], reverse=True)[:n]
+
+    def pivot(self):
+        """ Returns a dict mapping each group key to the list of its values
+        per interval, the shape most charting libraries expect. Missing
+        values are None.
+        """
+        return dict((key, self.series(key)) for key in self.keys)
+
+    def scaled(self, factor):
+        """ Returns a copy with every value multiplied by factor.
+
+        :param factor: the number to multiply the values by
+        """
+        if numpy is not None:
+            values = self.values * factor
+        else:
+            values = array.array("d", (value * factor for value in self.values))
+        return ColumnarResult(self.group_by, self.starts, self.ends, list(self.keys), values)
+
+    def to_records(self):
+        """ Rebuilds the nested list-of-dicts form returned by the API.
+        Integral values are returned as ints, others as floats.
+        """
+        records = []
+        for row in range(self.interval_count):
+            if self.grouped:
+                value = []
+                for key in self.keys:
+                    cell = self.value(key, row)
+                    if cell is None:
+                        continue
+                    group = dict(zip(self.group_by, key if len(self.group_by) > 1 else (key,)))
+                    group["result"] = _restore_int(cell)
+                    value.append(group)
+            else:
+                value = _restore_int(self.value(None, row))
+            if self.has_interval:
+                records.append({"timeframe": {"start": self.starts[row], "end": self.ends[row]},
+                                "value": value})
+            else:
+                records = value
+        return records
+
+    def to_pandas(self):
+        """ Returns a pandas.DataFrame with one row per interval and one
+        column per group. With NumPy installed the frame wraps the
+        underlying value array without copying it.
+        """
+        if pandas is None:
+            raise ImportError("pandas is required for ColumnarResult.to_pandas().")
+
+        index = pandas.to_datetime(self.starts) if self.has_interval else None
+        if len(self.group_by) > 1:
+            columns = pandas.MultiIndex.from_tuples(self.keys, names=self.group_by)
+        elif self.group_by:
+            columns = pandas.Index(self.keys, name=self.group_by[0])
+        elif self.grouped:
+            columns = pandas.Index(self.keys)
+        else:
+            columns = ["result"]
+
+        # pandas depends on NumPy, so self.values is already a 2-d ndarray here.
+        return pandas.DataFrame(self.values, index=index, columns=columns, copy=False)
+
+
+def _normalize_group_by(group_by):
+    if group_by is None:
+        return None
+    if isinstance(group_by, six.string_types):
+        # KeenClient.get_params serializes lists of group_by properties to JSON.
+        if group_by.startswith("["):
+            return json.loads(group_by)
+        return [group_by]
+    return list(group_by)
+
+
+def _infer_group_by(rows):
+    for row in rows:
+        for group in row:
+            return sorted(name for name in group if name != "result")
+    return []
+
+
+def _group_key(group, group_by):
+    if len(group_by) == 1:
+        return _hashable(group.get(group_by[0]))
+    return tuple(_hashable(group.get(name)) for name in group_by)
+
+
+def _hashable(value):
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, sort_keys=True)
+    return value
+
+
+def _nan_array(size):
+    if numpy is not None:
+        return numpy.full(size, numpy.nan)
+    return array.array("d", [float("nan")]) * size
+
+
+def _to_float(value):
+    if value is None:
+        return float("nan")
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise ValueError("Only numeric analysis results can be made columnar, got {0!r}.".format(value))
+
+
+def _from_float(value):
+    return None if math.isnan(value) else float(value)
+
+
+def _restore_int(value):
+    # The values are stored as floats, but most analyses count things.
+    if value is not None and value.is_integer():
+        return int(value)
+    return value
@@ -0,0 +1,291 @@
+""" A shared-memory ring buffer of serialized events, written by many
+processes on a host and drained by a single uploader process.
+
+The ring is a file (ideally on a tmpfs such as /dev/shm) mapped into every
+process. Producers append records under a lock that excludes both the other
+processes (a POSIX record lock on the file) and the other threads of their own
+process. The uploader reads committed records without holding the lock and
+only takes it to publish how far it has read, so producers are never blocked
+by an upload. Requires a POSIX system (fcntl).
+"""
+
+import mmap
+import os
+import struct
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from keen import buffer as event_buffer
+from keen import forking
+
+DEFAULT_RING_CAPACITY = 64 * 1024 * 1024
+
+_MAGIC = b"KEENRNG1"
+# magic, capacity, head, tail, written, dropped
+_HEADER = struct.Struct("<8sQQQQQ")
+_HEADER_SIZE = 64
+_HEAD_OFFSET = 16
+_TAIL_OFFSET = 24
+_WRITTEN_OFFSET = 32
+_DROPPED_OFFSET = 40
+_COUNTER = struct.Struct("<Q")
+# total record length, collection length
+_RECORD = struct.Struct("<IH")
+
+
+class SharedRingBuffer(object):
+    """
+    A fixed-size, multi-producer, single-consumer ring of (collection, data)
+    records in a memory-mapped file.
+
+    head and tail are byte counters that only grow; the ring holds the
+    records between them, at positions modulo the capacity. A put() that
+    doesn't fit is dropped and counted rather than waited on, so producers
+    never block on the uploader.
+    """
+
+    def __init__(self, path, capacity=DEFAULT_RING_CAPACITY):
+        """ Opens the ring at path, creating it if it doesn't exist.
+
+        :param path: the ring file, e.g. /dev/shm/keen-events
+        :param capacity: the size of the ring in bytes when it is created; an
+        existing ring keeps its capacity
+        """
+        super(SharedRingBuffer, self).__init__()
+        if fcntl is None:
+            raise RuntimeError("SharedRingBuffer requires a POSIX system.")
+        self.path = path
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        self._thread_lock = threading.Lock()
+        with self._lock():
+            size = os.fstat(self._fd).st_size
+            if size == 0:
+                os.ftruncate(self._fd, _HEADER_SIZE + capacity)
+                self._map = mmap.mmap(self._fd, _HEADER_SIZE + capacity)
+                self._map[:_HEADER.size] = _HEADER.pack(_MAGIC, capacity, 0, 0, 0, 0)
+            else:
+                self._map = mmap.mmap(self._fd, size)
+                if self._map[:len(_MAGIC)] != _MAGIC:
+                    raise ValueError("{0} is not a Keen ring buffer.".format(path))
+        self.capacity = _HEADER.unpack_from(self._map, 0)[1]
+        forking.register(self)
+
+    def _after_fork(self):
+        # Record locks aren't inherited, but a thread lock held during the
+        # fork would never be released in the child.
+        self._thread_lock = threading.Lock()
+
+    def _lock(self):
+        return _RingLock(self._fd, self._thread_lock)
+
+    def _get(self, offset):
+        return _COUNTER.unpack_from(self._map, offset)[0]
+
+    def _set(self, offset, value):
+        _COUNTER.pack_into(self._map, offset, value)
+
+    def _write(self, position, data):
+        start = _HEADER_SIZE + position % self.capacity
+        first = min(len(data), _HEADER_SIZE + self.capacity - start)
+        self._map[start:start + first] = data[:first]
+        if first < len(data):
+            self._map[_HEADER_SIZE:_HEADER_SIZE + len(data) - first] = data[first:]
+
+    def _read(self, position, length):
+        start = _HEADER_SIZE + position % self.capacity
+        first = min(length, _HEADER_SIZE + self.capacity - start)
+        data = self._map[start:start + first]
+        if first < length:
+            data += self._map[_HEADER_SIZE:_HEADER_SIZE + length - first]
+        return data
+
+    def put(self, collection, data):
+        """ Appends one serialized event.
+
+        :param collection: the name of the collection to insert the event to
+        :param data: the event as JSON bytes
+        :returns: True if the event was written, False if the ring was full
+        """
+        name = collection.encode("utf-8")
+        record = _RECORD.pack(_RECORD.size + len(name) + len(data), len(name)) + name + data
+        with self._lock():
+            head = self._get(_HEAD_OFFSET)
+            if head + len(record) - self._get(_TAIL_OFFSET) > self.capacity:
+                self._set(_DROPPED_OFFSET, self._get(_DROPPED_OFFSET) + 1)
+                return False
+            self._write(head, record)
+            # Publishing the new head last makes the record visible to the
+            # reader only once it is complete.
+            self._set(_HEAD_OFFSET, head + len(record))
+            self._set(_WRITTEN_OFFSET, self._get(_WRITTEN_OFFSET) + 1)
+        return True
+
+    def read_batch(self, max_events, max_bytes=None):
+        """ Reads the oldest records without consuming them. Only the single
+        uploader of the ring may call this.
+
+        :param max_events: the maximum number of events to return
+        :param max_bytes: optional, the approximate maximum total size
+        :returns: a list of (collection, data) tuples and the position to pass
+        to commit() once they are uploaded
+        """
+        with self._lock():
+            head = self._get(_HEAD_OFFSET)
+        position = self._get(_TAIL_OFFSET)
+        items = []
+        size = 0
+        while position < head and len(items) < max_events:
+            length, name_length = _RECORD.unpack(self._read(position, _RECORD.size))
+            if items and max_bytes is not None and size + length > max_bytes:
+                break
+            record = self._read(position + _RECORD.size, length - _RECORD.size)
+            items.append((record[:name_length].decode("utf-8"), record[name_length:]))
+            position += length
+            size += length
+        return items, position
+
+    def commit(self, position):
+        """ Frees the records before position, as returned by read_batch(). """
+        with self._lock():
+            self._set(_TAIL_OFFSET, position)
+
+    def stats(self):
+        """ Returns the ring's counters, shared by all its processes, as a dict. """
+        with self._lock():
+            head = self._get(_HEAD_OFFSET)
+            tail = self._get(_TAIL_OFFSET)
+            return {
+                "capacity": self.capacity,
+                "bytes": head - tail,
+                "written": self._get(_WRITTEN_OFFSET),
+                "dropped": self._get(_DROPPED_OFFSET),
+            }
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
+
+
+class _RingLock(object):
+
+    __slots__ = ("fd", "thread_lock")
+
+    def __init__(self, fd, thread_lock):
+        self.fd = fd
+        self.thread_lock = thread_lock
+
+    def __enter__(self):
+        self.thread_lock.acquire()
+        try:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX)
+        except Exception:
+            self.thread_lock.release()
+            raise
+
+    def __exit__(self, *exc_info):
+        try:
+            fcntl.lockf(self.fd, fcntl.LOCK_UN)
+        finally:
+            self.thread_lock.release()
+
+
+class RingUploader(object):
+    """
+    Drains a SharedRingBuffer into large post_events batches. Run exactly one
+    per ring, usually as `python -m keen upload-ring`.
+
+    A batch is only committed (freed in the ring) once it is uploaded, or
+    written to the spool if there is one. While uploads fail the events stay
+    in the ring, and producers start dropping once it is full.
+    """
+
+    def __init__(self, ring, post, batch_size=5000, max_batch_bytes=5 * 1024 * 1024, poll_interval=0.2,
+                 retry_backoff=1.0, max_backoff=60.0, spool=None):
+        """ Initializes a RingUploader.
+
+        :param ring: the SharedRingBuffer to drain
+        :param post: callable uploading a {collection: [event, ...]} dict,
+        typically KeenApi.post_events
+        :param batch_size: the maximum number of events per upload
+        :param max_batch_bytes: the approximate maximum size of an upload
+        :param poll_interval: seconds to wait when the ring is empty
+        :param retry_backoff: seconds to wait after the first failed upload,
+        doubled after every further failure
+        :param max_backoff: the longest wait after failed uploads
+        :param spool: optional, a keen.spool.DiskSpool that batches are
+        written to when their upload fails, instead of retrying them
+        """
+        super(RingUploader, self).__init__()
+        self.ring = ring
+        self.post = post
+        self.batch_size = batch_size
+        self.max_batch_bytes = max_batch_bytes
+        self.poll_interval = poll_interval
+        self.retry_backoff = retry_backoff
+        self.max_backoff = max_backoff
+        self.spool = spool
+        self.uploaded = 0
+        self.spilled = 0
+        self.failures = 0
+        self.last_error = None
+        self._stop = threading.Event()
+
+    def upload_once(self):
+        """ Uploads one batch from the ring.
+
+        :returns: the number of events uploaded or spooled, None if the upload
+        failed and the events were left in the ring
+        """
+        items, position = self.ring.read_batch(self.batch_size, max_bytes=self.max_batch_bytes)
+        if not items:
+            return 0
+        try:
+            self.post(event_buffer.group_by_collection(items))
+        except Exception as e:
+            self.failures += 1
+            self.last_error = e
+            if self.spool is None:
+                return None
+            self.spool.write(items)
+            self.spilled += len(items)
+        else:
+            self.uploaded += len(items)
+        self.ring.commit(position)
+        return len(items)
+
+    def run(self):
+        """ Uploads batches until stop() is called. """
+        delay = self.retry_backoff
+        while not self._stop.is_set():
+            count = self.upload_once()
+            if count is None:
+                self._stop.wait(delay)
+                delay = min(delay * 2, self.max_backoff)
+                continue
+            delay = self.retry_backoff
+            if count == 0:
+                self._stop.wait(self.poll_interval)
+
+    def stop(self):
+        self._stop.set()
+
+    def drain(self, timeout=None):
+        """ Uploads until the ring is empty, an upload fails or the timeout
+        expires.
+
+        :param timeout: optional, the most seconds to spend
+        :returns: the number of events uploaded or spooled
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        total = 0
+        while deadline is None or time.time() < deadline:
+            count = self.upload_once()
+            if not count:
+                break
+            total += count
+        return total
@@ -0,0 +1,278 @@
+""" Client-side sampling of high-volume collections.
+
+A Sampling maps collections to Samplers. Every event a sampler keeps gets a
+weight property: the number of events it stands for, i.e. 1 / the sampling
+rate at the time. Summing the weight property (KeenClient.weighted_count())
+estimates the number of events before sampling, and rescale() scales count
+and sum results by a fixed sampling rate.
+"""
+
+import hashlib
+import json
+import math
+import numbers
+import random
+import threading
+import time
+
+import six
+
+from keen import forking, payloads, results
+
+DEFAULT_WEIGHT_PROPERTY = "sample_weight"
+
+
+class Sampler(object):
+    """ Decides which events of a collection are kept. """
+
+    def sample(self, event):
+        """ Returns the weight of the event if it is kept, 0 if it is dropped.
+
+        :param event: the event body, a dict or JSON bytes/str
+        """
+        raise NotImplementedError()
+
+    @property
+    def rate(self):
+        """ The fraction of events currently kept. """
+        raise NotImplementedError()
+
+
+class RateSampler(Sampler):
+    """ Keeps each event with a fixed probability. """
+
+    def __init__(self, rate, random=random.random):
+        """ Initializes a RateSampler.
+
+        :param rate: the fraction of events to keep, e.g. 0.01
+        :param random: optional, a callable returning floats in [0, 1)
+        """
+        super(RateSampler, self).__init__()
+        if not 0 < rate <= 1:
+            raise ValueError("The sampling rate must be in (0, 1].")
+        self._rate = rate
+        self.weight = 1.0 / rate
+        self.random = random
+
+    @property
+    def rate(self):
+        return self._rate
+
+    def sample(self, event):
+        return self.weight if self.random() < self._rate else 0
+
+
+class KeySampler(RateSampler):
+    """
+    Keeps a fixed fraction of the values of a key property, e.g. user.id,
+    with every event of a kept value. The decision is a hash of the value, so
+    it is the same in every process and a user's events are kept or dropped
+    together. Events without the key are sampled randomly at the same rate.
+    """
+
+    def __init__(self, rate, key, random=random.random):
+        """ Initializes a KeySampler.
+
+        :param rate: the fraction of key values to keep
+        :param key: the name of the key property, nested properties separated
+        by dots, e.g. "user.id"
+        :param random: optional, a callable returning floats in [0, 1)
+        """
+        super(KeySampler, self).__init__(rate, random=random)
+        self.key = key
+        self._path = key.split(".")
+        self._threshold = int(rate * 2 ** 64)
+
+    def sample(self, event):
+        if payloads.is_serialized(event):
+            event = json.loads(_text(event))
+        value = event
+        for name in self._path:
+            if not isinstance(value, dict) or name not in value:
+                return super(KeySampler, self).sample(event)
+            value = value[name]
+        digest = hashlib.md5(json.dumps(value, sort_keys=True).encode("utf-8")).hexdigest()
+        return self.weight if int(digest[:16], 16) < self._threshold else 0
+
+
+class TokenBucketSampler(Sampler):
+    """
+    Keeps at most events_per_second events a second, with bursts of up to
+    burst events, and drops the rest. Below the cap every event is kept with
+    weight 1; above it, the weight is the recent arrival rate divided by the
+    cap, so the weights of the kept events add up to the events seen.
+    """
+
+    def __init__(self, events_per_second, burst=None, window=1.0, clock=time.time):
+        """ Initializes a TokenBucketSampler.
+
+        :param events_per_second: the most events kept per second
+        :param burst: optional, the most events kept at once after a quiet
+        period, defaults to events_per_second
+        :param window: the time constant in seconds of the arrival rate
+        average
+        :param clock: optional, a callable returning the time in seconds
+        """
+        super(TokenBucketSampler, self).__init__()
+        if events_per_second <= 0:
+            raise ValueError("events_per_second must be positive.")
+        self.events_per_second = float(events_per_second)
+        self.burst = float(burst if burst is not None else events_per_second)
+        self.window = window
+        self.clock = clock
+        self._tokens = self.burst
+        # Exponentially decayed count of arrivals; / window is the rate.
+        self._arrivals = 0.0
+        self._last = clock()
+        self._lock = threading.Lock()
+        forking.register(self)
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+
+    @property
+    def weight(self):
+        return max(1.0, self._arrivals / self.window / self.events_per_second)
+
+    @property
+    def rate(self):
+        return 1.0 / self.weight
+
+    def sample(self, event):
+        with self._lock:
+            now = self.clock()
+            elapsed = max(0.0, now - self._last)
+            self._last = now
+            self._tokens = min(self.burst, self._tokens + elapsed * self.events_per_second)
+            self._arrivals = self._arrivals * math.exp(-elapsed / self.window) + 1
+            if self._tokens < 1:
+                return 0
+            self._tokens -= 1
+            return self.weight
+
+
+class Sampling(object):
+    """
+    The samplers of a client's collections. Events of collections without a
+    sampler are passed through unchanged.
+    """
+
+    def __init__(self, samplers, weight_property=DEFAULT_WEIGHT_PROPERTY):
+        """ Initializes a Sampling.
+
+        :param samplers: dict mapping collection names to Samplers
+        :param weight_property: the name of the property the weight of a kept
+        event is written to
+        """
+        super(Sampling, self).__init__()
+        self.samplers = dict(samplers)
+        self.weight_property = weight_property
+        self.seen = dict((collection, 0) for collection in self.samplers)
+        self.kept = dict((collection, 0) for collection in self.samplers)
+        # '"sample_weight":' to splice into serialized events
+        self._prefix = json.dumps(weight_property) + ":"
+
+    def sample(self, collection, event):
+        """ Returns the event with its weight property set, or None if it is
+        dropped. Dict events are copied, not modified.
+
+        :param collection: the collection of the event
+        :param event: the event body, a dict or JSON bytes/str
+        """
+        sampler = self.samplers.get(collection)
+        if sampler is None:
+            return event
+        weight = sampler.sample(event)
+        # Counted without a lock, these are approximate under contention.
+        self.seen[collection] += 1
+        if not weight:
+            return None
+        self.kept[collection] += 1
+        if payloads.is_serialized(event):
+            return self._splice(event, weight)
+        weighted = dict(event)
+        weighted[self.weight_property] = weight
+        return weighted
+
+    def sample_events(self, events):
+        """ Samples a dict mapping collection names to lists of events.
+
+        :returns: a new dict with the kept events
+        """
+        sampled = {}
+        for collection, collection_events in six.iteritems(events):
+            if collection not in self.samplers:
+                sampled[collection] = collection_events
+                continue
+            sample = self.sample
+            sampled[collection] = [weighted for weighted in (sample(collection, event) for event in collection_events)
+                                   if weighted is not None]
+        return sampled
+
+    def sample_iterable(self, collection, events):
+        """ Samples an iterable of events of one collection lazily. """
+        if collection not in self.samplers:
+            return iter(events)
+        sample = self.sample
+        return (weighted for weighted in (sample(collection, event) for event in events) if weighted is not None)
+
+    def sample_pairs(self, pairs):
+        """ Samples an iterable of (collection, event) pairs lazily. """
+        sample = self.sample
+        for collection, event in pairs:
+            event = sample(collection, event)
+            if event is not None:
+                yield collection, event
+
+    def stats(self):
+        """ Returns the events seen and kept, and the current rate, of every
+        sampled collection.
+        """
+        return dict((collection, {"seen": self.seen[collection], "kept": self.kept[collection],
+                                  "rate": sampler.rate})
+                    for collection, sampler in six.iteritems(self.samplers))
+
+    def rescale(self, collection, result):
+        """ Scales a count or sum result of a collection by its sampler's
+        current rate. Returns unsampled collections' results unchanged.
+        """
+        sampler = self.samplers.get(collection)
+        if sampler is None:
+            return result
+        return rescale(result, 1.0 / sampler.rate)
+
+    def _splice(self, event, weight):
+        # Writes the property first; a property of the same name in the
+        # event would come later and win.
+        body = _text(event).lstrip()[1:].lstrip()
+        separator = "" if body.startswith("}") else ","
+        return "{" + self._prefix + json.dumps(weight) + separator + body
+
+
+def _text(event):
+    return event if isinstance(event, six.text_type) else bytes(event).decode("utf-8")
+
+
+def rescale(result, weight):
+    """ Multiplies the numbers of a count or sum result by weight, e.g. by
+    100 for events sampled at 1%. Handles plain, interval and group_by
+    results, and keen.results.ColumnarResults.
+
+    :param result: the result of KeenClient.count() or sum()
+    :param weight: the number of events each kept event stands for
+    """
+    if isinstance(result, bool) or result is None:
+        return result
+    if isinstance(result, numbers.Number):
+        return result * weight
+    if isinstance(result, results.ColumnarResult):
+        return result.scaled(weight)
+    if isinstance(result, list):
+        return [rescale(item, weight) for item in result]
+    if isinstance(result, dict):
+        rescaled = dict(result)
+        for key in ("result", "value"):
+            if key in rescaled:
+                rescaled[key] = rescale(rescaled[key], weight)
+        return rescaled
+    raise TypeError("Can't rescale a result of type {0}.".format(type(result).__name__))
@@ -0,0 +1,118 @@
+import atexit
+import os
+import signal
+import sys
+import threading
+
+DEFAULT_SHUTDOWN_TIMEOUT = 10.0
+
+# Extra seconds to wait for the closing thread beyond the flush timeout,
+# for the joins that follow the flush in close().
+_JOIN_GRACE = 1.0
+
+
+def print_report(report, stream=None):
+    """ Writes a one-line summary of a FlushReport, if there was anything to
+    flush. The default report callback of ShutdownHook.
+    """
+    if report:
+        stream = stream or sys.stderr
+        stream.write("keen: flushed {0} events on shutdown, spilled {1}, lost {2}, "
+                     "{3} still in flight\n".format(report.flushed, report.spilled, report.lost, report.in_flight))
+
+
+class ShutdownHook(object):
+    """
+    Closes a KeenClient when the interpreter exits or the process receives
+    one of the given signals, so queued events are uploaded (or spooled)
+    instead of being lost. The client is closed at most once.
+
+    The client is closed on a thread of the hook's own, which the caller
+    waits for no longer than the timeout. A signal can arrive while the main
+    thread holds a lock of the client, e.g. inside EventBuffer.put(), and a
+    handler that flushed on the main thread would wait for that lock forever.
+
+    Create one with KeenClient.close_on_exit().
+    """
+
+    def __init__(self, client, timeout=DEFAULT_SHUTDOWN_TIMEOUT, on_report=print_report):
+        """ Initializes a ShutdownHook.
+
+        :param client: the KeenClient to close
+        :param timeout: the most seconds to spend flushing
+        :param on_report: optional, a callable receiving the FlushReport
+        """
+        super(ShutdownHook, self).__init__()
+        self.client = client
+        self.timeout = timeout
+        self.on_report = on_report
+        self.report = None
+        self._lock = threading.Lock()
+        self._requested = threading.Event()
+        self._thread = None
+        self._previous_handlers = {}
+
+    def install(self, signals=(signal.SIGTERM,)):
+        """ Registers the hook with atexit and as the handler of signals.
+        Signal handlers can only be installed from the main thread.
+
+        :param signals: the signals to flush on; the previous handler of each
+        is called afterwards
+        :returns: self
+        """
+        self._start()
+        atexit.register(self)
+        for signum in signals:
+            self._previous_handlers[signum] = signal.signal(signum, self._handle_signal)
+        return self
+
+    def uninstall(self):
+        """ Restores the previous signal handlers and unregisters from atexit
+        where the interpreter supports it.
+        """
+        for signum, previous in self._previous_handlers.items():
+            signal.signal(signum, previous if previous is not None else signal.SIG_DFL)
+        self._previous_handlers = {}
+        if hasattr(atexit, "unregister"):
+            atexit.unregister(self)
+
+    def __call__(self):
+        """ Closes the client, waiting at most the timeout (plus a grace
+        second) for it.
+
+        :returns: the FlushReport, or None if closing didn't finish in time
+        """
+        self._start()
+        self._requested.set()
+        self._thread.join(None if self.timeout is None else self.timeout + _JOIN_GRACE)
+        return self.report
+
+    def _start(self):
+        # The closing thread waits for _requested; starting it ahead, in
+        # install(), leaves a signal handler nothing to do but set an Event.
+        # A forked child has no thread yet, or the parent's dead one.
+        thread = self._thread
+        if self.report is None and (thread is None or not thread.is_alive()):
+            thread = threading.Thread(target=self._run, name="keen-shutdown")
+            thread.daemon = True
+            thread.start()
+            self._thread = thread
+
+    def _run(self):
+        self._requested.wait()
+        with self._lock:
+            if self.report is not None:
+                return
+            self.report = self.client.close(timeout=self.timeout)
+        if self.on_report is not None:
+            self.on_report(self.report)
+
+    def _handle_signal(self, signum, frame):
+        self()
+        previous = self._previous_handlers.get(signum)
+        if callable(previous):
+            previous(signum, frame)
+        elif previous != signal.SIG_IGN:
+            # Let the default action (usually terminating) happen as before.
+            signal.signal(signum, signal.SIG_DFL)
+            os.kill(os.getpid(), signum)
@@ -0,0 +1,455 @@
+import errno
+import gzip
+import io
+import itertools
+import json
+import os
+import threading
+import time
+
+from keen import buffer as event_buffer
+from keen import forking
+
+SEGMENT_SUFFIX = ".seg"
+COMPRESSED_SEGMENT_SUFFIX = ".seg.gz"
+_TEMPORARY_SUFFIX = ".tmp"
+_CLAIM_SUFFIX = ".claim"
+
+# Seconds a replayer may go without progress on a segment it claimed before
+# other processes may claim it again.
+DEFAULT_LEASE = 600.0
+
+
+class DiskSpool(object):
+    """
+    Spills serialized events to segment files in a local directory, so they
+    survive an outage of the Keen API or a full EventBuffer.
+
+    Every write() creates one segment file. A segment is a sequence of
+    records, each a header line with the byte length and the collection name
+    followed by the event JSON exactly as it was queued:
+
+        8 "clicks"\\n{"a": 1}\\n
+
+    Segments are written to a temporary name and renamed into place, so a
+    crash never leaves a half-written segment behind. Their names sort by age,
+    oldest first. Processes sharing the directory claim a segment by renaming
+    it before replaying it. A DiskSpool can be used as the spill of an
+    EventBuffer, but a SpillWriter around it writes the spilled events in
+    batches instead of a segment per event.
+    """
+
+    def __init__(self, directory, compress=False):
+        """ Initializes a DiskSpool.
+
+        :param directory: the directory to write segments to, created if missing
+        :param compress: whether to gzip the segments
+        """
+        super(DiskSpool, self).__init__()
+        self.directory = directory
+        self.compress = compress
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        forking.register(self)
+        self.spilled_events = 0
+        self.spilled_bytes = 0
+
+    def _after_fork(self):
+        # Segment names include the PID, so only the lock needs replacing.
+        self._lock = threading.Lock()
+
+    def write(self, items):
+        """ Writes events to a new segment.
+
+        :param items: a list of (collection, data) tuples, data being the
+        event as JSON bytes
+        :returns: the path of the segment, None if items was empty
+        """
+        if not items:
+            return None
+        suffix = COMPRESSED_SEGMENT_SUFFIX if self.compress else SEGMENT_SUFFIX
+        name = "{0:020d}-{1:08d}-{2}{3}".format(int(time.time() * 1000000), next(self._sequence),
+                                                os.getpid(), suffix)
+        path = os.path.join(self.directory, name)
+        size = self._write_segment(path, items)
+        with self._lock:
+            self.spilled_events += len(items)
+            self.spilled_bytes += size
+        return path
+
+    def rewrite(self, path, items):
+        """ Replaces the events of a segment, keeping its place in the order.
+
+        :param path: the path of a segment
+        :param items: the (collection, data) tuples to keep
+        """
+        self._write_segment(path, items)
+
+    def _write_segment(self, path, items):
+        buffer = io.BytesIO()
+        for collection, data in items:
+            buffer.write("{0} {1}\n".format(len(data), json.dumps(collection)).encode("utf-8"))
+            buffer.write(data)
+            buffer.write(b"\n")
+        body = buffer.getvalue()
+
+        temporary = path + _TEMPORARY_SUFFIX
+        with open(temporary, "wb") as f:
+            if _unclaimed(path).endswith(COMPRESSED_SEGMENT_SUFFIX):
+                with gzip.GzipFile(fileobj=f, mode="wb") as compressed:
+                    compressed.write(body)
+            else:
+                f.write(body)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(temporary, path)
+        return len(body)
+
+    def segments(self):
+        """ Returns the paths of the complete segments, oldest first. """
+        return [os.path.join(self.directory, name) for name in sorted(os.listdir(self.directory))
+                if name.endswith(SEGMENT_SUFFIX) or name.endswith(COMPRESSED_SEGMENT_SUFFIX)]
+
+    def __len__(self):
+        return len(self.segments())
+
+    def read(self, path):
+        """ Reads the events of a segment.
+
+        :param path: the path of a segment
+        :returns: a list of (collection, data) tuples
+        """
+        opener = gzip.open if _unclaimed(path).endswith(COMPRESSED_SEGMENT_SUFFIX) else io.open
+        with opener(path, "rb") as f:
+            body = f.read()
+        items = []
+        position = 0
+        while position < len(body):
+            header_end = body.index(b"\n", position)
+            length, collection = body[position:header_end].decode("utf-8").split(" ", 1)
+            start = header_end + 1
+            end = start + int(length)
+            items.append((json.loads(collection), body[start:end]))
+            position = end + 1
+        return items
+
+    def remove(self, path):
+        """ Deletes a segment once its events have been uploaded. A segment
+        that is already gone is ignored.
+
+        :param path: the path of a segment
+        """
+        try:
+            os.remove(path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+    def claim(self, path):
+        """ Takes a segment for replaying, so no other process replays it.
+        The claimed segment is no longer listed by segments().
+
+        :param path: the path of a segment
+        :returns: the path of the claimed segment, None if another process
+        claimed or removed it first
+        """
+        claimed = "{0}.{1}{2}".format(path, os.getpid(), _CLAIM_SUFFIX)
+        try:
+            # Atomic: of several processes renaming a segment, one succeeds.
+            os.rename(path, claimed)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return None
+        self.renew(claimed)
+        return claimed
+
+    def renew(self, claimed):
+        """ Records progress on a claimed segment, restarting its lease. """
+        try:
+            os.utime(claimed, None)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+    def release(self, claimed, items=None):
+        """ Puts a claimed segment back in its place, e.g. after a failed
+        replay.
+
+        :param claimed: the path returned by claim()
+        :param items: optional, the (collection, data) tuples to keep, when
+        some were replayed already
+        """
+        if items is not None:
+            self._write_segment(claimed, items)
+        try:
+            os.rename(claimed, _unclaimed(claimed))
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+    def reclaim(self, lease=DEFAULT_LEASE):
+        """ Releases the segments whose claims haven't been renewed for lease
+        seconds, e.g. because the claiming process died.
+        """
+        expired = time.time() - lease
+        for name in os.listdir(self.directory):
+            if not name.endswith(_CLAIM_SUFFIX):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.getmtime(path) < expired:
+                    os.rename(path, _unclaimed(path))
+            except OSError:
+                # Another process released or removed it meanwhile.
+                pass
+
+
+class SpillWriter(object):
+    """
+    The spill of an EventBuffer that writes to a DiskSpool in batches, off
+    the thread adding events. write() only queues the events; a background
+    thread writes everything queued within interval seconds of the first
+    event to one segment. During an outage every put() overflows, and a
+    fsync'd segment per event would make adding events as slow as the disk.
+
+    Queued events are in memory until they are written. When max_pending
+    events are queued, write() writes them itself, so memory stays bounded.
+    """
+
+    def __init__(self, spool, interval=0.05, max_pending=10000):
+        """ Initializes a SpillWriter.
+
+        :param spool: the DiskSpool to write to
+        :param interval: seconds to collect events for a segment
+        :param max_pending: the most events queued before write() writes
+        them on the caller's thread
+        """
+        super(SpillWriter, self).__init__()
+        self.spool = spool
+        self.interval = interval
+        self.max_pending = max_pending
+        self.failed = 0
+        self.last_error = None
+        self._reset()
+        forking.register(self)
+
+    def _reset(self):
+        self._condition = threading.Condition(threading.Lock())
+        # Held while a batch is written, so flush() returns after the
+        # writes of earlier events.
+        self._write_lock = threading.Lock()
+        self._pending = []
+        self._thread = None
+        self._closed = False
+
+    def _after_fork(self):
+        # The queued events are the parent's to write.
+        self._reset()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def write(self, items):
+        """ Queues events to be written to the spool.
+
+        :param items: a list of (collection, data) tuples
+        """
+        with self._condition:
+            self._pending.extend(items)
+            full = len(self._pending) >= self.max_pending
+            if not full:
+                self._ensure_thread()
+                self._condition.notify()
+        if full:
+            self.flush()
+
+    def flush(self):
+        """ Writes the queued events now. """
+        with self._write_lock:
+            with self._condition:
+                items, self._pending = self._pending, []
+            self._write(items)
+
+    def close(self):
+        """ Writes the queued events and stops the background thread. """
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+        self.flush()
+
+    def _ensure_thread(self):
+        # Called with _condition held.
+        if self._closed or (self._thread is not None and self._thread.is_alive()):
+            return
+        self._thread = threading.Thread(target=self._run, name="keen-spill")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._closed:
+                    self._condition.wait()
+                if self._closed:
+                    return
+            # Let more events join this segment.
+            time.sleep(self.interval)
+            self.flush()
+
+    def _write(self, items):
+        if not items:
+            return
+        try:
+            self.spool.write(items)
+        except Exception as e:
+            self.failed += len(items)
+            self.last_error = e
+
+
+class SpoolReplayer(object):
+    """
+    A background thread that uploads spooled segments, oldest first, once the
+    Keen API accepts uploads again.
+
+    Every pass tries the oldest segment; a failure backs off exponentially up
+    to max_backoff seconds, and a success moves straight on to the next
+    segment. wake() starts a pass right away, e.g. after a live upload
+    succeeded. Uploads are throttled to max_events_per_second so that
+    replaying a long outage doesn't compete with live traffic.
+    """
+
+    def __init__(self, spool, post, batch_size=500, max_events_per_second=1000, interval=5.0,
+                 max_backoff=300.0, lease=DEFAULT_LEASE):
+        """ Initializes a SpoolReplayer.
+
+        :param spool: the DiskSpool to replay
+        :param post: callable uploading a {collection: [event, ...]} dict,
+        typically KeenApi.post_events; it must raise when the upload fails
+        :param batch_size: the maximum number of events per upload
+        :param max_events_per_second: the replay rate limit, None for no limit
+        :param interval: seconds between passes while the spool is empty or
+        after the first failure
+        :param max_backoff: the longest wait between passes after failures
+        :param lease: seconds without progress after which a segment claimed
+        by another process, which may have died, is replayed here
+        """
+        super(SpoolReplayer, self).__init__()
+        self.spool = spool
+        self.post = post
+        self.batch_size = batch_size
+        self.max_events_per_second = max_events_per_second
+        self.interval = interval
+        self.max_backoff = max_backoff
+        self.lease = lease
+
+        self.replayed_events = 0
+        self.failures = 0
+        self.last_error = None
+        self._reset_threading()
+        forking.register(self)
+
+    def _reset_threading(self):
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _after_fork(self):
+        # The replay thread wasn't forked; start() starts a new one.
+        self._reset_threading()
+
+    def start(self):
+        """ Starts the replay thread unless it is already running. """
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name="keen-spool-replay")
+                self._thread.daemon = True
+                self._thread.start()
+
+    def stop(self, timeout=None):
+        """ Stops the replay thread after the current upload.
+
+        :param timeout: seconds to wait for the thread to exit
+        """
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def wake(self):
+        """ Starts the next pass now instead of at the end of the current wait. """
+        self._wake.set()
+
+    def _run(self):
+        delay = self.interval
+        while not self._stop.is_set():
+            try:
+                replayed = self.replay_once()
+            except Exception as e:
+                # E.g. a full or unreadable disk; keep the thread alive.
+                self.failures += 1
+                self.last_error = e
+                replayed = False
+            if replayed:
+                delay = self.interval
+                if self.spool.segments():
+                    continue
+            else:
+                delay = min(delay * 2, self.max_backoff)
+            self._wake.wait(delay)
+            self._wake.clear()
+
+    def replay_once(self):
+        """ Claims the oldest segment no other process has claimed, uploads
+        it and deletes it.
+
+        :returns: False if the upload failed, True otherwise (including when
+        there was nothing to replay)
+        """
+        self.spool.reclaim(self.lease)
+        for path in self.spool.segments():
+            claimed = self.spool.claim(path)
+            if claimed is not None:
+                break
+        else:
+            return True
+        try:
+            items = self.spool.read(claimed)
+        except (IOError, OSError) as e:
+            if e.errno != errno.ENOENT:
+                raise
+            # Our lease ran out and another process took the segment.
+            return True
+        for start in range(0, len(items), self.batch_size):
+            batch = items[start:start + self.batch_size]
+            try:
+                self.post(event_buffer.group_by_collection(batch))
+            except Exception as e:
+                self.failures += 1
+                self.last_error = e
+                # Keep only what wasn't uploaded, so it isn't sent twice.
+                self.spool.release(claimed, items[start:] if start else None)
+                return False
+            self.replayed_events += len(batch)
+            self.spool.renew(claimed)
+            self._throttle(len(batch))
+        self.spool.remove(claimed)
+        return True
+
+    def _throttle(self, count):
+        if self.max_events_per_second:
+            self._stop.wait(float(count) / self.max_events_per_second)
+
+
+def _unclaimed(path):
+    # "<segment>.<pid>.claim" -> "<segment>"
+    if path.endswith(_CLAIM_SUFFIX):
+        return path.rsplit(".", 2)[0]
+    return path
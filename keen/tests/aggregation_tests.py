@@ -0,0 +1,158 @@
+import datetime
+
+from mock import Mock, patch
+
+from keen import aggregation
+from keen.client import KeenClient
+from keen.api import KeenApi
+from keen.persistence_strategies import AggregatingPersistenceStrategy, DirectPersistenceStrategy
+from keen.tests.base_test_case import BaseTestCase
+
+# 2024-01-01T00:00:00Z
+MIDNIGHT = 1704067200
+
+
+class AggregatorTests(BaseTestCase):
+
+    def setUp(self):
+        super(AggregatorTests, self).setUp()
+        self.aggregator = aggregation.Aggregator({
+            "requests": aggregation.Aggregation(["endpoint", "client.os"], metrics=["duration"]),
+        }, max_keys=2, grace=5)
+
+    def test_collapses_identical_dimensions(self):
+        for duration in (3, 1, 8):
+            self.aggregator.add("requests", {"endpoint": "/a", "client": {"os": "ios"}, "duration": duration},
+                                MIDNIGHT + 10)
+        self.aggregator.add("requests", {"endpoint": "/a", "client": {"os": "ios"}, "duration": "n/a"}, MIDNIGHT + 20)
+
+        self.assert_equal([("requests", {
+            "endpoint": "/a", "client": {"os": "ios"}, "count": 4,
+            "duration": {"sum": 12, "min": 1, "max": 8},
+            "keen": {"timestamp": "2024-01-01T00:00:00Z"},
+        })], self.aggregator.pop_all())
+        self.assert_equal(0, len(self.aggregator))
+
+    def test_time_buckets(self):
+        self.aggregator.add("requests", {"endpoint": "/a"}, MIDNIGHT + 59)
+        self.aggregator.add("requests", {"endpoint": "/a"}, MIDNIGHT + 60)
+
+        self.assert_equal([], self.aggregator.pop_closed(MIDNIGHT + 64))
+        closed = self.aggregator.pop_closed(MIDNIGHT + 65)
+
+        self.assert_equal(1, len(closed))
+        self.assert_equal("2024-01-01T00:00:00Z", closed[0][1]["keen"]["timestamp"])
+        self.assert_equal(1, len(self.aggregator))
+
+    def test_evicts_least_recently_updated(self):
+        self.aggregator.add("requests", {"endpoint": "/a"}, MIDNIGHT)
+        self.aggregator.add("requests", {"endpoint": "/b"}, MIDNIGHT)
+        self.aggregator.add("requests", {"endpoint": "/a"}, MIDNIGHT)
+
+        evicted = self.aggregator.add("requests", {"endpoint": "/c"}, MIDNIGHT)
+
+        self.assert_equal([("requests", {"endpoint": "/b", "count": 1, "keen": {"timestamp": "2024-01-01T00:00:00Z"}})],
+                          evicted)
+        self.assert_equal(1, self.aggregator.evicted)
+        self.assert_equal(2, len(self.aggregator))
+
+    def test_event_time(self):
+        self.assert_equal(MIDNIGHT, aggregation.event_time({"keen": {"timestamp": "2024-01-01T00:00:00Z"}}, 0))
+        self.assert_equal(MIDNIGHT + 0.5, aggregation.event_time({"keen": {"timestamp": "2024-01-01 00:00:00.5"}}, 0))
+        self.assert_equal(MIDNIGHT, aggregation.event_time({"keen": {"timestamp": "2023-12-31T19:00:00-05:00"}}, 0))
+        self.assert_equal(7, aggregation.event_time({"keen": {"timestamp": "yesterday"}}, 7))
+        self.assert_equal(7, aggregation.event_time({"a": 1}, 7))
+
+    def test_epoch_seconds(self):
+        self.assert_equal(MIDNIGHT + 0.5, aggregation.epoch_seconds(datetime.datetime(2024, 1, 1, 0, 0, 0, 500000)))
+
+
+class AggregatingPersistenceStrategyTests(BaseTestCase):
+
+    def setUp(self):
+        super(AggregatingPersistenceStrategyTests, self).setUp()
+        patcher = patch.object(AggregatingPersistenceStrategy, "_ensure_worker")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.inner = Mock()
+        self.inner.batch_persist.return_value = 1
+        self.strategy = AggregatingPersistenceStrategy(self.inner, {
+            "requests": aggregation.Aggregation(["status"], metrics=["duration"]),
+        })
+        self.client = KeenClient("5004ded1163d66114f000000", write_key="abc", persistence_strategy=self.strategy)
+
+    def test_aggregates_until_flush(self):
+        timestamp = datetime.datetime(2024, 1, 1, 0, 0, 30)
+        for i in range(100):
+            self.client.add_event("requests", {"status": 200, "duration": i}, timestamp=timestamp)
+        self.assert_equal(51, self.client.add_events({"requests": [b'{"status": 500, "duration": 1}'] * 50,
+                                                      "signups": [{"plan": "pro"}]}))
+
+        self.assert_equal({"signups": [{"plan": "pro"}]}, self.inner.batch_persist.call_args[0][0])
+        self.client.flush()
+
+        events = self.inner.batch_persist.call_args[0][0]["requests"]
+        self.assert_equal({"status": 200, "count": 100, "duration": {"sum": 4950, "min": 0, "max": 99},
+                           "keen": {"timestamp": "2024-01-01T00:00:00Z"}}, events[0])
+        self.assert_equal(50, events[1]["count"])
+        self.assert_equal(1, self.inner.flush.call_count)
+        self.assert_equal({"aggregates": 0, "aggregated": 150, "emitted": 2, "evicted": 0, "pending": 0,
+                           "failed": 0}, self.strategy.stats())
+
+    def test_batched_events_are_bucketed_by_their_timestamp(self):
+        self.client.add_events({"requests": [
+            {"status": 200, "duration": 1, "keen": {"timestamp": "2024-01-01T00:00:30.250Z"}},
+            b'{"status": 200, "duration": 2, "keen": {"timestamp": "2024-01-01T01:00:10+01:00"}}',
+        ]})
+        self.client.add_event("requests", {"status": 200, "duration": 3, "keen": {"timestamp": "2024-01-01T00:00:59"}})
+        self.client.flush()
+
+        events = self.inner.batch_persist.call_args[0][0]["requests"]
+        self.assert_equal(1, len(events))
+        self.assert_equal(3, events[0]["count"])
+        self.assert_equal("2024-01-01T00:00:00Z", events[0]["keen"]["timestamp"])
+
+    def test_failed_hand_on_is_retried(self):
+        self.inner.batch_persist.side_effect = [IOError("down"), None]
+        timestamp = datetime.datetime(2024, 1, 1)
+        self.client.add_event("requests", {"status": 200, "duration": 1}, timestamp=timestamp)
+
+        self.client.flush()
+        self.assert_equal({"pending": 1, "failed": 0},
+                          dict((name, self.strategy.stats()[name]) for name in ("pending", "failed")))
+        self.assert_true(isinstance(self.strategy.last_error, IOError))
+        self.client.flush()
+
+        self.assert_equal(1, self.inner.batch_persist.call_args[0][0]["requests"][0]["count"])
+        self.assert_equal(0, self.strategy.stats()["pending"])
+
+    def test_pending_aggregates_are_bounded(self):
+        self.inner.batch_persist.side_effect = IOError("down")
+        self.strategy.aggregator.max_keys = 2
+        for status in range(5):
+            self.client.add_event("requests", {"status": status}, timestamp=datetime.datetime(2024, 1, 1))
+
+        self.client.flush()
+
+        self.assert_equal(2, self.strategy.stats()["pending"])
+        self.assert_equal(3, self.strategy.stats()["failed"])
+
+    def test_direct_strategy_result_is_returned(self):
+        client = KeenClient("5004ded1163d66114f000000", write_key="abc")
+        client.persistence_strategy = AggregatingPersistenceStrategy(
+            DirectPersistenceStrategy(client.api),
+            {"requests": aggregation.Aggregation(["status"])}
+        )
+        response = {"other": [{"success": True}]}
+
+        with patch.object(KeenApi, "post_events", return_value=response) as post_events:
+            self.assert_equal(response, client.add_events({"other": [{"a": 1}]}))
+            self.assert_equal(response, client.add_events({"other": [{"a": 2}], "requests": [{"status": 200}]}))
+            self.assert_equal(1, client.add_events({"requests": [{"status": 500}]}))
+
+        self.assert_equal(2, post_events.call_count)
+
+    def test_other_collections_pass_through(self):
+        self.client.add_event("signups", {"plan": "pro"})
+
+        self.assert_equal("signups", self.inner.persist.call_args[0][0].event_collection)
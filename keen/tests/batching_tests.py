@@ -0,0 +1,143 @@
+import json
+import threading
+import time
+
+from mock import patch
+
+from keen import batching, exceptions
+from keen.client import KeenClient
+from keen.tests.base_test_case import BaseTestCase
+from keen.tests.client_tests import MockedResponse
+
+
+class BatchingTests(BaseTestCase):
+
+    def test_iter_event_pairs(self):
+        def purchases():
+            yield {"price": 1}
+            yield {"price": 2}
+
+        pairs = list(batching.iter_event_pairs({"purchases": purchases()}))
+        self.assert_equal([("purchases", {"price": 1}), ("purchases", {"price": 2})], pairs)
+
+        pairs = [("a", {}), ("b", {})]
+        self.assert_equal(pairs, list(batching.iter_event_pairs(iter(pairs))))
+
+    def test_iter_batches_is_lazy(self):
+        pulled = []
+
+        def pairs():
+            for i in range(5):
+                pulled.append(i)
+                yield "numbers", {"i": i}
+
+        batches = batching.iter_batches(pairs(), batch_size=2)
+        first = next(batches)
+        self.assert_equal({"numbers": [{"i": 0}, {"i": 1}]}, first.events)
+        self.assert_equal(2, len(pulled))
+        self.assert_equal([2, 1], [batch.size for batch in batches])
+
+    def test_uploader_counts_and_bounds_concurrency(self):
+        lock = threading.Lock()
+        state = {"running": 0, "peak": 0}
+
+        def post(events):
+            with lock:
+                state["running"] += 1
+                state["peak"] = max(state["peak"], state["running"])
+            time.sleep(0.01)
+            with lock:
+                state["running"] -= 1
+            if "bad" in events:
+                raise exceptions.KeenApiError({"message": "nope", "error_code": "Error"})
+            return dict((name, [{"success": True}] * len(evs)) for name, evs in events.items())
+
+        batches = [batching.Batch({"good": [{}] * 3}, 3) for _ in range(10)]
+        batches.append(batching.Batch({"bad": [{}] * 2}, 2))
+
+        stats = batching.BatchUploader(post, max_in_flight=3).upload(iter(batches))
+
+        self.assert_true(state["peak"] <= 3)
+        self.assert_equal(11, stats.batches)
+        self.assert_equal(1, stats.failed_batches)
+        self.assert_equal(30, stats.succeeded)
+        self.assert_equal(2, stats.failed)
+        self.assert_true(isinstance(stats.last_error, exceptions.KeenApiError))
+
+
+@patch("requests.Session.post")
+class StreamingClientTests(BaseTestCase):
+
+    def test_add_events_stream(self, post):
+        post.return_value = MockedResponse(status_code=200, json_response={
+            "clicks": [{"success": True}, {"success": False, "error": {}}]
+        })
+        client = KeenClient("5004ded1163d66114f000000", write_key="abc")
+
+        stats = client.add_events_stream((("clicks", {"i": i}) for i in range(4)), batch_size=2)
+
+        self.assert_equal(2, post.call_count)
+        self.assert_equal(2, stats.succeeded)
+        self.assert_equal(2, stats.failed)
+
+
+class AdaptiveBatchingTests(BaseTestCase):
+
+    def test_grows_while_fast(self):
+        adaptive = batching.AdaptiveBatching(batch_size=100, max_batch_size=200, max_in_flight=2, in_flight_limit=3,
+                                             batch_step=50)
+        for _ in range(6):
+            adaptive.record(adaptive.batch_size, 0.1)
+
+        self.assert_equal(200, adaptive.batch_size)
+        self.assert_equal(3, adaptive.max_in_flight)
+        self.assert_true(adaptive.throughput > 0)
+
+    def test_shrinks_on_congestion(self):
+        adaptive = batching.AdaptiveBatching(batch_size=400, min_batch_size=150, max_in_flight=4, target_latency=1.0)
+
+        adaptive.record(400, 0.1, exceptions.KeenApiError({"message": "slow down", "error_code": "x"},
+                                                          status_code=429))
+        self.assert_equal((200, 2), (adaptive.batch_size, adaptive.max_in_flight))
+
+        adaptive.record(200, 5.0)
+        self.assert_equal((150, 1), (adaptive.batch_size, adaptive.max_in_flight))
+        self.assert_equal(2, adaptive.congestion_events)
+
+        # A rejected batch says nothing about the API's capacity.
+        adaptive.record(150, 0.1, exceptions.KeenApiError({"message": "bad", "error_code": "x"}, status_code=400))
+        self.assert_equal((150, 1), (adaptive.batch_size, adaptive.max_in_flight))
+
+    def test_iter_batches_follows_batch_size(self):
+        sizes = iter([2, 3, 1, 1])
+        batches = batching.iter_batches((("a", i) for i in range(6)), batch_size=lambda: next(sizes))
+
+        self.assert_equal([2, 3, 1], [batch.size for batch in batches])
+
+    @patch("requests.Session.post")
+    def test_adaptive_stream(self, post):
+        post.return_value = MockedResponse(status_code=200, json_response={"clicks": []})
+        client = KeenClient("5004ded1163d66114f000000", write_key="abc")
+        adaptive = batching.AdaptiveBatching(batch_size=50, min_batch_size=50, batch_step=50)
+
+        stats = client.add_events_stream({"clicks": ({"i": i} for i in range(300))}, adaptive=adaptive)
+
+        # Batches are cut ahead of the requests, so the exact sizes depend on timing.
+        self.assert_true(stats.batch_size > 50)
+        self.assert_equal(adaptive.batch_size, stats.batch_size)
+        self.assert_equal(adaptive.max_in_flight, stats.max_in_flight)
+        sent = sum(len(json.loads(call[1]["data"])["clicks"]) for call in post.call_args_list)
+        self.assert_equal(300, sent)
+
+    @patch("requests.Session.post")
+    def test_status_code_on_api_errors(self, post):
+        post.return_value = MockedResponse(status_code=429, json_response={"message": "slow", "error_code": "x"})
+        client = KeenClient("5004ded1163d66114f000000", write_key="abc")
+
+        try:
+            client.add_events({"clicks": [{}]})
+        except exceptions.KeenApiError as e:
+            self.assert_equal(429, e.status_code)
+            self.assert_true(batching.is_congestion(e))
+        else:
+            self.fail("KeenApiError not raised")
@@ -0,0 +1,139 @@
+import json
+import threading
+
+from mock import Mock, patch
+
+from keen import exceptions
+from keen.buffer import EventBuffer, OverflowPolicy, group_by_collection
+from keen.client import KeenClient
+from keen.persistence_strategies import BufferedPersistenceStrategy
+from keen.tests.base_test_case import BaseTestCase
+
+
+class ListSpill(object):
+
+    def __init__(self):
+        self.items = []
+
+    def write(self, items):
+        self.items.extend(items)
+
+
+class EventBufferTests(BaseTestCase):
+
+    def test_tracks_bytes_and_depth(self):
+        buffer = EventBuffer()
+        self.assert_true(buffer.put("clicks", b'{"a": 1}'))
+        self.assert_true(buffer.put("views", b"{}"))
+
+        self.assert_equal(2, buffer.depth)
+        self.assert_equal(10, buffer.bytes)
+
+        taken = buffer.take(10, timeout=0)
+        self.assert_equal([("clicks", b'{"a": 1}'), ("views", b"{}")], taken)
+        self.assert_equal(0, buffer.bytes)
+        self.assert_equal({"depth": 0, "bytes": 0, "accepted": 2, "dropped": 0, "spilled": 0}, buffer.stats())
+
+    def test_take_respects_max_bytes(self):
+        buffer = EventBuffer()
+        for _ in range(3):
+            buffer.put("clicks", b"x" * 10)
+
+        self.assert_equal(2, len(buffer.take(10, max_bytes=25, timeout=0)))
+        self.assert_equal(1, len(buffer.take(10, max_bytes=5, timeout=0)))
+        self.assert_equal([], buffer.take(10, timeout=0))
+
+    def test_drop_newest(self):
+        buffer = EventBuffer(max_events=2, overflow_policy=OverflowPolicy.DROP_NEWEST)
+        buffer.put("clicks", b"1")
+        buffer.put("clicks", b"2")
+
+        self.assert_false(buffer.put("clicks", b"3"))
+        self.assert_equal([b"1", b"2"], [data for _, data in buffer.take(10, timeout=0)])
+        self.assert_equal(1, buffer.dropped)
+
+    def test_drop_oldest(self):
+        buffer = EventBuffer(max_bytes=10, overflow_policy=OverflowPolicy.DROP_OLDEST)
+        buffer.put("clicks", b"aaaa")
+        buffer.put("clicks", b"bbbb")
+
+        self.assert_true(buffer.put("clicks", b"cccccc"))
+        self.assert_equal([b"bbbb", b"cccccc"], [data for _, data in buffer.take(10, timeout=0)])
+        self.assert_equal(1, buffer.dropped)
+
+    def test_spill(self):
+        spill = ListSpill()
+        buffer = EventBuffer(max_events=1, overflow_policy=OverflowPolicy.SPILL, spill=spill)
+        buffer.put("clicks", b"1")
+
+        self.assert_false(buffer.put("views", b"2"))
+        self.assert_equal([("views", b"2")], spill.items)
+        self.assert_equal(1, buffer.spilled)
+        self.assert_equal(1, buffer.depth)
+
+    def test_spill_requires_spill(self):
+        self.assert_raises(ValueError, EventBuffer, overflow_policy=OverflowPolicy.SPILL)
+
+    def test_oversized_event_is_dropped(self):
+        buffer = EventBuffer(max_bytes=4)
+
+        self.assert_false(buffer.put("clicks", b"12345"))
+        self.assert_equal(1, buffer.dropped)
+
+    def test_block_times_out(self):
+        buffer = EventBuffer(max_events=1, block_timeout=0.01)
+        buffer.put("clicks", b"1")
+
+        self.assert_raises(exceptions.BufferFullError, buffer.put, "clicks", b"2")
+
+    def test_block_waits_for_room(self):
+        buffer = EventBuffer(max_events=1, block_timeout=5)
+        buffer.put("clicks", b"1")
+        timer = threading.Timer(0.05, buffer.take, args=(1,))
+        timer.start()
+
+        self.assert_true(buffer.put("clicks", b"2"))
+        timer.join()
+        self.assert_equal([("clicks", b"2")], buffer.take(1, timeout=0))
+
+    def test_group_by_collection(self):
+        self.assert_equal({"a": [b"1", b"3"], "b": [b"2"]},
+                          group_by_collection([("a", b"1"), ("b", b"2"), ("a", b"3")]))
+
+
+class BufferedPersistenceStrategyTests(BaseTestCase):
+
+    def setUp(self):
+        super(BufferedPersistenceStrategyTests, self).setUp()
+        patcher = patch.object(BufferedPersistenceStrategy, "_ensure_worker")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_add_event_is_buffered(self):
+        api = Mock()
+        strategy = BufferedPersistenceStrategy(api)
+        client = KeenClient("5004ded1163d66114f000000", write_key="abc", persistence_strategy=strategy)
+
+        client.add_event("clicks", {"a": 1})
+        client.add_events({"views": [{"b": 2}, b'{"c": 3}']})
+
+        self.assert_equal(3, strategy.buffer.depth)
+        self.assert_false(api.post_events.called)
+
+        self.assert_equal(3, strategy._upload_batch())
+        events = api.post_events.call_args[0][0]
+        self.assert_equal([{"a": 1}], [json.loads(e.decode("utf-8")) for e in events["clicks"]])
+        self.assert_equal([b'{"b": 2}', b'{"c": 3}'], events["views"])
+        self.assert_equal(3, strategy.stats()["uploaded"])
+
+    def test_failed_upload_is_retried_then_counted(self):
+        api = Mock()
+        api.post_events.side_effect = exceptions.KeenApiError({"message": "down", "error_code": "x"})
+        strategy = BufferedPersistenceStrategy(api, max_retries=2, retry_backoff=0)
+
+        strategy.batch_persist({"clicks": [{"a": 1}, {"a": 2}]})
+        strategy._upload_batch()
+
+        self.assert_equal(3, api.post_events.call_count)
+        self.assert_equal(2, strategy.failed)
+        self.assert_equal(0, strategy.uploaded)
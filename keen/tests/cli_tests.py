@@ -0,0 +1,141 @@
+import gzip
+import json
+import os
+import shutil
+import tempfile
+
+import six
+from mock import patch
+
+from keen import cli, exceptions
+from keen.tests.base_test_case import BaseTestCase
+
+
+class CheckpointTests(BaseTestCase):
+
+    def setUp(self):
+        super(CheckpointTests, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "checkpoint.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        super(CheckpointTests, self).tearDown()
+
+    def test_advances_over_contiguous_batches_only(self):
+        checkpoint = cli.Checkpoint(self.path)
+
+        checkpoint.acknowledge(1, "a.ndjson", 20, True)
+        self.assert_equal(0, checkpoint.offset("a.ndjson"))
+
+        checkpoint.acknowledge(0, "a.ndjson", 10, True)
+        self.assert_equal(20, checkpoint.offset("a.ndjson"))
+        self.assert_equal(20, cli.Checkpoint(self.path).offset("a.ndjson"))
+
+    def test_failed_batch_stops_advance(self):
+        checkpoint = cli.Checkpoint(self.path)
+
+        checkpoint.acknowledge(0, "a.ndjson", 10, False)
+        checkpoint.acknowledge(1, "a.ndjson", 20, True)
+
+        self.assert_equal(0, checkpoint.offset("a.ndjson"))
+
+    def test_batches_past_a_failed_one_are_remembered(self):
+        checkpoint = cli.Checkpoint(self.path)
+        checkpoint.acknowledge(0, "a.ndjson", 10, False, start=0)
+        checkpoint.acknowledge(2, "a.ndjson", 30, True, start=20)
+        checkpoint.acknowledge(1, "a.ndjson", 20, True, start=10)
+
+        resumed = cli.Checkpoint(self.path)
+        self.assert_equal(0, resumed.offset("a.ndjson"))
+        self.assert_equal([False, True, True], [resumed.acknowledged("a.ndjson", end) for end in (10, 15, 30)])
+
+        resumed.acknowledge(0, "a.ndjson", 10, True, start=0)
+        self.assert_equal(30, resumed.offset("a.ndjson"))
+        self.assert_equal({}, resumed.ranges)
+
+
+@patch("keen.api.KeenApi.post_events")
+class ImportCommandTests(BaseTestCase):
+
+    def setUp(self):
+        super(ImportCommandTests, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.checkpoint = os.path.join(self.directory, "checkpoint.json")
+        lines = "".join(json.dumps({"type": "clicks" if i % 2 else "views", "i": i}) + "\n" for i in range(5))
+        self.plain = os.path.join(self.directory, "events.ndjson")
+        with open(self.plain, "w") as f:
+            f.write(lines + "\n")
+        self.compressed = os.path.join(self.directory, "events.ndjson.gz")
+        with gzip.open(self.compressed, "wb") as f:
+            f.write(lines.encode("utf-8"))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        super(ImportCommandTests, self).tearDown()
+
+    def run_import(self, *extra):
+        argv = ["import", "--project-id", "1234", "--write-key", "abcd", "--progress-interval", "0",
+                "--checkpoint", self.checkpoint] + list(extra)
+        with patch("sys.stderr", six.StringIO()):
+            return cli.main(argv)
+
+    def test_import_routes_by_field_and_resumes(self, post_events):
+        post_events.side_effect = lambda events: dict(
+            (name, [{"success": True}] * len(evs)) for name, evs in events.items())
+
+        code = self.run_import("--collection-field", "type", "--batch-size", "2", self.plain, self.compressed)
+
+        self.assert_equal(0, code)
+        sent = {}
+        for call in post_events.call_args_list:
+            for name, events in call[0][0].items():
+                sent.setdefault(name, []).extend(event["i"] for event in events)
+        self.assert_equal([0, 0, 2, 2, 4, 4], sorted(sent["views"]))
+        self.assert_equal([1, 1, 3, 3], sorted(sent["clicks"]))
+
+        # everything was acknowledged, so a second run has nothing left to send
+        post_events.reset_mock()
+        self.assert_equal(0, self.run_import("--collection", "all", self.plain, self.compressed))
+        self.assert_equal(0, post_events.call_count)
+
+    def test_failed_batch_is_retried_on_resume(self, post_events):
+        post_events.side_effect = exceptions.KeenApiError({"message": "down", "error_code": "Error"})
+
+        code = self.run_import("--collection", "all", "--no-mmap", self.plain)
+
+        self.assert_equal(1, code)
+        self.assert_false(os.path.exists(self.checkpoint))
+
+    def test_resume_only_resends_failed_batches(self, post_events):
+        def post(events):
+            if any(event["i"] == 0 for event in events["all"]):
+                raise exceptions.KeenApiError({"message": "down", "error_code": "Error"})
+            return {"all": [{"success": True}] * len(events["all"])}
+
+        post_events.side_effect = post
+        self.assert_equal(1, self.run_import("--collection", "all", "--batch-size", "2", "--max-in-flight", "1",
+                                             self.plain))
+
+        post_events.reset_mock()
+        post_events.side_effect = lambda events: {"all": [{"success": True}] * len(events["all"])}
+        self.assert_equal(0, self.run_import("--collection", "all", "--batch-size", "2", self.plain))
+
+        sent = [[event["i"] for event in call[0][0]["all"]] for call in post_events.call_args_list]
+        self.assert_equal([[0, 1]], sent)
+
+    def test_non_string_collection_field_is_skipped(self, post_events):
+        post_events.side_effect = lambda events: dict(
+            (name, [{"success": True}] * len(evs)) for name, evs in events.items())
+        path = os.path.join(self.directory, "nested.ndjson")
+        with open(path, "w") as f:
+            f.write('{"type": {"a": 1}}\n{"type": ["x"]}\n{"type": "clicks"}\n')
+
+        stderr = six.StringIO()
+        with patch("sys.stderr", stderr):
+            code = cli.main(["import", "--project-id", "1234", "--write-key", "abcd", "--progress-interval", "0",
+                             "--collection-field", "type", path])
+
+        self.assert_equal(0, code)
+        self.assert_equal({"clicks": [{"type": "clicks"}]}, post_events.call_args[0][0])
+        self.assert_equal(2, stderr.getvalue().count("the collection must be a string"))
@@ -355,6 +355,34 @@ class EventTests(BaseTestCase):
         self.assertEqual(as_json['keen']['addons']['asdf'], 1)
         self.assertTrue('timestamp' in as_json['keen'])
 
+    def test_to_json_does_not_modify_body(self):
+        body = {'keen': {'addons': {'asdf': 1}}, 'a': 'b'}
+        timestamp = datetime.datetime(2020, 1, 2, 3, 4, 5, 6)
+        event = Event('<project_id>', '<event_collection>', body, timestamp=timestamp)
+
+        as_json = json.loads(event.to_json())
+
+        self.assertEqual(timestamp.isoformat(), as_json['keen']['timestamp'])
+        self.assertEqual({'keen': {'addons': {'asdf': 1}}, 'a': 'b'}, body)
+
+    def test_uses_slots(self):
+        event = Event('<project_id>', '<event_collection>', {})
+        self.assertFalse(hasattr(event, '__dict__'))
+
+    def test_formatted_timestamp(self):
+        event = Event('<project_id>', '<event_collection>', {})
+        self.assertEqual(None, event.formatted_timestamp)
+
+        timestamps = [datetime.datetime(2020, 1, 2, 3, 4, 5), datetime.datetime(2020, 1, 2, 3, 4, 5, 6)]
+        if hasattr(datetime, 'timezone'):
+            timestamps.extend(timestamp.replace(tzinfo=datetime.timezone.utc) for timestamp in list(timestamps))
+            timestamps.append(datetime.datetime(2020, 1, 2, 3, 4, 5,
+                                                tzinfo=datetime.timezone(datetime.timedelta(hours=2))))
+        for timestamp in timestamps:
+            # setting the timestamp again must not return the previous, cached string
+            event.timestamp = timestamp
+            self.assertEqual(timestamp.isoformat(), event.formatted_timestamp)
+
 
 @patch("requests.Session.get")
 class QueryTests(BaseTestCase):
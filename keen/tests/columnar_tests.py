@@ -0,0 +1,99 @@
+import datetime
+import json
+import unittest
+
+from mock import patch
+
+from keen import columnar
+from keen.client import KeenClient
+from keen.tests.base_test_case import BaseTestCase
+from keen.tests.client_tests import MockedResponse
+
+try:
+    import numpy
+    import pandas
+except ImportError:
+    numpy = pandas = None
+
+
+class ColumnarEncodingTests(BaseTestCase):
+
+    def test_iter_rows_nests_dotted_names(self):
+        rows = list(columnar.iter_rows({
+            "price": [5, 6.5],
+            "user.id": ["a", "b"],
+            "user.plan": ["free", None],
+        }))
+
+        self.assert_equal([
+            {"price": 5, "user": {"id": "a", "plan": "free"}},
+            {"price": 6.5, "user": {"id": "b", "plan": None}},
+        ], [json.loads(row) for row in rows])
+
+    def test_non_finite_and_dates(self):
+        timestamp = datetime.datetime(2020, 1, 2, 3, 4, 5)
+        row = next(columnar.iter_rows({"value": [float("nan")], "keen.timestamp": [timestamp]}))
+
+        self.assert_equal({"value": None, "keen": {"timestamp": timestamp.isoformat()}}, json.loads(row))
+
+    @unittest.skipIf(pandas is None, "pandas is not installed")
+    def test_datetime64_columns(self):
+        timestamps = numpy.array(["2020-01-01T00:00:00", "NaT"], dtype="datetime64[ns]")
+
+        rows = [json.loads(row) for row in columnar.iter_rows({
+            "keen.timestamp": timestamps,
+            "series": pandas.Series(timestamps),
+            "objects": [timestamps[0], timestamps[1]],
+        })]
+
+        self.assert_equal({"keen": {"timestamp": "2020-01-01T00:00:00"}, "series": "2020-01-01T00:00:00",
+                           "objects": "2020-01-01T00:00:00"}, rows[0])
+        self.assert_equal({"keen": {"timestamp": None}, "series": None, "objects": None}, rows[1])
+
+    @unittest.skipIf(pandas is None, "pandas is not installed")
+    def test_nullable_pandas_dtypes(self):
+        frame = pandas.DataFrame({
+            "count": pandas.Series([1, None], dtype="Int64"),
+            "flag": pandas.Series([True, None], dtype="boolean"),
+            "name": pandas.Series(["a", None], dtype="string"),
+        })
+
+        rows = [json.loads(row) for row in columnar.iter_rows(columnar.dataframe_columns(frame))]
+
+        self.assert_equal([{"count": 1, "flag": True, "name": "a"}, {"count": None, "flag": None, "name": None}],
+                          rows)
+
+    def test_invalid_columns(self):
+        self.assert_raises(ValueError, list, columnar.iter_rows({"a": [1], "b": [1, 2]}))
+        self.assert_raises(ValueError, list, columnar.iter_rows({"a": [1], "a.b": [1]}))
+
+    def test_iter_payloads_batches(self):
+        payloads = list(columnar.iter_payloads("purchases", {"price": list(range(5))}, batch_size=2))
+
+        self.assert_equal(3, len(payloads))
+        self.assert_equal({"purchases": [{"price": 4}]}, json.loads(payloads[-1]))
+
+    def test_escapes_percent_in_names(self):
+        row = next(columnar.iter_rows({"100%": [1]}))
+        self.assert_equal({"100%": 1}, json.loads(row))
+
+    def test_fragment_is_written_into_every_row(self):
+        template, _ = columnar.row_template(["a.b"], fragment='"host":"web-1"')
+
+        self.assert_equal('{"host":"web-1","a":{"b":%s}}', template)
+        self.assert_equal(['{"x":"5%","a":1}', '{"x":"5%","a":2}'],
+                          list(columnar.iter_rows({"a": [1, 2]}, fragment='"x":"5%"')))
+
+
+@patch("requests.Session.post")
+class ColumnarClientTests(BaseTestCase):
+
+    def test_add_events_columnar(self, post):
+        post.return_value = MockedResponse(status_code=200, json_response={"purchases": [{"success": True}] * 2})
+        client = KeenClient("5004ded1163d66114f000000", write_key="abc")
+
+        response = client.add_events_columnar("purchases", {"price": [1, 2, 3, 4]}, batch_size=2)
+
+        self.assert_equal(2, post.call_count)
+        self.assert_equal({"purchases": [{"price": 3}, {"price": 4}]}, json.loads(post.call_args[1]["data"]))
+        self.assert_equal(4, len(response["purchases"]))
@@ -0,0 +1,82 @@
+import gzip
+import io
+import json
+
+from mock import patch
+
+from keen import compression
+from keen.api import KeenApi
+from keen.client import KeenClient
+from keen.tests.base_test_case import BaseTestCase
+from keen.tests.client_tests import MockedResponse
+
+
+class CompressionTests(BaseTestCase):
+
+    def test_encode_body_threshold(self):
+        stats = compression.CompressionStats()
+
+        body, encoding = compression.encode_body(u"{}", compression.GZIP, 10, stats)
+        self.assert_equal(b"{}", body)
+        self.assert_equal(None, encoding)
+
+        payload = json.dumps([{"a_long_property_name": i} for i in range(100)])
+        body, encoding = compression.encode_body(payload, compression.GZIP, 10, stats)
+        self.assert_equal(compression.GZIP, encoding)
+        self.assert_equal(payload.encode("utf-8"), gzip.GzipFile(fileobj=io.BytesIO(body)).read())
+
+        self.assert_equal(1, stats.compressed_requests)
+        self.assert_equal(1, stats.uncompressed_requests)
+        self.assert_equal(len(payload) + 2, stats.raw_bytes)
+        self.assert_true(stats.ratio > 1)
+
+    def test_validate_compression(self):
+        compression.validate_compression(None)
+        compression.validate_compression(compression.GZIP)
+        self.assert_raises(ValueError, compression.validate_compression, "brotli")
+
+
+@patch("requests.Session.post")
+class CompressedUploadTests(BaseTestCase):
+
+    def test_post_events_compressed(self, post):
+        post.return_value = MockedResponse(status_code=200, json_response={"clicks": [{"success": True}]})
+        client = KeenClient("5004ded1163d66114f000000", write_key="abc", compression="gzip",
+                            compression_threshold=0)
+
+        client.add_events({"clicks": [{"hello": "goodbye"}]})
+
+        kwargs = post.call_args[1]
+        self.assert_equal("gzip", kwargs["headers"]["Content-Encoding"])
+        self.assert_equal({"clicks": [{"hello": "goodbye"}]},
+                          json.loads(gzip.GzipFile(fileobj=io.BytesIO(kwargs["data"])).read().decode("utf-8")))
+        self.assert_equal(1, client.api.compression_stats.compressed_requests)
+
+    def test_post_event_below_threshold(self, post):
+        post.return_value = MockedResponse(status_code=201, json_response={"created": True})
+        client = KeenClient("5004ded1163d66114f000000", write_key="abc", compression="gzip")
+
+        client.add_event("clicks", {"hello": "goodbye"})
+
+        self.assert_false("Content-Encoding" in post.call_args[1]["headers"])
+
+    def test_api_class_without_compression_options(self, post):
+        created = []
+
+        # A subclass written before the compression options existed.
+        class LegacyApi(KeenApi):
+            def __init__(self, project_id, write_key=None, read_key=None, base_url=None, get_timeout=None,
+                         post_timeout=None, master_key=None):
+                super(LegacyApi, self).__init__(project_id, write_key=write_key, read_key=read_key,
+                                                base_url=base_url, get_timeout=get_timeout,
+                                                post_timeout=post_timeout, master_key=master_key)
+                created.append(project_id)
+
+        client = KeenClient("5004ded1163d66114f000000", write_key="abc", api_class=LegacyApi)
+        compressed = KeenClient("5004ded1163d66114f000000", write_key="abc", api_class=LegacyApi,
+                                compression="gzip")
+
+        self.assert_equal(2, len(created))
+        self.assert_equal(None, client.api.compression)
+        self.assert_equal("gzip", compressed.api.compression)
+        self.assert_raises(ValueError, KeenClient, "5004ded1163d66114f000000", compression="brotli")
@@ -0,0 +1,99 @@
+import os
+import threading
+import time
+
+from mock import Mock, patch
+
+import keen
+from keen import forking
+from keen.tests.base_test_case import BaseTestCase
+
+
+class ConfigureTests(BaseTestCase):
+
+    def setUp(self):
+        super(ConfigureTests, self).setUp()
+        keen.reset()
+        self.addCleanup(keen.reset)
+        patcher = patch("keen.KeenClient", side_effect=lambda *args, **kwargs: Mock(args=args, kwargs=kwargs))
+        self.client_class = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_configure_creates_the_client_on_first_use(self):
+        keen.configure("5004ded1163d66114f000000", write_key="abc", get_timeout=60)
+        self.assert_false(self.client_class.called)
+
+        keen.add_event("clicks", {"a": 1})
+        keen.add_event("clicks", {"a": 2})
+
+        self.assert_equal(1, self.client_class.call_count)
+        self.assert_equal(("5004ded1163d66114f000000",), keen._client.args)
+        self.assert_equal(60, keen._client.kwargs["get_timeout"])
+        self.assert_equal(2, keen._client.add_event.call_count)
+
+    def test_configure_and_reset_close_the_client(self):
+        keen.configure("5004ded1163d66114f000000", write_key="abc")
+        first = keen._get_client()
+
+        keen.configure("5004ded1163d66114f000001", write_key="abc")
+        second = keen._get_client()
+        keen.reset()
+
+        self.assert_true(first.close.called)
+        self.assert_true(second.close.called)
+        self.assert_equal(("5004ded1163d66114f000001",), second.args)
+        self.assert_equal(None, keen.project_id)
+        self.assert_equal(None, keen._client)
+
+    def test_concurrent_first_calls_create_one_client(self):
+        def slow_client(*args, **kwargs):
+            time.sleep(0.01)
+            return Mock()
+        self.client_class.side_effect = slow_client
+        keen.configure("5004ded1163d66114f000000", write_key="abc")
+
+        threads = [threading.Thread(target=keen.add_event, args=("clicks", {"a": i})) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assert_equal(1, self.client_class.call_count)
+        self.assert_equal(8, keen._client.add_event.call_count)
+
+    def test_per_thread_clients(self):
+        keen.configure("5004ded1163d66114f000000", write_key="abc", per_thread=True)
+        clients = []
+
+        def get_client():
+            clients.append(keen._get_client())
+        thread = threading.Thread(target=get_client)
+        thread.start()
+        thread.join()
+        get_client()
+        get_client()
+
+        self.assert_false(clients[0] is clients[1])
+        self.assert_true(clients[1] is clients[2])
+        self.assert_equal(None, keen._client)
+        keen.reset()
+        self.assert_true(clients[1].close.called)
+
+    def test_fork_reads_the_environment_again(self):
+        with patch.dict(os.environ, {"KEEN_PROJECT_ID": "5004ded1163d66114f000000", "KEEN_WRITE_KEY": "abc"}):
+            client = keen._get_client()
+            self.assert_equal("5004ded1163d66114f000000", keen.project_id)
+            os.environ["KEEN_PROJECT_ID"] = "5004ded1163d66114f000001"
+
+            forking._after_fork()
+
+            self.assert_false(keen._get_client() is client)
+            self.assert_equal("5004ded1163d66114f000001", keen.project_id)
+
+    def test_fork_keeps_a_client_configured_in_code(self):
+        keen.configure("5004ded1163d66114f000000", write_key="abc", read_key="def")
+        client = keen._get_client()
+
+        forking._after_fork()
+
+        self.assert_true(keen._get_client() is client)
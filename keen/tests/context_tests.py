@@ -0,0 +1,94 @@
+import datetime
+import json
+import unittest
+
+from mock import patch
+
+from keen.client import Event, KeenClient
+from keen.context import ContextClient, EventContext
+from keen.tests.base_test_case import BaseTestCase
+from keen.tests.client_tests import MockedResponse
+
+try:
+    import pandas
+except ImportError:
+    pandas = None
+
+
+class EventContextTests(BaseTestCase):
+
+    def test_encode_splices_fragment(self):
+        context = EventContext({"host": "web-1", "build": 12})
+
+        self.assert_equal({"host": "web-1", "build": 12, "a": 1}, json.loads(context.encode({"a": 1})))
+        self.assert_equal({"host": "web-1", "build": 12}, json.loads(context.encode({})))
+
+    def test_event_properties_win(self):
+        context = EventContext({"host": "web-1", "build": 12})
+
+        self.assert_equal({"host": "web-2", "build": 12}, json.loads(context.encode({"host": "web-2"})))
+
+    def test_merged(self):
+        context = EventContext({"host": "web-1"}).merged({"region": "eu", "host": "web-2"})
+
+        self.assert_equal({"host": "web-2", "region": "eu"}, context.properties)
+
+    def test_event_with_context_and_timestamp(self):
+        timestamp = datetime.datetime(2020, 1, 2)
+        event = Event("project", "clicks", {"a": 1}, timestamp=timestamp, context=EventContext({"host": "web-1"}))
+
+        self.assert_equal({"host": "web-1", "a": 1, "keen": {"timestamp": timestamp.isoformat()}},
+                          json.loads(event.to_json()))
+
+
+@patch("requests.Session.post")
+class ContextClientTests(BaseTestCase):
+
+    def setUp(self):
+        super(ContextClientTests, self).setUp()
+        self.client = KeenClient("5004ded1163d66114f000000", write_key="abc").with_context({"host": "web-1"})
+
+    def test_with_context(self, post):
+        self.assert_true(isinstance(self.client, ContextClient))
+        self.assert_equal("5004ded1163d66114f000000", self.client.project_id)
+
+    def test_add_event(self, post):
+        post.return_value = MockedResponse(status_code=201, json_response={"created": True})
+
+        self.client.with_context({"region": "eu"}).add_event("clicks", {"a": 1})
+
+        self.assert_equal({"host": "web-1", "region": "eu", "a": 1}, json.loads(post.call_args[1]["data"]))
+
+    def test_add_events(self, post):
+        post.return_value = MockedResponse(status_code=200, json_response={"clicks": [{"success": True}] * 2})
+
+        self.client.add_events({"clicks": [{"a": 1}, {"a": 2}]})
+
+        self.assert_equal({"clicks": [{"host": "web-1", "a": 1}, {"host": "web-1", "a": 2}]},
+                          json.loads(post.call_args[1]["data"]))
+
+    def test_add_events_columnar(self, post):
+        post.return_value = MockedResponse(status_code=200, json_response={"clicks": [{"success": True}] * 2})
+
+        self.client.with_context({"user": {"plan": "pro"}, "note": "100%"}).add_events_columnar(
+            "clicks", {"a": [1, 2], "user.id": [3, 4]})
+
+        self.assert_equal({"clicks": [{"host": "web-1", "note": "100%", "a": 1, "user": {"id": 3}},
+                                      {"host": "web-1", "note": "100%", "a": 2, "user": {"id": 4}}]},
+                          json.loads(post.call_args[1]["data"]))
+
+    @unittest.skipIf(pandas is None, "pandas is not installed")
+    def test_add_dataframe(self, post):
+        post.return_value = MockedResponse(status_code=200, json_response={"clicks": [{"success": True}]})
+
+        self.client.add_dataframe("clicks", pandas.DataFrame({"a": [1]}))
+
+        self.assert_equal({"clicks": [{"host": "web-1", "a": 1}]}, json.loads(post.call_args[1]["data"]))
+
+    def test_add_events_chunked(self, post):
+        post.return_value = MockedResponse(status_code=200, json_response={"clicks": [{"success": True}] * 2})
+
+        self.client.add_events_chunked({"clicks": iter([{"a": 1}, b'{"a": 2}'])})
+
+        body = b"".join(post.call_args[1]["data"])
+        self.assert_equal({"clicks": [{"host": "web-1", "a": 1}, {"host": "web-1", "a": 2}]}, json.loads(body))
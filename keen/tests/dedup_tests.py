@@ -0,0 +1,138 @@
+import json
+import os
+import shutil
+import tempfile
+
+from mock import Mock, patch
+
+from keen import dedup
+from keen.api import KeenApi
+from keen.client import KeenClient
+from keen.tests.base_test_case import BaseTestCase
+
+
+class BloomFilterTests(BaseTestCase):
+
+    def test_no_false_negatives_and_bounded_false_positives(self):
+        bloom = dedup.BloomFilter(1000, 0.01)
+        for i in range(1000):
+            bloom.add("id-{0}".format(i))
+
+        self.assert_true(all("id-{0}".format(i) in bloom for i in range(1000)))
+        false_positives = len([i for i in range(10000) if "other-{0}".format(i) in bloom])
+        self.assert_true(false_positives < 300)
+        self.assert_equal(1199, len(bloom.bits))
+
+
+class DeduplicatorTests(BaseTestCase):
+
+    def setUp(self):
+        super(DeduplicatorTests, self).setUp()
+        self.deduplicator = dedup.Deduplicator(capacity=1000, error_rate=0.001, window=60)
+
+    def test_assign(self):
+        event = {"a": 1, "keen": {"timestamp": "2024-01-01T00:00:00Z"}}
+        assigned = self.deduplicator.assign(event)
+
+        self.assert_equal(32, len(assigned["keen"]["id"]))
+        self.assert_equal("2024-01-01T00:00:00Z", assigned["keen"]["timestamp"])
+        self.assert_true("id" not in event["keen"])
+        self.assert_true(self.deduplicator.assign(assigned) is assigned)
+
+        serialized = self.deduplicator.assign(b'{"a": 1}')
+        self.assert_equal(1, json.loads(serialized)["a"])
+        self.assert_equal(json.loads(serialized)["keen"]["id"], self.deduplicator.event_id(serialized))
+        self.assert_equal(32, len(json.loads(self.deduplicator.assign(u'{"keen": {}}'))["keen"]["id"]))
+        self.assert_equal(b'{"keen": {"id": "x"}}', self.deduplicator.assign(b'{"keen": {"id": "x"}}'))
+
+    def test_filter(self):
+        self.deduplicator.acknowledge(["a"])
+
+        remaining, ids = self.deduplicator.filter({"clicks": [{"keen": {"id": "a"}}, b'{"keen": {"id": "b"}}', {}]})
+
+        self.assert_equal({"clicks": [b'{"keen": {"id": "b"}}', {}]}, remaining)
+        self.assert_equal({"clicks": ["b", None]}, ids)
+        self.assert_equal(1, self.deduplicator.suppressed)
+
+    def test_window(self):
+        with patch("keen.dedup.time.time", return_value=1000.0):
+            deduplicator = dedup.Deduplicator(capacity=100, window=60)
+            deduplicator.acknowledge(["a"])
+        with patch("keen.dedup.time.time", return_value=1070.0):
+            self.assert_true(deduplicator.seen("a"))
+        with patch("keen.dedup.time.time", return_value=1140.0):
+            self.assert_false(deduplicator.seen("a"))
+
+    def test_save_and_load(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, "dedup")
+        deduplicator = dedup.Deduplicator(capacity=1000, path=path)
+        deduplicator.acknowledge(["a", "b"])
+        deduplicator.save()
+
+        restarted = dedup.Deduplicator(capacity=1000, path=path)
+
+        self.assert_true(restarted.seen("a"))
+        self.assert_false(restarted.seen("c"))
+        # Saved with other sizes, the filters start over.
+        self.assert_false(dedup.Deduplicator(capacity=10, path=path).seen("a"))
+
+
+class DeduplicatedUploadTests(BaseTestCase):
+
+    def setUp(self):
+        super(DeduplicatedUploadTests, self).setUp()
+        self.deduplicator = dedup.Deduplicator(capacity=1000)
+        self.client = KeenClient("5004ded1163d66114f000000", write_key="abc", deduplicator=self.deduplicator)
+
+    def test_retried_events_are_sent_once(self):
+        with patch.object(KeenApi, "_post_events", return_value={"clicks": [{"success": True}, {"success": False}]}) \
+                as post:
+            self.client.add_events({"clicks": [{"a": 1}, {"a": 2}]})
+            sent = post.call_args[0][0]["clicks"]
+            self.assert_true(all("id" in event["keen"] for event in sent))
+
+            post.return_value = {"clicks": [{"success": True}]}
+            # A retry of the same batch only resends the rejected event.
+            self.client.api.post_events({"clicks": sent})
+
+        self.assert_equal([sent[1]], post.call_args[0][0]["clicks"])
+        self.assert_equal(1, self.deduplicator.suppressed)
+
+        with patch.object(KeenApi, "_post_events") as post:
+            self.assert_equal({"clicks": []}, self.client.api.post_events({"clicks": sent}))
+        self.assert_false(post.called)
+
+    def test_streamed_events(self):
+        sent = []
+
+        def fulfill(method, url, data=None, **kwargs):
+            sent.append(json.loads(b"".join(data).decode("utf-8"))["clicks"])
+            return Mock(status_code=200, json=Mock(return_value={"clicks": [{"success": True}] * len(sent[-1])}))
+
+        with patch.object(KeenApi, "fulfill", side_effect=fulfill):
+            self.client.add_events_chunked({"clicks": iter([{"a": 1}, {"a": 2}])})
+            self.client.add_events_chunked({"clicks": iter(sent[0] + [{"a": 3}])})
+
+        self.assert_true(all("id" in event["keen"] for event in sent[0]))
+        self.assert_equal([3], [event["a"] for event in sent[1]])
+        self.assert_equal(3, self.deduplicator.acknowledged)
+
+    def test_columnar_events(self):
+        with patch.object(KeenApi, "post_events_payload", return_value={"clicks": [{"success": True}]}) as post:
+            self.client.add_events_columnar("clicks", {"keen.id": ["x", "y"], "a": [1, 2]}, batch_size=1)
+            self.assert_equal(2, post.call_count)
+            self.client.add_events_columnar("clicks", {"keen.id": ["x", "z"], "a": [1, 3]})
+
+        self.assert_equal([{"keen": {"id": "z"}, "a": 3}], json.loads(post.call_args[0][0])["clicks"])
+        self.assert_equal(1, self.deduplicator.suppressed)
+
+    def test_single_events(self):
+        with patch.object(KeenApi, "fulfill", return_value=Mock(status_code=201)) as fulfill:
+            self.client.add_event("clicks", {"a": 1})
+            payload = json.loads(fulfill.call_args[1]["data"])
+            self.client.api.post_events({"clicks": [payload]})
+
+        self.assert_equal(1, fulfill.call_count)
+        self.assert_equal(1, self.deduplicator.acknowledged)
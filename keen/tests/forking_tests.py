@@ -0,0 +1,76 @@
+import os
+
+from mock import Mock, patch
+
+from keen import forking
+from keen.api import KeenApi
+from keen.batching import AdaptiveBatching
+from keen.dedup import Deduplicator
+from keen.sampling import TokenBucketSampler
+from keen.persistence_strategies import BufferedPersistenceStrategy
+from keen.tests.base_test_case import BaseTestCase
+
+
+class ForkingTests(BaseTestCase):
+
+    def simulate_fork(self):
+        child_pid = os.getpid() + 1
+        with patch("os.getpid", return_value=child_pid):
+            forking.check()
+        # Let the next check in this (real) process see the real PID again.
+        self.addCleanup(forking._after_fork)
+
+    def test_check_is_a_no_op_in_the_same_process(self):
+        api = KeenApi("5004ded1163d66114f000000", write_key="abc")
+        session = api.session
+
+        forking.check()
+
+        self.assert_true(api.session is session)
+
+    def test_api_rebuilds_its_session(self):
+        api = KeenApi("5004ded1163d66114f000000", write_key="abc")
+        session = api.session
+
+        self.simulate_fork()
+
+        self.assert_false(api.session is session)
+
+    def test_buffered_strategy_starts_empty(self):
+        strategy = BufferedPersistenceStrategy(Mock())
+        strategy.buffer.put("clicks", b"{}")
+        strategy._worker = Mock()
+        strategy.uploaded = 5
+
+        self.simulate_fork()
+
+        self.assert_equal(0, strategy.buffer.depth)
+        self.assert_equal(0, strategy.buffer.bytes)
+        self.assert_equal(None, strategy._worker)
+        self.assert_equal(0, strategy.uploaded)
+
+    def test_held_locks_are_replaced(self):
+        api = KeenApi("5004ded1163d66114f000000", write_key="abc")
+        holders = [Deduplicator(capacity=10), api.compression_stats, AdaptiveBatching(), TokenBucketSampler(10)]
+        for holder in holders:
+            # As if an upload thread of the parent held it at the fork.
+            holder._lock.acquire()
+
+        self.simulate_fork()
+
+        for holder in holders:
+            self.assert_false(holder._lock.locked())
+
+    def test_real_fork(self):
+        if not hasattr(os, "fork"):
+            return
+        api = KeenApi("5004ded1163d66114f000000", write_key="abc")
+        parent_session = id(api.session)
+
+        pid = os.fork()
+        if pid == 0:
+            forking.check()
+            os._exit(0 if id(api.session) != parent_session else 1)
+
+        _, status = os.waitpid(pid, 0)
+        self.assert_equal(0, status)
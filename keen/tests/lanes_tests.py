@@ -0,0 +1,106 @@
+from mock import Mock, patch
+
+from keen import lanes
+from keen.buffer import OverflowPolicy
+from keen.client import KeenClient
+from keen.persistence_strategies import BufferedPersistenceStrategy, LanedPersistenceStrategy
+from keen.tests.base_test_case import BaseTestCase
+
+
+def open_lanes(*all_lanes):
+    for lane in all_lanes:
+        lane.open()
+    return all_lanes
+
+
+class LaneSchedulerTests(BaseTestCase):
+
+    def test_routes_by_collection(self):
+        billing, default = open_lanes(lanes.Lane("billing", ["payments", "refunds"]), lanes.Lane("default"))
+        scheduler = lanes.LaneScheduler([billing, default], "default")
+
+        scheduler.put("payments", b"{}")
+        scheduler.put("clicks", b"{}")
+
+        self.assert_equal(1, billing.buffer.depth)
+        self.assert_equal(1, default.buffer.depth)
+        self.assert_equal(2, scheduler.stats()["depth"])
+        self.assert_equal(1, scheduler.stats()["lanes"]["billing"]["accepted"])
+
+    def test_invalid_lanes(self):
+        self.assert_raises(ValueError, lanes.Lane, "billing", weight=0)
+        self.assert_raises(ValueError, lanes.LaneScheduler, open_lanes(lanes.Lane("a")), "b")
+        self.assert_raises(ValueError, lanes.LaneScheduler, open_lanes(lanes.Lane("a", ["x"]), lanes.Lane("b", ["x"])), "a")
+
+    def test_weighted_fairness(self):
+        high, low = open_lanes(lanes.Lane("high", ["h"], weight=3, batch_size=1),
+                               lanes.Lane("low", ["l"], weight=1, batch_size=1))
+        scheduler = lanes.LaneScheduler([high, low], "low")
+        for _ in range(20):
+            scheduler.put("h", b"{}")
+            scheduler.put("l", b"{}")
+
+        taken = [scheduler.take(1024, timeout=0)[0][0] for _ in range(8)]
+
+        self.assert_equal(6, taken.count("h"))
+        self.assert_equal(2, taken.count("l"))
+        # Smooth round-robin spreads the low lane's turns out.
+        self.assert_not_equal(["h", "h", "h", "h", "h", "h"], taken[:6])
+
+    def test_flush_cadence(self):
+        fast, slow = open_lanes(lanes.Lane("fast", ["f"], batch_size=10, flush_interval=0),
+                                lanes.Lane("slow", ["s"], batch_size=10, flush_interval=60))
+        scheduler = lanes.LaneScheduler([fast, slow], "slow")
+        scheduler.put("f", b"{}")
+        scheduler.put("s", b"{}")
+
+        self.assert_equal([("f", b"{}")], scheduler.take(1024, timeout=0))
+        # The slow lane holds less than a batch and isn't due yet.
+        self.assert_equal([], scheduler.take(1024, timeout=0.01))
+        self.assert_equal([("s", b"{}")], scheduler.take(1024, timeout=0, flushing=True))
+
+    def test_full_batch_is_ready(self):
+        slow, = open_lanes(lanes.Lane("slow", batch_size=2, flush_interval=60))
+        scheduler = lanes.LaneScheduler([slow], "slow")
+        scheduler.put("s", b"1")
+        scheduler.put("s", b"2")
+        scheduler.put("s", b"3")
+
+        self.assert_equal([("s", b"1"), ("s", b"2")], scheduler.take(1024, timeout=0))
+
+
+class LanedPersistenceStrategyTests(BaseTestCase):
+
+    def setUp(self):
+        super(LanedPersistenceStrategyTests, self).setUp()
+        patcher = patch.object(BufferedPersistenceStrategy, "_ensure_worker")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.api = Mock()
+
+    def test_lane_overflow_policies(self):
+        strategy = LanedPersistenceStrategy(self.api, [
+            lanes.Lane("billing", ["payments"], weight=4, max_events=10),
+            lanes.Lane("clickstream", max_events=2, overflow_policy=OverflowPolicy.DROP_NEWEST),
+        ])
+        client = KeenClient("5004ded1163d66114f000000", write_key="abc", persistence_strategy=strategy)
+
+        self.assert_equal(2, client.add_events({"clicks": [{"a": i} for i in range(5)]}))
+        self.assert_equal(3, client.add_events({"payments": [{"b": i} for i in range(3)]}))
+
+        stats = strategy.stats()
+        self.assert_equal(3, stats["dropped"])
+        self.assert_equal(3, stats["lanes"]["clickstream"]["dropped"])
+        self.assert_equal(0, stats["lanes"]["billing"]["dropped"])
+        self.assert_true(strategy.lanes["billing"] is strategy.scheduler.routes["payments"])
+
+        report = client.flush()
+
+        self.assert_equal(5, report.flushed)
+        uploaded = [call[0][0] for call in self.api.post_events.call_args_list]
+        self.assert_equal(3, sum(len(events.get("payments", [])) for events in uploaded))
+        self.assert_equal(0, strategy.stats()["depth"])
+
+    def test_buffer_argument_is_rejected(self):
+        self.assert_raises(TypeError, LanedPersistenceStrategy, self.api, [lanes.Lane("default")], buffer=Mock())
+        self.assert_raises(ValueError, LanedPersistenceStrategy, self.api, [])
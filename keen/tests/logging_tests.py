@@ -0,0 +1,110 @@
+import logging
+
+from mock import Mock, patch
+
+from keen.logging import KeenHandler
+from keen.tests.base_test_case import BaseTestCase
+
+
+class KeenHandlerTests(BaseTestCase):
+
+    def setUp(self):
+        super(KeenHandlerTests, self).setUp()
+        patcher = patch.object(KeenHandler, "_ensure_thread")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = Mock()
+        self.logger = logging.getLogger("keen.tests.logging")
+        self.logger.propagate = False
+        self.logger.setLevel(logging.DEBUG)
+
+    def add_handler(self, **kwargs):
+        handler = KeenHandler(self.client, "logs", **kwargs)
+        self.logger.addHandler(handler)
+        self.addCleanup(self.logger.removeHandler, handler)
+        return handler
+
+    def test_records_are_shipped_as_events(self):
+        handler = self.add_handler()
+
+        self.logger.warning("disk %d%% full", 93, extra={"host": "web-1", "tags": {"a", "b"}})
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            self.logger.exception("failed")
+        self.assert_false(self.client.api.post_events.called)
+        handler.flush()
+
+        events = self.client.api.post_events.call_args[0][0]["logs"]
+        self.assert_equal("disk 93% full", events[0]["message"])
+        self.assert_equal("WARNING", events[0]["level"])
+        self.assert_equal("keen.tests.logging", events[0]["logger"])
+        self.assert_equal("web-1", events[0]["extra"]["host"])
+        self.assert_true(events[0]["extra"]["tags"].startswith("{"))
+        self.assert_true(events[0]["keen"]["timestamp"].endswith("Z"))
+        self.assert_true("ValueError: boom" in events[1]["exception"])
+        self.assert_equal(2, handler.shipped)
+
+    def test_overflow_drops_new_records(self):
+        handler = self.add_handler(max_queue=2)
+
+        for i in range(5):
+            self.logger.info("event %d", i)
+        handler.flush()
+
+        self.assert_equal(3, handler.dropped)
+        self.assert_equal(["event 0", "event 1"],
+                          [e["message"] for e in self.client.api.post_events.call_args[0][0]["logs"]])
+
+    def test_level_sampling(self):
+        handler = self.add_handler(sample_rates={logging.DEBUG: 0.25})
+
+        with patch("keen.logging.random.random", side_effect=[0.1, 0.5, 0.2, 0.9]):
+            for _ in range(4):
+                self.logger.debug("noise")
+        self.logger.error("kept")
+        handler.flush()
+
+        events = self.client.api.post_events.call_args[0][0]["logs"]
+        self.assert_equal(["noise", "noise", "kept"], [e["message"] for e in events])
+        self.assert_equal(4.0, events[0]["sample_weight"])
+        self.assert_true("sample_weight" not in events[2])
+
+    def test_batches_and_failures(self):
+        handler = self.add_handler(batch_size=2)
+        self.client.api.post_events.side_effect = [None, IOError("down")]
+
+        for i in range(3):
+            self.logger.info("event %d", i)
+        handler.flush()
+
+        self.assert_equal(2, self.client.api.post_events.call_count)
+        self.assert_equal(2, handler.shipped)
+        self.assert_equal(1, handler.failed)
+
+    def test_records_logged_while_shipping_are_ignored(self):
+        handler = self.add_handler()
+        self.client.api.post_events.side_effect = lambda events: self.logger.info("posting")
+
+        self.logger.info("event")
+        handler.flush()
+
+        self.assert_equal(1, self.client.api.post_events.call_count)
+        self.assert_equal(0, len(handler._queue))
+
+
+class KeenHandlerThreadTests(BaseTestCase):
+
+    def test_background_thread_ships(self):
+        client = Mock()
+        handler = KeenHandler(client, "logs", flush_interval=0.01)
+        logger = logging.getLogger("keen.tests.logging.thread")
+        logger.propagate = False
+        logger.addHandler(handler)
+        self.addCleanup(logger.removeHandler, handler)
+
+        logger.warning("hello")
+        handler.close()
+
+        self.assert_equal("hello", client.api.post_events.call_args[0][0]["logs"][0]["message"])
+        self.assert_false(handler._thread.is_alive())
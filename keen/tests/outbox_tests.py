@@ -0,0 +1,160 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+
+from mock import Mock, patch
+
+from keen import outbox
+from keen.client import KeenClient
+from keen.persistence_strategies import OutboxPersistenceStrategy
+from keen.tests.base_test_case import BaseTestCase
+
+
+class OutboxTestCase(BaseTestCase):
+
+    def setUp(self):
+        super(OutboxTestCase, self).setUp()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, "app.db")
+
+
+class SQLiteOutboxTests(OutboxTestCase):
+
+    def test_insert_read_delete(self):
+        box = outbox.SQLiteOutbox(self.path)
+        connection = box.connect()
+        self.addCleanup(connection.close)
+
+        box.insert(connection, [("clicks", b'{"a": 1}'), ("views", b"{}")])
+        connection.commit()
+
+        rows = box.read(connection, 10)
+        self.assert_equal([("clicks", b'{"a": 1}'), ("views", b"{}")], [row[1:] for row in rows])
+        self.assert_equal(2, box.backlog(connection)["depth"])
+        self.assert_equal("wal", connection.execute("PRAGMA journal_mode").fetchone()[0])
+
+        box.delete(connection, [rows[0][0]])
+        self.assert_equal(1, box.backlog(connection)["depth"])
+
+    def test_claimed_rows_are_skipped_until_released_or_expired(self):
+        box = outbox.SQLiteOutbox(self.path)
+        connection = box.connect()
+        self.addCleanup(connection.close)
+        box.insert(connection, [("clicks", b'{"a": 1}'), ("clicks", b'{"a": 2}')])
+        connection.commit()
+
+        first = box.claim(connection, 1, "a")
+        self.assert_equal([("clicks", b'{"a": 1}')], [row[1:] for row in first])
+        second = box.claim(connection, 10, "b", lease=-1)
+        self.assert_equal([("clicks", b'{"a": 2}')], [row[1:] for row in second])
+        # The lease of b has run out already, the one of a hasn't.
+        self.assert_equal([second[0][0]], [row[0] for row in box.claim(connection, 10, "c")])
+
+        box.release(connection, [first[0][0]], "someone else")
+        self.assert_equal([], box.claim(connection, 10, "d"))
+        box.release(connection, [first[0][0]], "a")
+        self.assert_equal([first[0][0]], [row[0] for row in box.claim(connection, 10, "d")])
+
+    def test_old_tables_get_the_claim_columns(self):
+        connection = sqlite3.connect(self.path)
+        connection.execute("CREATE TABLE keen_outbox (id INTEGER PRIMARY KEY AUTOINCREMENT, collection TEXT NOT NULL, "
+                           "event BLOB NOT NULL, created REAL NOT NULL)")
+        connection.execute("INSERT INTO keen_outbox (collection, event, created) VALUES ('clicks', X'7B7D', 0)")
+        connection.commit()
+        connection.close()
+
+        box = outbox.SQLiteOutbox(self.path)
+        connection = box.connect()
+        self.addCleanup(connection.close)
+        self.assert_equal(1, len(box.claim(connection, 10, "a")))
+
+    def test_group_commit(self):
+        box = outbox.SQLiteOutbox(self.path)
+        committer = outbox.GroupCommitter(box, commit_interval=0.05)
+        threads = [threading.Thread(target=committer.submit, args=([("clicks", b"{}")],)) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        committer.stop()
+
+        connection = box.connect()
+        self.addCleanup(connection.close)
+        self.assert_equal(20, box.backlog(connection)["depth"])
+        self.assert_true(committer.commits < 20)
+
+
+class OutboxPersistenceStrategyTests(OutboxTestCase):
+
+    def setUp(self):
+        super(OutboxPersistenceStrategyTests, self).setUp()
+        patcher = patch.object(outbox.OutboxDrainer, "start")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.api = Mock()
+        self.strategy = OutboxPersistenceStrategy(self.api, self.path, commit_interval=0)
+        self.addCleanup(self.strategy.committer.stop)
+        self.client = KeenClient("5004ded1163d66114f000000", write_key="abc", persistence_strategy=self.strategy)
+
+    def test_events_are_uploaded_then_deleted(self):
+        self.client.add_event("clicks", {"a": 1})
+        self.client.add_events({"views": [b'{"b": 2}']})
+        self.assert_equal(2, self.strategy.backlog()["depth"])
+
+        report = self.client.flush()
+
+        self.assert_equal(2, report.flushed)
+        self.assert_equal({"clicks": [b'{"a": 1}'], "views": [b'{"b": 2}']}, self.api.post_events.call_args[0][0])
+        self.assert_equal({"depth": 0, "age": 0.0}, self.strategy.backlog())
+
+    def test_failed_upload_keeps_rows(self):
+        self.api.post_events.side_effect = IOError("down")
+        self.client.add_event("clicks", {"a": 1})
+
+        report = self.client.flush()
+
+        self.assert_equal(0, report.flushed)
+        self.assert_equal(1, report.spilled)
+        stats = self.strategy.stats()
+        self.assert_equal(1, stats["depth"])
+        self.assert_true(stats["age"] >= 0)
+        self.assert_equal(1, stats["upload_failures"])
+
+    def test_transaction(self):
+        connection = self.strategy.outbox.connect()
+        self.addCleanup(connection.close)
+        connection.execute("CREATE TABLE orders (id INTEGER)")
+
+        with self.strategy.transaction(connection):
+            connection.execute("INSERT INTO orders VALUES (1)")
+            self.client.add_event("orders", {"id": 1})
+
+        try:
+            with self.strategy.transaction(connection):
+                connection.execute("INSERT INTO orders VALUES (2)")
+                self.client.add_event("orders", {"id": 2})
+                raise RuntimeError()
+        except RuntimeError:
+            pass
+
+        self.assert_equal([(1,)], connection.execute("SELECT id FROM orders").fetchall())
+        self.assert_equal(1, self.strategy.backlog()["depth"])
+        self.assert_equal(0, self.strategy.committer.commits)
+
+    def test_processes_sharing_a_database_upload_each_row_once(self):
+        other = OutboxPersistenceStrategy(Mock(), self.path, commit_interval=0)
+        self.addCleanup(other.committer.stop)
+        self.client.add_events({"clicks": [{"i": i} for i in range(10)]})
+        self.strategy.drainer.batch_size = other.drainer.batch_size = 1
+
+        threads = [threading.Thread(target=strategy.flush) for strategy in (self.strategy, other)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assert_equal(10, self.api.post_events.call_count + other.api.post_events.call_count)
+        self.assert_equal(0, self.strategy.backlog()["depth"])
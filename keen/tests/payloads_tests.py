@@ -0,0 +1,94 @@
+import gzip
+import io
+import json
+
+from mock import patch
+
+from keen import compression, payloads
+from keen.client import KeenClient
+from keen.tests.base_test_case import BaseTestCase
+from keen.tests.client_tests import MockedResponse
+
+
+class BatchPayloadBuilderTests(BaseTestCase):
+
+    def test_splices_serialized_events(self):
+        builder = payloads.BatchPayloadBuilder()
+        builder.add("clicks", b'{"a": 1}')
+        builder.add("views", u'{"b": "\u00e9"}')
+        builder.add("clicks", {"c": 3})
+        builder.add("clicks", memoryview(b'{"d": 4}'))
+
+        self.assert_equal(4, len(builder))
+        body = json.loads(builder.build().decode("utf-8"))
+        self.assert_equal({"clicks": [{"a": 1}, {"c": 3}, {"d": 4}], "views": [{"b": u"\u00e9"}]}, body)
+
+    def test_reset(self):
+        builder = payloads.BatchPayloadBuilder()
+        builder.add("clicks", b'{"long": "' + b"x" * 100 + b'"}')
+        builder.reset()
+
+        builder.add("clicks", b"{}")
+        self.assert_equal(b'{"clicks":[{}]}', builder.build())
+        builder.reset()
+
+        self.assert_equal(b"{}", builder.build())
+
+    def test_contains_serialized(self):
+        self.assert_false(payloads.contains_serialized({"clicks": [{}]}))
+        self.assert_true(payloads.contains_serialized({"clicks": [{}, "{}"]}))
+
+
+class PayloadChunkTests(BaseTestCase):
+
+    def test_iter_payload_chunks_is_lazy(self):
+        pulled = []
+
+        def clicks():
+            for i in range(100):
+                pulled.append(i)
+                yield {"i": i}
+
+        chunks = payloads.iter_payload_chunks({"clicks": clicks(), "views": iter([b'{"v": 1}'])}, chunk_size=64)
+        first = next(chunks)
+        self.assert_true(len(first) >= 64)
+        self.assert_true(len(pulled) < 100)
+
+        body = json.loads((first + b"".join(chunks)).decode("utf-8"))
+        self.assert_equal(100, len(body["clicks"]))
+        self.assert_equal([{"v": 1}], body["views"])
+
+    def test_iter_encoded_body_gzip(self):
+        stats = compression.CompressionStats()
+        chunks = [b'{"clicks":[', b'{"a": 1}', b"]}"]
+
+        body = b"".join(compression.iter_encoded_body(iter(chunks), compression.GZIP, stats))
+
+        self.assert_equal(b"".join(chunks), gzip.GzipFile(fileobj=io.BytesIO(body)).read())
+        self.assert_equal(len(b"".join(chunks)), stats.raw_bytes)
+        self.assert_equal(len(body), stats.sent_bytes)
+
+
+@patch("requests.Session.post")
+class SerializedUploadTests(BaseTestCase):
+
+    def test_post_events_with_serialized_events(self, post):
+        post.return_value = MockedResponse(status_code=200, json_response={"clicks": [{"success": True}] * 2})
+        client = KeenClient("5004ded1163d66114f000000", write_key="abc")
+
+        client.add_events({"clicks": [b'{"from": "queue"}', {"from": "dict"}]})
+
+        data = post.call_args[1]["data"]
+        self.assert_true(isinstance(data, bytes))
+        self.assert_equal({"clicks": [{"from": "queue"}, {"from": "dict"}]}, json.loads(data.decode("utf-8")))
+
+    def test_add_events_chunked(self, post):
+        post.return_value = MockedResponse(status_code=200, json_response={"clicks": [{"success": True}] * 3})
+        client = KeenClient("5004ded1163d66114f000000", write_key="abc")
+
+        response = client.add_events_chunked({"clicks": ({"i": i} for i in range(3))}, chunk_size=8)
+
+        data = post.call_args[1]["data"]
+        self.assert_false(isinstance(data, bytes))
+        self.assert_equal({"clicks": [{"i": 0}, {"i": 1}, {"i": 2}]}, json.loads(b"".join(data).decode("utf-8")))
+        self.assert_equal(3, len(response["clicks"]))
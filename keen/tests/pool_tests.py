@@ -0,0 +1,86 @@
+from mock import patch
+
+from keen import forking
+from keen.api import KeenApi
+from keen.persistence_strategies import BufferedPersistenceStrategy, DirectPersistenceStrategy
+from keen.pool import KeenClientPool, PooledPersistenceStrategy
+from keen.tests.base_test_case import BaseTestCase
+
+
+class KeenClientPoolTests(BaseTestCase):
+
+    def setUp(self):
+        super(KeenClientPoolTests, self).setUp()
+        patcher = patch.object(BufferedPersistenceStrategy, "_ensure_worker")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.pool = KeenClientPool(pool_maxsize=20)
+
+    def test_clients_are_reused_and_share_a_session(self):
+        first = self.pool.client("5004ded1163d66114f000000", write_key="a")
+        second = self.pool.client("5004ded1163d66114f000001", write_key="b")
+
+        self.assert_true(self.pool.client("5004ded1163d66114f000000", write_key="a") is first)
+        self.assert_true(first.api.session is second.api.session)
+        self.assert_equal(20, first.api.session.get_adapter("https://api.keen.io")._pool_maxsize)
+        other = self.pool.client("5004ded1163d66114f000000", write_key="a", base_url="https://keen.example.com")
+        self.assert_false(other.api.session is first.api.session)
+        self.assert_true(isinstance(first.persistence_strategy, PooledPersistenceStrategy))
+
+    def test_writes_are_batched_per_project_and_key(self):
+        first = self.pool.client("5004ded1163d66114f000000", write_key="a")
+        second = self.pool.client("5004ded1163d66114f000001", write_key="b")
+
+        with patch.object(KeenApi, "post_events", autospec=True) as post_events:
+            first.add_event("clicks", {"a": 1})
+            second.add_events({"views": [{"b": 1}, {"b": 2}]})
+            first.add_events({"clicks": [{"a": 2}]})
+            self.pool.strategy._upload_batch()
+
+        uploads = dict((call[0][0].project_id, call[0][1]) for call in post_events.call_args_list)
+        self.assert_equal(2, post_events.call_count)
+        self.assert_equal([b'{"a": 1}', b'{"a": 2}'], uploads["5004ded1163d66114f000000"]["clicks"])
+        self.assert_equal(2, len(uploads["5004ded1163d66114f000001"]["views"]))
+        self.assert_equal({"5004ded1163d66114f000000": {"queued": 2, "uploaded": 2, "failed": 0},
+                           "5004ded1163d66114f000001": {"queued": 2, "uploaded": 2, "failed": 0}},
+                          self.pool.stats())
+
+    def test_failures_are_counted_per_project(self):
+        self.pool.strategy.max_retries = 0
+        client = self.pool.client("5004ded1163d66114f000000", write_key="a")
+
+        with patch.object(KeenApi, "post_events", side_effect=IOError("down")):
+            client.add_event("clicks", {"a": 1})
+            report = client.flush()
+
+        self.assert_equal(1, report.lost)
+        self.assert_equal(1, self.pool.stats()["5004ded1163d66114f000000"]["failed"])
+
+    def test_unbuffered_pool(self):
+        pool = KeenClientPool(buffered=False)
+
+        client = pool.client("5004ded1163d66114f000000", write_key="a")
+
+        self.assert_true(isinstance(client.persistence_strategy, DirectPersistenceStrategy))
+        self.assert_equal({}, pool.stats())
+
+    def test_fork_replaces_shared_sessions(self):
+        first = self.pool.client("5004ded1163d66114f000000", write_key="a")
+        second = self.pool.client("5004ded1163d66114f000001", write_key="b")
+        session = first.api.session
+
+        forking._after_fork()
+
+        self.assert_false(first.api.session is session)
+        self.assert_true(first.api.session is second.api.session)
+
+    def test_api_keeps_a_session_it_does_not_own(self):
+        own = KeenApi("5004ded1163d66114f000000", write_key="a")
+        shared = KeenApi("5004ded1163d66114f000000", write_key="a", session=self.pool._session(KeenApi.base_url))
+        own_session, shared_session = own.session, shared.session
+
+        own._after_fork()
+        shared._after_fork()
+
+        self.assert_false(own.session is own_session)
+        self.assert_true(shared.session is shared_session)
@@ -0,0 +1,93 @@
+import json
+import os
+import shutil
+import socket
+import tempfile
+
+from mock import Mock, patch
+from six.moves.urllib.request import urlopen
+
+from keen import relay
+from keen.client import KeenClient
+from keen.persistence_strategies import BufferedPersistenceStrategy, RelayPersistenceStrategy
+from keen.tests.base_test_case import BaseTestCase
+
+
+class FrameTests(BaseTestCase):
+
+    def test_round_trip(self):
+        frame = relay.encode_frame(u"caf\u00e9", b'{"a": [1, "]"]}')
+
+        self.assert_equal((u"caf\u00e9", b'{"a": [1, "]"]}'), relay.parse_frame(frame))
+        self.assert_equal(("clicks", b"{}"), relay.parse_frame(b' [ "clicks" , {} ] '))
+
+    def test_invalid_frames(self):
+        for frame in (b'{"a": 1}', b'["clicks"]', b'[1, {}]', b'["clicks", [1]]', b'["clicks, {}]', b"\xff"):
+            self.assert_raises(ValueError, relay.parse_frame, frame)
+
+    def test_parse_address(self):
+        self.assert_equal((socket.AF_INET, ("127.0.0.1", 8126)), relay.parse_address("udp://127.0.0.1:8126"))
+        self.assert_equal("/tmp/keen.sock", relay.parse_address("unix:///tmp/keen.sock")[1])
+        self.assert_raises(ValueError, relay.parse_address, "tcp://127.0.0.1:8126")
+
+
+class RelayTests(BaseTestCase):
+
+    def setUp(self):
+        super(RelayTests, self).setUp()
+        patcher = patch.object(BufferedPersistenceStrategy, "_ensure_worker")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.api = Mock()
+
+    def start_server(self, address, **kwargs):
+        server = relay.RelayServer(address, BufferedPersistenceStrategy(self.api), **kwargs)
+        self.addCleanup(server.close, 0)
+        return server
+
+    def test_udp_relay(self):
+        server = self.start_server("udp://127.0.0.1:0")
+        port = server.socket.getsockname()[1]
+        strategy = RelayPersistenceStrategy("udp://127.0.0.1:{0}".format(port), max_datagram_size=32)
+        client = KeenClient("5004ded1163d66114f000000", write_key="abc", persistence_strategy=strategy)
+
+        client.add_event("clicks", {"a": 1})
+        self.assert_equal(3, client.add_events({"views": [{"b": i} for i in range(3)]}))
+        # One datagram per frame at this size.
+        for _ in range(4):
+            server.handle(server.socket.recv(65536))
+        server.strategy._upload_batch()
+
+        events = self.api.post_events.call_args[0][0]
+        self.assert_equal([{"a": 1}], [json.loads(e.decode("utf-8")) for e in events["clicks"]])
+        self.assert_equal(3, len(events["views"]))
+        self.assert_equal(4, strategy.sent)
+        self.assert_equal(4, server.stats()["received"])
+
+    def test_unix_relay_and_stats(self):
+        if not hasattr(socket, "AF_UNIX"):
+            return
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        address = "unix://" + os.path.join(directory, "relay.sock")
+        server = self.start_server(address, stats_port=0)
+        strategy = RelayPersistenceStrategy(address)
+
+        strategy.batch_persist({"clicks": [b"{}"]})
+        server.handle(server.socket.recv(65536) + b"\nnot a frame\n")
+        server._stop.set()
+        server.serve_forever()
+
+        port = server._stats_server.server_address[1]
+        stats = json.loads(urlopen("http://127.0.0.1:{0}/".format(port)).read().decode("utf-8"))
+        self.assert_equal(1, stats["received"])
+        self.assert_equal(1, stats["invalid"])
+        self.assert_equal(1, stats["depth"])
+
+    def test_unreachable_relay_drops(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        strategy = RelayPersistenceStrategy("unix://" + os.path.join(directory, "missing.sock"))
+
+        self.assert_equal(0, strategy.batch_persist({"clicks": [{}, {}]}))
+        self.assert_equal(2, strategy.dropped)
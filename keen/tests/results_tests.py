@@ -0,0 +1,106 @@
+from mock import patch
+
+import keen
+from keen.client import KeenClient
+from keen.results import ColumnarResult
+from keen.tests.base_test_case import BaseTestCase
+from keen.tests.client_tests import MockedResponse
+
+
+class ColumnarResultTests(BaseTestCase):
+
+    INTERVAL_GROUP_BY_RESULT = [
+        {"timeframe": {"start": "2020-01-01T00:00:00.000Z", "end": "2020-01-02T00:00:00.000Z"},
+         "value": [{"browser": "firefox", "result": 3}, {"browser": "chrome", "result": 5}]},
+        {"timeframe": {"start": "2020-01-02T00:00:00.000Z", "end": "2020-01-03T00:00:00.000Z"},
+         "value": [{"browser": "chrome", "result": 7}, {"browser": "safari", "result": 1}]},
+    ]
+
+    def test_interval_group_by(self):
+        result = ColumnarResult.from_result(self.INTERVAL_GROUP_BY_RESULT)
+
+        self.assert_equal(("browser",), result.group_by)
+        self.assert_equal(["firefox", "chrome", "safari"], result.keys)
+        self.assert_equal(2, result.interval_count)
+        self.assert_equal(5, result.value("chrome", 0))
+        self.assert_equal(None, result.value("safari", 0))
+        self.assert_equal([3, None], result.series("firefox"))
+        self.assert_equal({"firefox": 3, "chrome": 12, "safari": 1}, result.totals())
+        self.assert_equal([("chrome", 12), ("firefox", 3)], result.top(2))
+        self.assert_equal([("chrome", 7)], result.top(1, interval=1))
+        self.assert_equal({"firefox": [3, None], "chrome": [5, 7], "safari": [None, 1]}, result.pivot())
+
+    def test_round_trip(self):
+        result = ColumnarResult.from_result(self.INTERVAL_GROUP_BY_RESULT)
+        records = result.to_records()
+
+        self.assert_equal(self.INTERVAL_GROUP_BY_RESULT[0]["timeframe"], records[0]["timeframe"])
+        self.assert_equal(
+            sorted(group["browser"] for group in self.INTERVAL_GROUP_BY_RESULT[1]["value"]),
+            sorted(group["browser"] for group in records[1]["value"])
+        )
+        self.assert_true(isinstance(records[0]["value"][0]["result"], int))
+
+        result = ColumnarResult.from_result([{"timeframe": {"start": "a", "end": "b"}, "value": 2.5}])
+        self.assert_equal([{"timeframe": {"start": "a", "end": "b"}, "value": 2.5}], result.to_records())
+
+    def test_multi_group_by(self):
+        result = ColumnarResult.from_result(
+            [{"browser": "chrome", "os": "linux", "result": 2}, {"browser": "chrome", "os": "mac", "result": 4}],
+            group_by='["browser", "os"]'
+        )
+
+        self.assert_equal(("browser", "os"), result.group_by)
+        self.assert_equal(4, result.value(("chrome", "mac")))
+        self.assert_true(("chrome", "linux") in result)
+
+    def test_interval_without_group_by(self):
+        result = ColumnarResult.from_result([
+            {"timeframe": {"start": "a", "end": "b"}, "value": 1},
+            {"timeframe": {"start": "b", "end": "c"}, "value": None},
+        ])
+
+        self.assert_equal((), result.group_by)
+        self.assert_equal([1, None], result.series())
+
+    def test_empty_results(self):
+        result = ColumnarResult.from_result([])
+        self.assert_true(result.has_interval)
+        self.assert_false(result.grouped)
+        self.assert_equal([], result.series())
+        self.assert_equal([], result.to_records())
+
+        result = ColumnarResult.from_result([], group_by="browser")
+        self.assert_false(result.has_interval)
+        self.assert_true(result.grouped)
+        self.assert_equal([], result.to_records())
+
+        result = ColumnarResult.from_result([], group_by="browser", interval="daily")
+        self.assert_true(result.has_interval)
+        self.assert_equal([], result.to_records())
+
+        empty_groups = [{"timeframe": {"start": "a", "end": "b"}, "value": []}]
+        result = ColumnarResult.from_result(empty_groups)
+        self.assert_true(result.grouped)
+        self.assert_equal(empty_groups, result.to_records())
+
+    def test_non_numeric_result(self):
+        self.assert_raises(ValueError, ColumnarResult.from_result, 5)
+        self.assert_raises(ValueError, ColumnarResult.from_result, [{"browser": "chrome", "result": ["a"]}])
+
+
+@patch("requests.Session.get")
+class ColumnarClientTests(BaseTestCase):
+
+    def test_columnar_results(self, get):
+        get.return_value = MockedResponse(status_code=200, json_response={
+            "result": [{"browser": "chrome", "result": 2}]
+        })
+        client = KeenClient("5004ded1163d66114f000000", read_key="abc", columnar_results=True)
+
+        result = client.count("purchases", group_by="browser")
+        self.assert_true(isinstance(result, ColumnarResult))
+        self.assert_equal(2, result.value("chrome"))
+
+        result = client.select_unique("purchases", "browser", group_by="browser")
+        self.assert_equal([{"browser": "chrome", "result": 2}], result)
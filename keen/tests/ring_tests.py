@@ -0,0 +1,122 @@
+import os
+import shutil
+import tempfile
+
+from mock import Mock
+
+from keen import ring
+from keen.client import KeenClient
+from keen.persistence_strategies import RingPersistenceStrategy
+from keen.spool import DiskSpool
+from keen.tests.base_test_case import BaseTestCase
+
+
+class RingTestCase(BaseTestCase):
+
+    def setUp(self):
+        super(RingTestCase, self).setUp()
+        if ring.fcntl is None:
+            self.skipTest("SharedRingBuffer requires fcntl.")
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, "ring")
+
+    def open_ring(self, capacity=1024):
+        event_ring = ring.SharedRingBuffer(self.path, capacity=capacity)
+        self.addCleanup(event_ring.close)
+        return event_ring
+
+
+class SharedRingBufferTests(RingTestCase):
+
+    def test_read_and_commit(self):
+        event_ring = self.open_ring()
+        self.assert_true(event_ring.put("clicks", b'{"a": 1}'))
+        self.assert_true(event_ring.put(u"caf\u00e9", b"{}"))
+
+        items, position = event_ring.read_batch(10)
+        self.assert_equal([("clicks", b'{"a": 1}'), (u"caf\u00e9", b"{}")], items)
+
+        # Nothing is freed until the batch is committed.
+        self.assert_equal(items, event_ring.read_batch(10)[0])
+        event_ring.commit(position)
+        self.assert_equal([], event_ring.read_batch(10)[0])
+        self.assert_equal(0, event_ring.stats()["bytes"])
+
+    def test_full_ring_drops(self):
+        event_ring = self.open_ring(capacity=40)
+        self.assert_true(event_ring.put("clicks", b"x" * 20))
+
+        self.assert_false(event_ring.put("clicks", b"x" * 20))
+        self.assert_equal({"capacity": 40, "bytes": 32, "written": 1, "dropped": 1}, event_ring.stats())
+
+    def test_records_wrap_around(self):
+        event_ring = self.open_ring(capacity=50)
+        for i in range(20):
+            data = '{{"i": {0}}}'.format(i).encode("utf-8")
+            self.assert_true(event_ring.put("clicks", data))
+            items, position = event_ring.read_batch(10)
+            self.assert_equal([("clicks", data)], items)
+            event_ring.commit(position)
+
+    def test_processes_share_the_ring(self):
+        producer = self.open_ring()
+        producer.put("clicks", b"{}")
+
+        consumer = self.open_ring(capacity=4096)
+
+        self.assert_equal(1024, consumer.capacity)
+        self.assert_equal([("clicks", b"{}")], consumer.read_batch(10)[0])
+
+    def test_rejects_other_files(self):
+        with open(self.path, "wb") as f:
+            f.write(b"not a ring" * 10)
+
+        self.assert_raises(ValueError, ring.SharedRingBuffer, self.path)
+
+
+class RingUploaderTests(RingTestCase):
+
+    def test_uploads_and_commits(self):
+        event_ring = self.open_ring()
+        event_ring.put("clicks", b"1")
+        event_ring.put("views", b"2")
+        post = Mock()
+        uploader = ring.RingUploader(event_ring, post)
+
+        self.assert_equal(2, uploader.drain())
+
+        post.assert_called_once_with({"clicks": [b"1"], "views": [b"2"]})
+        self.assert_equal(0, event_ring.stats()["bytes"])
+
+    def test_failed_upload_stays_in_ring(self):
+        event_ring = self.open_ring()
+        event_ring.put("clicks", b"1")
+        uploader = ring.RingUploader(event_ring, Mock(side_effect=IOError("down")))
+
+        self.assert_equal(None, uploader.upload_once())
+        self.assert_equal(1, len(event_ring.read_batch(10)[0]))
+
+    def test_failed_upload_is_spooled(self):
+        event_ring = self.open_ring()
+        event_ring.put("clicks", b"1")
+        spool = DiskSpool(os.path.join(self.directory, "spool"))
+        uploader = ring.RingUploader(event_ring, Mock(side_effect=IOError("down")), spool=spool)
+
+        self.assert_equal(1, uploader.upload_once())
+        self.assert_equal([], event_ring.read_batch(10)[0])
+        self.assert_equal(1, len(spool))
+
+
+class RingPersistenceStrategyTests(RingTestCase):
+
+    def test_client_writes_to_ring(self):
+        strategy = RingPersistenceStrategy(self.open_ring())
+        client = KeenClient("5004ded1163d66114f000000", write_key="abc", persistence_strategy=strategy)
+
+        client.add_event("clicks", {"a": 1})
+        self.assert_equal(2, client.add_events({"views": [{"b": 2}, b'{"c": 3}']}))
+
+        items, _ = strategy.ring.read_batch(10)
+        self.assert_equal(["clicks", "views", "views"], [collection for collection, _ in items])
+        self.assert_equal(b'{"c": 3}', items[2][1])
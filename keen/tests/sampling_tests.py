@@ -0,0 +1,165 @@
+import json
+
+from mock import Mock, patch
+
+from keen import sampling
+from keen.api import KeenApi
+from keen.client import KeenClient
+from keen.results import ColumnarResult
+from keen.persistence_strategies import BasePersistenceStrategy
+from keen.tests.base_test_case import BaseTestCase
+
+
+class ListPersistenceStrategy(BasePersistenceStrategy):
+
+    def __init__(self):
+        self.events = []
+
+    def persist(self, event):
+        self.events.append((event.event_collection, json.loads(event.to_json())))
+
+    def batch_persist(self, events):
+        count = 0
+        for collection, collection_events in events.items():
+            for event in collection_events:
+                if not isinstance(event, dict):
+                    event = json.loads(event)
+                self.events.append((collection, event))
+                count += 1
+        return count
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def every_tenth(event):
+    if not isinstance(event, dict):
+        event = json.loads(event)
+    return 10.0 if event["a"] % 10 == 0 else 0
+
+
+class SamplerTests(BaseTestCase):
+
+    def test_rate_sampler(self):
+        values = iter([0.05, 0.5, 0.09])
+        sampler = sampling.RateSampler(0.1, random=lambda: next(values))
+
+        self.assert_equal([10.0, 0, 10.0], [sampler.sample({}) for _ in range(3)])
+        self.assert_raises(ValueError, sampling.RateSampler, 0)
+
+    def test_key_sampler_is_deterministic(self):
+        sampler = sampling.KeySampler(0.5, "user.id")
+        decisions = [sampler.sample({"user": {"id": i}}) for i in range(200)]
+
+        self.assert_equal(decisions, [sampler.sample(json.dumps({"user": {"id": i}})) for i in range(200)])
+        self.assert_true(60 < len([d for d in decisions if d]) < 140)
+        self.assert_equal(set([0, 2.0]), set(decisions))
+
+    def test_token_bucket_sampler(self):
+        clock = Clock()
+        sampler = sampling.TokenBucketSampler(10, clock=clock)
+        kept = 0
+        weights = 0
+        # 100 events a second for 20 seconds
+        for _ in range(2000):
+            clock.now += 0.01
+            weight = sampler.sample({})
+            if weight:
+                kept += 1
+                weights += weight
+
+        self.assert_true(200 <= kept <= 220)
+        self.assert_true(1800 < weights < 2200)
+        self.assert_true(0.09 < sampler.rate < 0.11)
+
+
+class SamplingTests(BaseTestCase):
+
+    def setUp(self):
+        super(SamplingTests, self).setUp()
+        self.sampler = Mock(rate=0.1)
+        self.sampler.sample.side_effect = every_tenth
+
+    def test_weight_property(self):
+        events = sampling.Sampling({"clicks": self.sampler})
+
+        body = {"a": 0}
+        self.assert_equal({"a": 0, "sample_weight": 10.0}, events.sample("clicks", body))
+        self.assert_equal({"a": 0}, body)
+        self.assert_equal(None, events.sample("clicks", {"a": 1}))
+        self.assert_equal({"a": 1}, events.sample("views", {"a": 1}))
+        self.assert_equal({"clicks": {"seen": 2, "kept": 1, "rate": 0.1}}, events.stats())
+
+    def test_serialized_events(self):
+        self.sampler.sample.side_effect = None
+        self.sampler.sample.return_value = 4
+        events = sampling.Sampling({"clicks": self.sampler}, weight_property="w")
+
+        self.assert_equal({"w": 4, "a": 1}, json.loads(events.sample("clicks", b'{"a": 1}')))
+        self.assert_equal({"w": 4}, json.loads(events.sample("clicks", u" { } ")))
+
+    def test_rescale(self):
+        self.assert_equal(50, sampling.rescale(5, 10))
+        self.assert_equal([{"browser": "x", "result": 30}], sampling.rescale([{"browser": "x", "result": 3}], 10))
+        interval = [{"timeframe": {"start": "a", "end": "b"}, "value": 2}]
+        self.assert_equal([{"timeframe": {"start": "a", "end": "b"}, "value": 20}], sampling.rescale(interval, 10))
+        self.assert_raises(TypeError, sampling.rescale, "3", 10)
+
+    def test_rescale_columnar_result(self):
+        result = ColumnarResult.from_result([{"timeframe": {"start": "a", "end": "b"},
+                                              "value": [{"browser": "x", "result": 3}]}])
+
+        rescaled = sampling.rescale(result, 10)
+        self.assert_equal([30], rescaled.series("x"))
+        self.assert_equal([3], result.series("x"))
+
+
+class ClientSamplingTests(BaseTestCase):
+
+    def setUp(self):
+        super(ClientSamplingTests, self).setUp()
+        self.strategy = ListPersistenceStrategy()
+        sampler = Mock(rate=0.1)
+        sampler.sample.side_effect = every_tenth
+        self.client = KeenClient("5004ded1163d66114f000000", write_key="abc", read_key="def",
+                                 persistence_strategy=self.strategy, sampling={"clicks": sampler})
+
+    def test_add_events_are_sampled(self):
+        for i in range(20):
+            self.client.add_event("clicks", {"a": i})
+        self.assert_equal(3, self.client.add_events({"clicks": [{"a": i} for i in range(20)], "views": [{"a": 1}]}))
+
+        self.assert_equal([0, 10, 0, 10, 1], [event["a"] for _, event in self.strategy.events])
+        self.assert_equal(10.0, self.strategy.events[0][1]["sample_weight"])
+        self.assert_true("sample_weight" not in self.strategy.events[-1][1])
+
+    def test_context_client(self):
+        self.client.with_context({"host": "a"}).add_events({"clicks": [{"a": 0}, {"a": 1}]})
+
+        self.assert_equal([("clicks", {"host": "a", "a": 0, "sample_weight": 10.0})], self.strategy.events)
+
+    def test_query_helpers(self):
+        with patch.object(KeenClient, "sum", return_value=1234) as sum_query:
+            self.assert_equal(1234, self.client.weighted_count("clicks", timeframe="today"))
+        self.assert_equal("sample_weight", sum_query.call_args[0][1])
+
+        self.assert_equal(70.0, self.client.rescale("clicks", 7))
+        self.assert_equal(7, self.client.rescale("views", 7))
+
+    def test_bulk_paths_are_sampled(self):
+        with patch.object(KeenApi, "post_events_payload", return_value={"clicks": []}) as post_payload:
+            self.client.add_events_columnar("clicks", {"a": list(range(20))})
+        events = json.loads(post_payload.call_args[0][0])["clicks"]
+        self.assert_equal([{"sample_weight": 10.0, "a": 0}, {"sample_weight": 10.0, "a": 10}], events)
+
+        with patch.object(KeenApi, "post_events_stream", return_value={}) as post_stream:
+            self.client.add_events_chunked({"clicks": ({"a": i} for i in range(20)), "views": iter([{"a": 1}])})
+        streamed = post_stream.call_args[0][0]
+        self.assert_equal([0, 10], [event["a"] for event in streamed["clicks"]])
+        self.assert_equal([{"a": 1}], list(streamed["views"]))
@@ -0,0 +1,113 @@
+import shutil
+import signal
+import tempfile
+import time
+
+from mock import Mock, patch
+
+from keen import exceptions
+from keen.client import KeenClient
+from keen.persistence_strategies import BufferedPersistenceStrategy, FlushReport
+from keen.shutdown import ShutdownHook
+from keen.spool import DiskSpool
+from keen.tests.base_test_case import BaseTestCase
+
+
+class FlushTests(BaseTestCase):
+
+    def setUp(self):
+        super(FlushTests, self).setUp()
+        patcher = patch.object(BufferedPersistenceStrategy, "_ensure_worker")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_flush_uploads_in_parallel(self):
+        api = Mock()
+        strategy = BufferedPersistenceStrategy(api, batch_size=2, flush_parallelism=3)
+        client = KeenClient("5004ded1163d66114f000000", write_key="abc", persistence_strategy=strategy)
+        client.add_events({"clicks": [{"i": i} for i in range(7)]})
+
+        report = client.flush(timeout=5)
+
+        self.assert_equal({"flushed": 7, "spilled": 0, "lost": 0, "in_flight": 0}, report.to_dict())
+        self.assert_equal(4, api.post_events.call_count)
+        self.assert_equal(0, strategy.buffer.depth)
+
+    def test_failed_flush_is_lost_without_spool(self):
+        api = Mock()
+        api.post_events.side_effect = exceptions.KeenApiError({"message": "down", "error_code": "x"})
+        strategy = BufferedPersistenceStrategy(api, max_retries=0)
+        strategy.batch_persist({"clicks": [{"a": 1}, {"a": 2}]})
+
+        report = strategy.close(timeout=5)
+
+        self.assert_equal(2, report.lost)
+        self.assert_equal(0, report.flushed)
+
+    def test_expired_deadline_spills_the_rest(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        api = Mock()
+        strategy = BufferedPersistenceStrategy(api, spool=DiskSpool(directory))
+        strategy.batch_persist({"clicks": [{"a": 1}, {"a": 2}]})
+
+        report = strategy.flush(timeout=0)
+
+        self.assert_equal(2, report.spilled)
+        self.assert_false(api.post_events.called)
+        self.assert_equal(1, len(strategy.spool))
+
+    def test_direct_strategy_has_nothing_to_flush(self):
+        client = KeenClient("5004ded1163d66114f000000", write_key="abc")
+
+        self.assert_false(client.close())
+
+
+class ShutdownHookTests(BaseTestCase):
+
+    def test_closes_once_and_reports(self):
+        client = Mock()
+        client.close.return_value = FlushReport(flushed=3)
+        on_report = Mock()
+        hook = ShutdownHook(client, timeout=2, on_report=on_report)
+
+        hook()
+        hook()
+
+        client.close.assert_called_once_with(timeout=2)
+        on_report.assert_called_once_with(client.close.return_value)
+
+    @patch("atexit.register")
+    def test_signal_calls_previous_handler(self, register):
+        client = Mock()
+        client.close.return_value = FlushReport()
+        previous = Mock()
+        original = signal.signal(signal.SIGUSR1, previous)
+        self.addCleanup(signal.signal, signal.SIGUSR1, original)
+
+        hook = ShutdownHook(client, on_report=None).install(signals=(signal.SIGUSR1,))
+        register.assert_called_once_with(hook)
+        hook._handle_signal(signal.SIGUSR1, None)
+
+        client.close.assert_called_once_with(timeout=hook.timeout)
+        previous.assert_called_once_with(signal.SIGUSR1, None)
+        hook.uninstall()
+        self.assert_equal(previous, signal.getsignal(signal.SIGUSR1))
+
+    def test_signal_while_the_buffer_lock_is_held(self):
+        # As if SIGTERM interrupted the main thread inside EventBuffer.put().
+        api = Mock()
+        strategy = BufferedPersistenceStrategy(api)
+        with patch.object(BufferedPersistenceStrategy, "_ensure_worker"):
+            strategy.batch_persist({"clicks": [{"a": 1}]})
+        hook = ShutdownHook(KeenClient("5004ded1163d66114f000000", write_key="abc", persistence_strategy=strategy),
+                            timeout=0.1, on_report=None)
+
+        started = time.time()
+        with strategy.buffer._condition:
+            self.assert_equal(None, hook())
+        self.assert_true(time.time() - started < 5)
+
+        # Once the lock is free, the closing thread finishes the flush.
+        hook._thread.join(5)
+        self.assert_equal(1, hook.report.lost + hook.report.flushed)
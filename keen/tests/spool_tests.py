@@ -0,0 +1,216 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from mock import Mock, patch
+
+from keen import exceptions
+from keen.buffer import OverflowPolicy
+from keen.persistence_strategies import BufferedPersistenceStrategy
+from keen.spool import DiskSpool, SpillWriter, SpoolReplayer
+from keen.tests.base_test_case import BaseTestCase
+
+
+class SpoolTestCase(BaseTestCase):
+
+    def setUp(self):
+        super(SpoolTestCase, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+
+class DiskSpoolTests(SpoolTestCase):
+
+    def test_round_trip(self):
+        for compress in (False, True):
+            spool = DiskSpool(self.directory, compress=compress)
+            items = [("clicks", b'{"a": 1}'), (u"caf\u00e9", b'{"text": "two\\nlines"}'), ("views", b"{}")]
+
+            path = spool.write(items)
+
+            self.assert_equal([path], spool.segments())
+            self.assert_equal(items, spool.read(path))
+            spool.remove(path)
+            self.assert_equal([], spool.segments())
+
+    def test_segments_are_ordered_by_age(self):
+        spool = DiskSpool(self.directory)
+        first = spool.write([("clicks", b"1")])
+        second = spool.write([("clicks", b"2")])
+
+        self.assert_equal([first, second], spool.segments())
+        self.assert_equal(2, spool.spilled_events)
+        self.assert_equal(None, spool.write([]))
+
+
+    def test_claimed_segments_are_hidden_until_released(self):
+        spool = DiskSpool(self.directory, compress=True)
+        other = DiskSpool(self.directory)
+        path = spool.write([("clicks", b"1"), ("clicks", b"2")])
+
+        claimed = spool.claim(path)
+
+        self.assert_equal([], other.segments())
+        self.assert_equal(None, other.claim(path))
+        self.assert_equal([("clicks", b"1"), ("clicks", b"2")], spool.read(claimed))
+        spool.release(claimed, [("clicks", b"2")])
+        self.assert_equal([path], other.segments())
+        self.assert_equal([("clicks", b"2")], other.read(path))
+
+    def test_expired_claims_are_released(self):
+        spool = DiskSpool(self.directory)
+        path = spool.write([("clicks", b"1")])
+        claimed = spool.claim(path)
+
+        spool.reclaim(60)
+        self.assert_equal([], spool.segments())
+        os.utime(claimed, (time.time() - 120, time.time() - 120))
+        spool.reclaim(60)
+
+        self.assert_equal([path], spool.segments())
+
+
+class SpillWriterTests(SpoolTestCase):
+
+    def test_background_thread_writes_one_segment(self):
+        spool = DiskSpool(self.directory)
+        writer = SpillWriter(spool, interval=0.05)
+
+        for i in range(100):
+            writer.write([("clicks", b"1")])
+        writer.close()
+
+        self.assert_equal(100, sum(len(spool.read(path)) for path in spool.segments()))
+        self.assert_true(len(spool) <= 2)
+        self.assert_false(writer._thread.is_alive())
+
+    def test_full_writer_writes_on_the_callers_thread(self):
+        spool = DiskSpool(self.directory)
+        writer = SpillWriter(spool, max_pending=3)
+
+        with patch.object(SpillWriter, "_ensure_thread"):
+            writer.write([("clicks", b"1"), ("clicks", b"2")])
+            self.assert_equal(0, len(spool))
+            writer.write([("clicks", b"3")])
+
+        self.assert_equal(1, len(spool))
+        self.assert_equal(0, len(writer))
+
+
+class SpoolReplayerTests(SpoolTestCase):
+
+    def test_replays_oldest_segment(self):
+        spool = DiskSpool(self.directory)
+        spool.write([("clicks", b"1"), ("views", b"2")])
+        spool.write([("clicks", b"3")])
+        post = Mock()
+        replayer = SpoolReplayer(spool, post, max_events_per_second=None)
+
+        self.assert_true(replayer.replay_once())
+
+        post.assert_called_once_with({"clicks": [b"1"], "views": [b"2"]})
+        self.assert_equal(1, len(spool))
+        self.assert_equal(2, replayer.replayed_events)
+
+    def test_partial_failure_keeps_the_rest(self):
+        spool = DiskSpool(self.directory)
+        path = spool.write([("clicks", b"1"), ("clicks", b"2"), ("clicks", b"3")])
+        post = Mock(side_effect=[None, IOError("down")])
+        replayer = SpoolReplayer(spool, post, batch_size=1, max_events_per_second=None)
+
+        self.assert_false(replayer.replay_once())
+
+        self.assert_equal([path], spool.segments())
+        self.assert_equal([("clicks", b"2"), ("clicks", b"3")], spool.read(path))
+        self.assert_equal(1, replayer.failures)
+
+
+    def test_segments_removed_by_another_process_are_skipped(self):
+        spool = DiskSpool(self.directory)
+        gone = spool.write([("clicks", b"1")])
+        spool.write([("clicks", b"2")])
+        segments = spool.segments()
+        os.remove(gone)
+        post = Mock()
+        replayer = SpoolReplayer(spool, post, max_events_per_second=None)
+
+        with patch.object(spool, "segments", return_value=segments):
+            self.assert_true(replayer.replay_once())
+
+        post.assert_called_once_with({"clicks": [b"2"]})
+        self.assert_equal([], os.listdir(self.directory))
+
+    def test_replayers_sharing_a_spool_replay_each_segment_once(self):
+        spools = [DiskSpool(self.directory), DiskSpool(self.directory)]
+        for i in range(20):
+            spools[0].write([("clicks", str(i).encode("ascii"))])
+        post = Mock()
+        replayers = [SpoolReplayer(spool, post, max_events_per_second=None) for spool in spools]
+
+        def replay(replayer):
+            while replayer.spool.segments():
+                replayer.replay_once()
+        threads = [threading.Thread(target=replay, args=(replayer,)) for replayer in replayers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assert_equal(20, post.call_count)
+        self.assert_equal(20, sum(replayer.replayed_events for replayer in replayers))
+
+
+class SpooledPersistenceTests(SpoolTestCase):
+
+    def setUp(self):
+        super(SpooledPersistenceTests, self).setUp()
+        patcher = patch.object(BufferedPersistenceStrategy, "_ensure_worker")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_failed_batch_is_spooled_and_replayed(self):
+        api = Mock()
+        api.post_events.side_effect = exceptions.KeenApiError({"message": "down", "error_code": "x"})
+        spool = DiskSpool(self.directory)
+        strategy = BufferedPersistenceStrategy(api, max_retries=0, spool=spool, replay_events_per_second=None)
+
+        strategy.batch_persist({"clicks": [b'{"a": 1}']})
+        strategy._upload_batch()
+
+        self.assert_equal(1, strategy.stats()["spooled_failures"])
+        self.assert_equal(0, strategy.failed)
+        self.assert_equal(1, len(spool))
+
+        api.post_events.side_effect = None
+        self.assert_true(strategy.replayer.replay_once())
+        api.post_events.assert_called_with({"clicks": [b'{"a": 1}']})
+        self.assert_equal(0, len(spool))
+
+    def test_full_buffer_spills_to_spool(self):
+        spool = DiskSpool(self.directory)
+        strategy = BufferedPersistenceStrategy(Mock(), spool=spool)
+        strategy.buffer.max_events = 1
+
+        self.assert_equal(OverflowPolicy.SPILL, strategy.buffer.overflow_policy)
+        self.assert_equal(1, strategy.batch_persist({"clicks": [{"a": 1}, {"a": 2}]}))
+        strategy.buffer.spill.flush()
+        self.assert_equal(1, len(spool))
+
+    def test_overflowing_events_are_spilled_in_batches(self):
+        spool = DiskSpool(self.directory)
+        strategy = BufferedPersistenceStrategy(Mock(), spool=spool)
+        strategy.buffer.max_events = 1
+        strategy.buffer.spill.interval = 60
+
+        with patch.object(spool, "write", wraps=spool.write) as write:
+            strategy.batch_persist({"clicks": [{"i": i} for i in range(2000)]})
+            self.assert_false(write.called)
+            self.assert_equal(1999, len(strategy.buffer.spill))
+
+            report = strategy.flush(timeout=0)
+
+        self.assert_equal(2, write.call_count)
+        self.assert_equal(2000, sum(len(spool.read(path)) for path in spool.segments()))
+        self.assert_equal(1, report.spilled)
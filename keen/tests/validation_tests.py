@@ -0,0 +1,100 @@
+from mock import Mock, patch
+
+from keen import exceptions, validation
+from keen.client import KeenClient
+from keen.tests.base_test_case import BaseTestCase
+
+
+class EventValidatorTests(BaseTestCase):
+
+    def setUp(self):
+        super(EventValidatorTests, self).setUp()
+        self.validator = validation.EventValidator(max_event_bytes=1000)
+
+    def test_valid_event(self):
+        event = {"a": 1, "nested": {"b": [{"c": u"caf\u00e9"}, None, True]}, "keen": {"timestamp": "x"}}
+
+        self.assert_equal([], self.validator.problems(event))
+        self.assert_equal([], self.validator.problems(b'{"a.b": 1}'))
+
+    def test_invalid_names(self):
+        problems = self.validator.problems({"a.b": 1, "$c": 2, "": 3, "d": [{"x" * 257: 4}], 1.5: 5})
+
+        self.assert_equal(5, len(problems))
+        self.assert_true("property name 'a.b' contains a dot" in problems)
+        self.assert_true("property name '$c' starts with $" in problems)
+
+    def test_names_are_cached(self):
+        self.validator.problems({"a.b": 1, "c": 2})
+
+        with patch("keen.validation.json.dumps") as dumps:
+            self.assert_equal(1, len(self.validator.problems({"a.b": 1, "c": 3})))
+        self.assert_false(dumps.called)
+        self.assert_equal({"a.b": "property name 'a.b' contains a dot", "c": None}, self.validator._names)
+
+    def test_size(self):
+        self.assert_equal([], self.validator.problems({"a": "x" * 900}))
+        self.assert_equal(["the event is 1209 bytes, more than 1000"], self.validator.problems({"a": "x" * 1200}))
+        # Escaped, these are six bytes each.
+        self.assert_equal(1, len(self.validator.problems({"a": u"\u00e9" * 200})))
+        self.assert_equal(1, len(self.validator.problems(b"x" * 1001)))
+
+    def test_check_raises_without_dead_letter(self):
+        self.assert_raises(exceptions.InvalidEventError, self.validator.check, "clicks", {"a.b": 1})
+        self.assert_equal(1, self.validator.invalid)
+
+
+class ClientValidationTests(BaseTestCase):
+
+    def setUp(self):
+        super(ClientValidationTests, self).setUp()
+        self.strategy = Mock()
+        self.dead_letter = Mock()
+        self.client = KeenClient("5004ded1163d66114f000000", write_key="abc",
+                                 validator=validation.EventValidator(on_invalid=self.dead_letter))
+        self.client.persistence_strategy = self.strategy
+
+    def test_invalid_events_go_to_dead_letter(self):
+        self.client.add_event("clicks", {"$a": 1})
+        self.client.add_events({"clicks": [{"a": 1}, {"b.c": 2}]})
+
+        self.assert_false(self.strategy.persist.called)
+        self.assert_equal({"clicks": [{"a": 1}]}, self.strategy.batch_persist.call_args[0][0])
+        self.assert_equal([("clicks", {"$a": 1}, ["property name '$a' starts with $"]),
+                           ("clicks", {"b.c": 2}, ["property name 'b.c' contains a dot"])],
+                          [call[0] for call in self.dead_letter.call_args_list])
+
+    def test_default_validator_raises(self):
+        client = KeenClient("5004ded1163d66114f000000", write_key="abc", validator=True)
+
+        self.assert_raises(exceptions.InvalidEventError, client.add_event, "clicks", {"a.b": 1})
+
+    @patch("requests.Session.post")
+    def test_context_events_are_validated_before_encoding(self, post):
+        client = self.client.with_context({"host": "web-1"})
+
+        client.add_events({"clicks": [{"$bad.name": 1}, {"a": 1}]})
+        client.add_events_stream({"clicks": [{"$c": 1}]})
+
+        self.assert_equal(1, len(self.strategy.batch_persist.call_args[0][0]["clicks"]))
+        self.assert_false(post.called)
+        self.assert_equal([{"$bad.name": 1}, {"$c": 1}], [call[0][1] for call in self.dead_letter.call_args_list])
+
+    @patch("keen.api.KeenApi.post_events_payload")
+    def test_column_names_are_validated_once(self, post_events_payload):
+        self.client.add_events_columnar("clicks", {"a": [1, 2], "user.$id": [3, 4]})
+        self.client.add_events_columnar("clicks", {"a": [1, 2], "user.id": [3, 4]})
+
+        self.assert_equal(1, post_events_payload.call_count)
+        self.assert_equal(["property name '$id' starts with $"], self.dead_letter.call_args[0][2])
+        self.assert_equal(2, self.client.validator.invalid)
+
+    @patch("keen.api.KeenApi.post_events_stream")
+    def test_chunked_events_are_validated(self, post_events_stream):
+        post_events_stream.side_effect = lambda events, chunk_size: dict(
+            (collection, list(collection_events)) for collection, collection_events in events.items())
+
+        response = self.client.add_events_chunked({"clicks": iter([{"a": 1}, {"b.c": 2}])})
+
+        self.assert_equal({"clicks": [{"a": 1}]}, response)
+        self.assert_equal(1, self.dead_letter.call_count)
@@ -0,0 +1,182 @@
+""" Local validation of events against the Keen API's limits, so invalid
+events are caught before an upload instead of coming back as per-event
+errors in its response.
+
+Property names are checked once and remembered, so validating an event
+costs a dict lookup per property. The encoded size is estimated while the
+properties are walked; only events whose estimate comes near the limit are
+encoded to measure them exactly.
+"""
+
+import json
+import numbers
+
+import six
+
+from keen import exceptions, payloads
+
+MAX_PROPERTY_NAME_LENGTH = 256
+MAX_EVENT_BYTES = 900000
+
+# The most property names remembered; events with generated names (ids as
+# keys, ...) would otherwise grow the cache without bound.
+_MAX_CACHED_NAMES = 100000
+
+
+class EventValidator(object):
+    """
+    Checks that events can be accepted by the Keen API: property names must
+    be non-empty strings of at most max_name_length characters without dots
+    that don't start with $, and the encoded event must be at most
+    max_event_bytes long. Serialized events are only checked for size, and
+    columnar batches only for their column names.
+
+    Invalid events are passed to on_invalid if there is one, and raise a
+    keen.exceptions.InvalidEventError otherwise.
+    """
+
+    def __init__(self, on_invalid=None, max_name_length=MAX_PROPERTY_NAME_LENGTH, max_event_bytes=MAX_EVENT_BYTES):
+        """ Initializes an EventValidator.
+
+        :param on_invalid: optional, a dead-letter callable receiving the
+        collection, the event and the list of problems of each invalid event
+        :param max_name_length: the longest property name allowed
+        :param max_event_bytes: the largest encoded event allowed
+        """
+        super(EventValidator, self).__init__()
+        self.on_invalid = on_invalid
+        self.max_name_length = max_name_length
+        self.max_event_bytes = max_event_bytes
+        self.invalid = 0
+        # property name -> its problem, or None if it is valid
+        self._names = {}
+
+    def problems(self, event):
+        """ Returns the list of problems of an event, empty if it is valid.
+
+        :param event: the event body, a dict or JSON bytes/str
+        """
+        if payloads.is_serialized(event):
+            size = len(event.encode("utf-8") if isinstance(event, six.text_type) else event)
+            problems = []
+        else:
+            problems = []
+            size = self._walk(event, problems)
+            if size > self.max_event_bytes // 2:
+                # Characters outside the BMP and long floats can encode to more
+                # than the estimate; measure events that might be too large.
+                size = len(json.dumps(event))
+        if size > self.max_event_bytes:
+            problems.append("the event is {0} bytes, more than {1}".format(size, self.max_event_bytes))
+        return problems
+
+    def check(self, event_collection, event):
+        """ Validates an event.
+
+        :param event_collection: the collection of the event
+        :param event: the event body, a dict or JSON bytes/str
+        :returns: True if the event is valid, False if it was passed to
+        on_invalid
+        :raises InvalidEventError: if the event is invalid and there is no
+        on_invalid
+        """
+        problems = self.problems(event)
+        if not problems:
+            return True
+        self.invalid += 1
+        if self.on_invalid is None:
+            raise exceptions.InvalidEventError(event_collection, problems)
+        self.on_invalid(event_collection, event, problems)
+        return False
+
+    def check_columns(self, event_collection, columns):
+        """ Validates the column names of a columnar batch, once for all of
+        its rows. Dotted names stand for nested properties, so each part is
+        checked. The sizes of the rows aren't checked.
+
+        :param event_collection: the collection of the events
+        :param columns: dict mapping property names to equally long sequences
+        :returns: True if the names are valid, False if the columns were
+        passed to on_invalid
+        :raises InvalidEventError: if a name is invalid and there is no
+        on_invalid
+        """
+        problems = []
+        for name in columns:
+            for part in name.split("."):
+                problem = self._name_problem(part)
+                if problem is not None:
+                    problems.append(problem)
+        if not problems:
+            return True
+        self.invalid += len(next(iter(columns.values())))
+        if self.on_invalid is None:
+            raise exceptions.InvalidEventError(event_collection, problems)
+        self.on_invalid(event_collection, columns, problems)
+        return False
+
+    def filter_events(self, events):
+        """ Validates a dict mapping collection names to lists of events.
+
+        :returns: a new dict with the valid events
+        :raises InvalidEventError: on the first invalid event if there is no
+        on_invalid
+        """
+        check = self.check
+        return dict((collection, [event for event in collection_events if check(collection, event)])
+                    for collection, collection_events in six.iteritems(events))
+
+    def _name_problem(self, name):
+        try:
+            return self._names[name]
+        except KeyError:
+            pass
+        key = name
+        if not isinstance(name, six.string_types):
+            # json.dumps() writes numbers and None as their string forms.
+            name = json.dumps(name)
+        if not name:
+            problem = "property name is empty"
+        elif "." in name:
+            problem = "property name '{0}' contains a dot".format(name)
+        elif name.startswith("$"):
+            problem = "property name '{0}' starts with $".format(name)
+        elif len(name) > self.max_name_length:
+            problem = "property name '{0}...' is longer than {1} characters".format(name[:20], self.max_name_length)
+        else:
+            problem = None
+        if len(self._names) >= _MAX_CACHED_NAMES:
+            self._names.clear()
+        self._names[key] = problem
+        return problem
+
+    def _walk(self, value, problems):
+        """ Checks the property names within value and returns an estimate
+        of its encoded size.
+        """
+        if isinstance(value, dict):
+            size = 2
+            name_problem = self._name_problem
+            for name, item in six.iteritems(value):
+                problem = name_problem(name)
+                if problem is not None:
+                    problems.append(problem)
+                # "name": value,
+                size += (len(name) if isinstance(name, six.string_types) else 8) + 5 + self._walk(item, problems)
+            return size
+        if isinstance(value, six.string_types):
+            length = len(value)
+            if len(value.encode("utf-8") if isinstance(value, six.text_type) else value) != length:
+                # json.dumps() escapes non-ASCII characters as \uXXXX.
+                return length * 6 + 2
+            return length + 2
+        if isinstance(value, (list, tuple)):
+            size = 2
+            for item in value:
+                size += self._walk(item, problems) + 2
+            return size
+        if isinstance(value, bool) or value is None:
+            return 5
+        if isinstance(value, numbers.Number):
+            return 8
+        return len(json.dumps(value, default=str))